@@ -0,0 +1,183 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Compare mirror.cron.CronSchedule with the old get_schedule_time()
+over all sections of config/bjtu.ini.
+
+Usage: python benchmark/cron_schedule.py [config file]
+
+"""
+
+import os, sys
+import time
+import bisect
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from configparser import ConfigParser
+
+import mirror.common
+from mirror.cron import CronSchedule
+
+class LegacySchedule(object):
+    """
+    get_schedule_time() of AbstractTask before mirror.cron was added.
+
+    """
+    TIME_STRUCT  = 1
+    TIME_SECONDS = 2
+
+    def __init__(self, crontime):
+        crontime = mirror.common.parse_cron_time(crontime)
+        self.enabled     = True
+        self.time_minute = crontime[0]
+        self.time_hour   = crontime[1]
+        self.time_dom    = crontime[2]
+        self.time_month  = crontime[3]
+        self.time_dow    = crontime[4]
+
+    def get_schedule_time(self, since, style=TIME_SECONDS):
+        """
+        This method is too long.
+
+        """
+
+        if not hasattr(self, "time_minute"):
+            return None
+        if not self.enabled:
+            return None
+        since_struct  = time.localtime(since)
+
+        minute = since_struct.tm_min
+        hour    = since_struct.tm_hour
+        day     = since_struct.tm_mday
+        month   = since_struct.tm_mon
+        year    = since_struct.tm_year
+
+        day_increase   = False
+        month_increase = False
+        year_increase  = False
+        if since_struct.tm_mon in self.time_month and since_struct.tm_mday in self.time_dom:
+            minute_idx = bisect.bisect(self.time_minute, since_struct.tm_min)
+            if since_struct.tm_hour in self.time_hour and minute_idx < len(self.time_minute):
+                minute = self.time_minute[minute_idx]
+                hour    = since_struct.tm_hour
+            else:
+                minute  = self.time_minute[0]
+                hour_idx = bisect.bisect(self.time_hour, since_struct.tm_hour)
+                if hour_idx < len(self.time_hour):
+                    hour = self.time_hour[hour_idx]
+                else:
+                    hour = self.time_hour[0]
+                    day_increase = True
+            if len(self.time_minute) == 60 and len(self.time_hour) != 24:
+                minute  = self.time_minute[0]
+                hour_idx = bisect.bisect(self.time_hour, since_struct.tm_hour)
+                if hour_idx < len(self.time_hour):
+                    hour = self.time_hour[hour_idx]
+                else:
+                    hour = self.time_hour[0]
+                    day_increase = True
+            if not day_increase:
+                day   = since_struct.tm_mday
+                month = since_struct.tm_mon
+        if since_struct.tm_mday not in self.time_dom or day_increase:
+            minute = self.time_minute[0]
+            hour    = self.time_hour[0]
+            day_idx = bisect.bisect(self.time_dom, since_struct.tm_mday)
+            if day_idx < len(self.time_dom):
+                day = self.time_dom[day_idx]
+            else:
+                day = self.time_dom[0]
+                month_increase = True
+            if not month_increase:
+                month = since_struct.tm_mon
+        if since_struct.tm_mon not in self.time_month or month_increase:
+            minute = self.time_minute[0]
+            hour    = self.time_hour[0]
+            day     = self.time_dom[0]
+            month_idx = bisect.bisect(self.time_month, since_struct.tm_mon)
+            if month_idx < len(self.time_month):
+                month = self.time_month[month_idx]
+            else:
+                month = self.time_month[0]
+                year_increase = True
+        if year_increase:
+            year += 1
+
+        next_time   = time.mktime((year, month, day, hour, minute, 0, 0, 0, 0))
+        next_struct = time.localtime(next_time)
+        if (next_struct.tm_wday + 1) not in self.time_dow:
+            from datetime import datetime, timedelta
+            wday_idx = bisect.bisect(self.time_dow, next_struct.tm_wday)
+            if wday_idx < len(self.time_dow):
+                wdays = self.time_dow[wday_idx] - next_struct.tm_wday
+            else:
+                wdays = (7 - self.time_dow[-1]) + self.time_dow[0]
+            delta = timedelta(days = wdays)
+            next_time = time.mktime((datetime.fromtimestamp(next_time) + delta).timetuple())
+
+        if style == self.TIME_SECONDS:
+            return next_time
+        else:
+            return time.localtime(next_time)
+
+def timeit(func, sinces):
+    start = time.perf_counter()
+    for since in sinces:
+        func(since)
+    return (time.perf_counter() - start) / len(sinces) * 1e6
+
+def main():
+    path = (sys.argv[1] if len(sys.argv) > 1 else
+            os.path.join(os.path.dirname(__file__), os.pardir, "config", "bjtu.ini"))
+    config = ConfigParser()
+    config.read(path)
+    sections = [section for section in config.sections() if section != "general"]
+
+    now = int(time.time())
+    # one call every 7 minutes during 30 days, and
+    # 100 calls in the same minute (a scheduler wake-up)
+    sinces = [now + i * 420 for i in range(30 * 24 * 60 // 7)]
+    burst  = [now - now % 60 + i * 0.5 for i in range(100)]
+
+    legacy_total = compiled_total = cached_total = 0.0
+    for section in sections:
+        crontime = config[section]["time"]
+        legacy   = LegacySchedule(crontime)
+        compiled = CronSchedule.parse(crontime)
+        for since in sinces:
+            expected = legacy.get_schedule_time(since)
+            if compiled.next_after(since) != expected:
+                print("Mismatch for %s (%s) since %s" % (section, crontime, time.ctime(since)))
+                return 1
+        legacy_total   += timeit(legacy.get_schedule_time, sinces)
+        compiled_total += timeit(compiled._next_after, sinces)
+        cached_total   += timeit(compiled.next_after, burst)
+
+    print("%d sections of %s, results are identical" % (len(sections), os.path.basename(path)))
+    print("get_schedule_time() (old):        %8.2f us/call" % (legacy_total   / len(sections)))
+    print("CronSchedule.next_after():        %8.2f us/call" % (compiled_total / len(sections)))
+    print("CronSchedule.next_after() cached: %8.2f us/call" % (cached_total   / len(sections)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
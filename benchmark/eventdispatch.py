@@ -0,0 +1,151 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Compare the old polling PluginThread with mirror.pluginthread.PluginThread:
+
+    * latency from emit() to handler, with 10k events per second
+    * time to dispatch a burst of 50k events
+
+`block` is the same as `condition`, but emit() waits for room when
+the queue of the executor of handlers is full.
+
+Usage: python benchmark/eventdispatch.py
+
+"""
+
+import os, sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import mirror.component as component
+from mirror.eventmanager import EventManager
+from mirror.event        import TaskEnqueueEvent, TaskStartEvent
+
+class LegacyPluginThread(threading.Thread):
+    """
+    PluginThread of mirror.pluginthread before it waits on a condition.
+
+    """
+    def __init__(self, event_manager):
+        threading.Thread.__init__(self, name="mirror.plugin")
+        self.event_queue   = [ ]
+        self.event_manager = event_manager
+        self.stop_event    = threading.Event()
+
+    def add_event(self, event):
+        self.event_queue.append(event)
+
+    def run(self):
+        sleep_count = 0
+        while (True):
+            if self.stop_event.is_set() and len(self.event_queue) == 0:
+                break
+            try:
+                event = self.event_queue.pop(0)
+            except:
+                time.sleep(0.1)
+                sleep_count += 1
+                if sleep_count > 600:
+                    break
+                else:
+                    continue
+            for handler in self.event_manager.handlers[event.name]:
+                try:
+                    handler(*event.args)
+                except Exception as e:
+                    pass
+
+class LegacyEventManager(EventManager):
+    def emit(self, event):
+        if event.name not in self.handlers:
+            return
+        if (not self.plugin_thread) or (not self.plugin_thread.is_alive()):
+            self.plugin_thread = LegacyPluginThread(self)
+            self.plugin_thread.start()
+        self.plugin_thread.add_event(event)
+
+    def drain(self, timeout = None):
+        while self.plugin_thread.event_queue:
+            time.sleep(0.001)
+        return True
+
+    def stop(self):
+        if self.plugin_thread and self.plugin_thread.is_alive():
+            self.plugin_thread.stop_event.set()
+            self.plugin_thread.join()
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100.0), len(values) - 1)]
+
+def run(manager_class, rate, seconds, burst, **options):
+    manager   = manager_class()
+    # handlers are plain functions, so they run in the default executor
+    manager.set_executor(manager.DEFAULT_EXECUTOR, **options)
+    latencies = []
+    handled   = []
+    manager.register_event_handler("TaskEnqueueEvent",
+        lambda emitted: latencies.append(time.perf_counter() - emitted))
+    manager.register_event_handler("TaskStartEvent",
+        lambda taskname, pid: handled.append(pid))
+
+    # paced events, emitted like a busy scheduler
+    interval = 1.0 / rate
+    start    = time.perf_counter()
+    for i in range(int(rate * seconds)):
+        deadline = start + i * interval
+        while time.perf_counter() < deadline:
+            pass
+        manager.emit(TaskEnqueueEvent(time.perf_counter()))
+    manager.drain()
+
+    # a burst, the queue grows before the thread catches up
+    start = time.perf_counter()
+    for i in range(burst):
+        manager.emit(TaskStartEvent("burst", i))
+    while len(handled) < burst:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    # this stops its plugin thread
+    component.deregister(manager)
+    return latencies, elapsed
+
+def main():
+    rate, seconds, burst = 10000, 2, 50000
+    print("%d events/s for %d s, then a burst of %d events" % (rate, seconds, burst))
+    print("%10s %12s %12s %12s %12s" % ("", "p50 (ms)", "p99 (ms)", "max (ms)", "burst (s)"))
+    # the polling queue is unbounded, so is the executor's queue
+    # unless `block` makes emit() wait for room
+    for name, manager_class, options in (
+            ("polling",   LegacyEventManager, {}),
+            ("condition", EventManager,       { "queuesize": 0 }),
+            ("block",     EventManager,       { "queuesize": 1000, "overflow": "block" })):
+        latencies, elapsed = run(manager_class, rate, seconds, burst, **options)
+        print("%10s %12.3f %12.3f %12.3f %12.3f" % (name,
+              percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+              max(latencies) * 1000, elapsed))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Compare the latency of starting a task with the fork and spawn launchers
+(see mirror.task.AbstractTask.execute()) while the heap of this process
+grows, like a long running mirrord with many tasks and plugins.
+
+The latency is the time spent in the parent, i.e. how long the
+scheduler is blocked by starting a task.
+
+Usage: python benchmark/launcher.py [rounds]
+
+"""
+
+import os, sys
+import time
+import shutil
+import tempfile
+import weakref
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from mirror.task import SimpleTask, LAUNCHER_FORK, LAUNCHER_SPAWN
+
+class FakeScheduler(object):
+    def __init__(self, logdir):
+        self.logdir   = logdir
+        self.launcher = LAUNCHER_FORK
+
+def measure(task, rounds):
+    """
+    :returns: the median seconds of task.run()
+
+    """
+    elapsed = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        task.run()
+        elapsed.append(time.perf_counter() - start)
+        if not task.running:
+            raise RuntimeError("Unable to start task")
+        os.waitpid(task.pid, 0)
+        task.set_stop_flag()
+    elapsed.sort()
+    return elapsed[len(elapsed) // 2]
+
+def main():
+    rounds    = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    logdir    = tempfile.mkdtemp() + os.path.sep
+    scheduler = FakeScheduler(logdir)
+    tasks     = {}
+    for launcher in (LAUNCHER_FORK, LAUNCHER_SPAWN):
+        tasks[launcher] = SimpleTask(launcher, weakref.ref(scheduler),
+                                     time = "* * * * *", priority = "1",
+                                     command = "true", twostage = "0",
+                                     timeout = "0", launcher = launcher)
+    heap = []
+    try:
+        print("%10s %12s %12s %8s" % ("heap (MB)", "fork (ms)", "spawn (ms)", "speedup"))
+        for size in (0, 64, 256, 1024):
+            while len(heap) < size:
+                # touch every page, so they are really mapped
+                heap.append(bytearray(b"x" * (1 << 20)))
+            fork  = measure(tasks[LAUNCHER_FORK],  rounds)
+            spawn = measure(tasks[LAUNCHER_SPAWN], rounds)
+            print("%10d %12.3f %12.3f %7.1fx" % (size, fork * 1000, spawn * 1000,
+                                                 fork / spawn))
+    finally:
+        shutil.rmtree(logdir)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Measure memory used by tasks, their queue entries and events,
+as a mirrord with tens of thousands of sections.
+
+Config sections are loaded before measuring, as ConfigManager keeps
+them anyway, so only memory of tasks built from them is counted.
+
+Every class with __slots__ is also measured as a copy without them,
+i.e. its instances keep their attributes in a __dict__.
+
+Usage: python benchmark/memory.py [tasks]
+
+"""
+
+import os, sys
+import gc
+import tempfile
+import contextlib
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import mirror.task
+import mirror.queue
+import mirror.event
+from mirror.queue import Queue
+from mirror.task  import REGULAR_TASK
+
+TIMES = ("* */2 * * *", "*/20 * * * *", "0 3 * * *", "30 */4 * * *")
+
+# classes with __slots__ used by tasks, queue entries and events,
+# by the modules they are looked up in
+SLOTTED = ((mirror.task,  ("Task", "SimpleTask", "CronSchedule", "Stage")),
+           (mirror.queue, ("TaskInfo",)),
+           (mirror.event, ("TaskStartEvent", "TaskStopEvent")))
+
+def rss():
+    with open("/proc/self/statm") as fp:
+        return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def make_sections(count, localdir):
+    """
+    Like sections of mirror.ini loaded by ConfigParser,
+    every value is a string of its own.
+
+    """
+    sections = {}
+    for i in range(count):
+        name = "mirror%05d" % i
+        if i % 4 == 0:
+            sections[name] = { "type": "simple", "command": "sh",
+                               "time": TIMES[i % len(TIMES)], "priority": str(i % 10 + 1),
+                               "args": "-c 'exit 0'", "twostage": "0", "timeout": "0",
+                               "autoretry": "10m" }
+        else:
+            sections[name] = { "command": "sh", "upstream[]": ["mirror.example.org"],
+                               "rsyncdir": name + "/", "localdir": localdir,
+                               "time": TIMES[i % len(TIMES)], "priority": str(i % 10 + 1),
+                               "exclude": "--exclude .~tmp~/",
+                               "args": "--links --hard-links --times --verbose --delete --recursive",
+                               "twostage": "0", "timeout": "2h" }
+    # the keys of every section are parsed from text too
+    return dict(("".join(name), dict(("".join(key), value) for key, value in section.items()))
+                for name, section in sections.items())
+
+def unslotted(cls, copies):
+    """
+    :returns: a copy of `cls` and its bases without __slots__
+
+    """
+    if cls is object:
+        return object
+    if cls not in copies:
+        slots = cls.__dict__.get("__slots__", ())
+        if isinstance(slots, str):
+            slots = (slots, )
+        dct   = dict((key, value) for key, value in cls.__dict__.items()
+                     if key not in slots and key not in ("__slots__", "__dict__", "__weakref__"))
+        bases = tuple(unslotted(base, copies) for base in cls.__bases__)
+        # type(), as the metaclass of events would add __slots__ again
+        copies[cls] = type(cls.__name__, bases, dct)
+    return copies[cls]
+
+@contextlib.contextmanager
+def without_slots():
+    """
+    Replace classes in SLOTTED by their copies without __slots__,
+    explicit super(Task, self) calls find the copies as well.
+
+    """
+    copies = {}
+    saved  = []
+    for module, names in SLOTTED:
+        for name in names:
+            cls = getattr(module, name)
+            saved.append((module, name, cls))
+            setattr(module, name, unslotted(cls, copies))
+    try:
+        yield
+    finally:
+        for module, name, cls in saved:
+            setattr(module, name, cls)
+
+def build(sections):
+    tasks = {}
+    queue = Queue()
+    for name, section in sections.items():
+        if section.get("type") == "simple":
+            task_class = mirror.task.SimpleTask
+        else:
+            task_class = mirror.task.Task
+        tasks[name] = task = task_class(name, None, **section)
+        queue.put(mirror.queue.TaskInfo(name, REGULAR_TASK, task.get_schedule_time(0),
+                                        task.priority))
+    return tasks, queue
+
+def build_events(tasks):
+    events = []
+    for i, name in enumerate(tasks):
+        events.append(mirror.event.TaskStartEvent(name, i))
+        events.append(mirror.event.TaskStopEvent(name, i, 0))
+    return events
+
+def measure(sections, measure_func):
+    """
+    :returns: (tasks, queue, events), memory of tasks and queue,
+              memory of events
+
+    """
+    (tasks, queue), size = measure_func(build, sections)
+    events, events_size  = measure_func(build_events, tasks)
+    return (tasks, queue, events), size, events_size
+
+def measure_rss(func, *args):
+    gc.collect()
+    before = rss()
+    result = func(*args)
+    gc.collect()
+    return result, rss() - before
+
+def measure_traced(func, *args):
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    gc.collect()
+    size   = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+def main():
+    count    = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    localdir = tempfile.mkdtemp()
+    sections = make_sections(count, localdir)
+
+    # RSS first, before tracemalloc allocates for itself, objects of
+    # both are kept meanwhile, so the second does not reuse freed memory
+    built, resident, events_resident = measure(sections, measure_rss)
+    with without_slots():
+        unslotted_built, unslotted_resident, unslotted_events_resident = \
+            measure(sections, measure_rss)
+    del built, unslotted_built
+    built, traced, events_traced = measure(sections, measure_traced)
+    del built
+    with without_slots():
+        built, unslotted_traced, unslotted_events_traced = measure(sections, measure_traced)
+    events = len(built[2])
+    del built
+
+    def row(label, slotted, unslotted, number):
+        slotted   = slotted   / 1024.0 / number * 1000
+        unslotted = unslotted / 1024.0 / number * 1000
+        print("  %-8s %10.1f %10.1f %7.1fx" % (label, unslotted, slotted, unslotted / slotted))
+
+    print("%d tasks with queue entries, KB per 1k tasks:" % count)
+    print("  %-8s %10s %10s %8s" % ("", "no slots", "slots", "saved"))
+    row("RSS",    resident, unslotted_resident, count)
+    row("traced", traced,   unslotted_traced,   count)
+    print("%d events, KB per 1k events:" % events)
+    print("  %-8s %10s %10s %8s" % ("", "no slots", "slots", "saved"))
+    row("RSS",    events_resident, unslotted_events_resident, events)
+    row("traced", events_traced,   unslotted_events_traced,   events)
+    os.rmdir(localdir)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
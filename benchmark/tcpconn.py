@@ -0,0 +1,117 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Compare the old regex based tcpconn() with mirror.sysinfo.proc_tcpconn()
+on synthetic /proc/net/tcp files of 10k, 100k and 1M lines, and time
+mirror.sysinfo.netlink_tcpconn() on this machine.
+
+Usage: python benchmark/tcpconn.py
+
+"""
+
+import os, sys
+import re
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from mirror.sysinfo import proc_tcpconn, netlink_tcpconn, TCP_STATUS
+
+TITLE = ("  sl  local_address rem_address   st tx_queue rx_queue tr tm->when "
+         "retrnsmt   uid  timeout inode\n")
+LINE  = ("%4d: %08X:%04X %08X:%04X %02X 00000000:00000000 00:00000000 00000000"
+         "    33        0 %d 1 0000000000000000 20 4 30 10 -1\n")
+
+pattern = (r"\d+:\s+" +
+           r"(?P<local_addr>[\da-fA-F]+):(?P<local_port>[\da-fA-F]+)\s+" +
+           r"(?P<remote_addr>[\da-fA-F]+):(?P<remote_port>[\da-fA-F]+)\s+" +
+           r"(?P<status>[\da-fA-F]+)\s+[\da-fA-F]+:[\da-fA-F]+\s+[\da-fA-F]+:[\da-fA-F]+\s+[\da-fA-F]+\s+\d+\s+\d+\s+" +
+           r"(?P<inode>\d+)")
+
+def legacy_tcpconn(port, files):
+    """
+    tcpconn() of mirror.sysinfo before netlink was used.
+
+    """
+    connections = 0
+    tcp   = re.compile(pattern)
+    for path in files:
+        if os.access(path, os.R_OK):
+            fp = open(path)
+            fp.readline() # skip title
+            for line in fp:
+                conn = tcp.search(line).groupdict()
+                local_port = int(conn['local_port'], 16)
+                if local_port != port:
+                    continue
+                status = int(conn['status'], 16)
+                if status == TCP_STATUS.TCP_ESTABLISHED:
+                    connections += 1
+            fp.close()
+    return connections
+
+def write_fixture(path, lines):
+    """
+    Most connections are established to port 80, like a busy http server.
+
+    """
+    rand = random.Random(lines)
+    with open(path, "w") as fp:
+        fp.write(TITLE)
+        for i in range(lines):
+            port   = 80 if rand.random() < 0.8 else rand.randint(1, 65535)
+            status = 1  if rand.random() < 0.7 else rand.randint(1, 11)
+            fp.write(LINE % (i, rand.getrandbits(32), port, rand.getrandbits(32),
+                             rand.randint(1024, 65535), status, rand.randint(1, 10 ** 7)))
+
+def timeit(func, *args):
+    start  = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print("%10s %12s %12s %8s" % ("lines", "regex (s)", "split (s)", "speedup"))
+        for lines in (10000, 100000, 1000000):
+            path = os.path.join(tmpdir, "tcp.%d" % lines)
+            write_fixture(path, lines)
+            expected, legacy = timeit(legacy_tcpconn, 80, (path,))
+            result,   split  = timeit(proc_tcpconn,   80, (path,))
+            if result != expected:
+                print("Mismatch on %d lines: %d != %d" % (lines, result, expected))
+                return 1
+            print("%10d %12.3f %12.3f %7.1fx" % (lines, legacy, split, legacy / split))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    try:
+        result, elapsed = timeit(netlink_tcpconn, 80)
+        print("netlink on this machine: %d connections in %.6f s" % (result, elapsed))
+    except Exception as e:
+        print("netlink is not available: %s" % e)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
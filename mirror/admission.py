@@ -0,0 +1,286 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Decide whether a task can start now, by system load, http connections,
+the number of running tasks and other signals (see SIGNALS) that have
+limits in config, see `admission` in [general]:
+
+    * linear  the priority a task needs is a line of (current / limit)
+    * aimd    the number of running tasks is limited, the limit grows by
+              one while load and connections are below their limits, and
+              is halved when either of them is above
+
+Every decision is kept in memory, and appended into `admissionlog` as
+a line of json if it is set, to find out the best limits.
+
+"""
+
+import json
+import time
+import logging
+
+from collections import deque
+from mirror.task import PRIORITY_MAX
+
+log = logging.getLogger(__name__)
+
+# tasks with priority up to it are started even if `maxtasks` is reached
+PRIORITY_URGENT = 2
+
+# signals besides load and conn, with their keys of limits in config,
+# see mirror.sysinfo, `disk` is of the device of the task's localdir
+SIGNALS = (("cpu", "cpupressure"), ("io", "iopressure"), ("memory", "mempressure"),
+           ("disk", "diskutil"), ("net", "netrate"))
+
+class Decision(object):
+    """
+    A decision of admission.
+
+    :param time: when it is made
+    :param taskname: name of the task, None for a change of the limit
+    :param priority: priority of the task
+    :param admitted: True if the task can start
+    :param reason: why it can not start, or None
+    :param running: the number of running tasks
+    :param state: dict of signals and state of the policy
+
+    """
+    __slots__ = ("time", "taskname", "priority", "admitted", "reason",
+                 "running", "state")
+
+    def __init__(self, time, taskname, priority, admitted, reason, running, state):
+        self.time     = time
+        self.taskname = taskname
+        self.priority = priority
+        self.admitted = admitted
+        self.reason   = reason
+        self.running  = running
+        self.state    = state
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+def runnable_priority(current, limit):
+    """
+    If limit is zero, all priority tasks can be run.
+    Else if current value is lower than limit, all priority tasks can be run.
+    Else it is a function between target priority and (current / limit).
+
+    """
+    if limit <= 0:
+        return PRIORITY_MAX
+    if current < limit:
+        return PRIORITY_MAX
+    return (-4.55 * (current * 1.0 / limit)) + 14.55
+
+class AdmissionPolicy(object):
+    """
+    Base class of policies.
+
+    update() is called with smoothed signals once every turn of
+    scheduling, before admit() is called for tasks to start.
+
+    :param loadlimit: limit of system load, 0 means no limit
+    :param httpconn: limit of http connections, 0 means no limit
+    :param maxtasks: limit of running tasks, 0 means no limit
+    :param logfile: file to append decisions into, or None
+    :param limits: dict of signal -> limit for other signals, see SIGNALS,
+                   0 means no limit
+
+    """
+    name = None
+
+    # the number of recent decisions kept in memory
+    HISTORY = 1000
+
+    def __init__(self, loadlimit, httpconn, maxtasks, logfile = None, limits = None):
+        self.signals   = { "load": 0.0, "conn": 0.0 }
+        self.decisions = deque(maxlen = self.HISTORY)
+        self.set_limits(loadlimit, httpconn, maxtasks, logfile, limits)
+
+    def set_limits(self, loadlimit, httpconn, maxtasks, logfile = None, limits = None):
+        self.loadlimit = loadlimit
+        self.httpconn  = httpconn
+        self.maxtasks  = maxtasks
+        self.logfile   = logfile
+        self.limits    = dict((name, limit) for name, limit in (limits or {}).items()
+                              if limit > 0)
+
+    def get_limits(self, signals):
+        """
+        :returns: list of (signal, value, limit) of `signals` that have limits
+
+        """
+        limits = [ ("load", signals.get("load", 0.0), self.loadlimit),
+                   ("conn", signals.get("conn", 0.0), self.httpconn) ]
+        limits.extend((name, signals.get(name, 0.0), limit)
+                      for name, limit in self.limits.items())
+        return [ (name, value, limit) for name, value, limit in limits if limit > 0 ]
+
+    def update(self, signals, running, now = None):
+        """
+        :param signals: dict of smoothed load and conn
+        :param running: the number of running tasks
+
+        """
+        self.signals = dict(signals)
+
+    def admit(self, taskname, priority, running, signals = None, now = None):
+        """
+        :param signals: dict of signals of the task itself, e.g. disk
+        :returns: Decision for task `taskname` to start now
+
+        """
+        signals = dict(self.signals, **signals) if signals else self.signals
+        admitted, reason = self.decide(priority, running, signals)
+        decision = Decision(time.time() if now is None else now, taskname, priority,
+                            admitted, reason, running, self.get_state(signals))
+        self.record(decision)
+        return decision
+
+    def decide(self, priority, running, signals):
+        """
+        :returns: (True, None) if a task of `priority` can start,
+                  or (False, reason)
+
+        """
+        raise NotImplementedError
+
+    def get_state(self, signals = None):
+        state = dict(self.signals if signals is None else signals)
+        state["policy"] = self.name
+        return state
+
+    def record(self, decision):
+        self.decisions.append(decision)
+        if not self.logfile:
+            return
+        try:
+            with open(self.logfile, "a") as fp:
+                fp.write(json.dumps(decision.to_dict(), sort_keys = True) + "\n")
+        except (IOError, OSError) as e:
+            log.warning("Unable to write admission log %s: %s", self.logfile, e)
+
+class LinearPolicy(AdmissionPolicy):
+    """
+    The priority a task needs is a line of (current / limit), for
+    load, connections and every other signal, see runnable_priority(),
+    and only tasks with priority up to PRIORITY_URGENT can start after
+    `maxtasks` tasks are running.
+
+    """
+    name = "linear"
+
+    def decide(self, priority, running, signals):
+        for name, value, limit in self.get_limits(signals):
+            if priority <= runnable_priority(value, limit):
+                continue
+            if name == "load":
+                return (False, "system load %.2f is too high" % value)
+            if name == "conn":
+                return (False, "http connections is too many")
+            return (False, "%s %.2f is too high" % (name, value))
+        if self.maxtasks > 0 and running >= self.maxtasks and priority > PRIORITY_URGENT:
+            return (False, "running tasks is larger than %d" % self.maxtasks)
+        return (True, None)
+
+class AIMDPolicy(AdmissionPolicy):
+    """
+    Limit the number of running tasks by additive increase and
+    multiplicative decrease, like TCP does with its window:
+
+    Once every `interval` seconds, the limit grows by `increase` if the
+    limit is used up while all signals are below their limits, and it is
+    multiplied by `decrease` if any of them is above. Signals of a task
+    itself, e.g. its disk, are not in the limit, but a task is not
+    started if any of them is above its limit.
+
+    The limit is between 1 and `maxtasks` (or MAX_LIMIT if it is 0),
+    tasks with priority up to PRIORITY_URGENT are not limited by it.
+    It starts at the highest, so an idle system is not held back after
+    mirrord starts, and the first update() decreases it at once if the
+    system is already overloaded.
+
+    """
+    name = "aimd"
+
+    MAX_LIMIT = 64
+
+    def __init__(self, loadlimit, httpconn, maxtasks, logfile = None, limits = None,
+                 increase = 1.0, decrease = 0.5, interval = 60):
+        super(AIMDPolicy, self).__init__(loadlimit, httpconn, maxtasks, logfile, limits)
+        self.increase = increase
+        self.decrease = decrease
+        self.interval = interval
+        self.limit    = float(self.get_max_limit())
+        self.updated  = None
+
+    def get_max_limit(self):
+        return self.maxtasks if self.maxtasks > 0 else self.MAX_LIMIT
+
+    def get_pressure(self, signals = None):
+        """
+        :returns: the highest ratio of a signal to its limit
+
+        """
+        signals = self.signals if signals is None else signals
+        return max([ value * 1.0 / limit for name, value, limit
+                     in self.get_limits(signals) if name in signals ] or [ 0.0 ])
+
+    def update(self, signals, running, now = None):
+        super(AIMDPolicy, self).update(signals, running, now)
+        now   = time.time() if now is None else now
+        first = self.updated is None
+        if not first and now - self.updated < self.interval:
+            return
+        self.updated = now
+
+        old = self.limit
+        if self.get_pressure() >= 1.0:
+            self.limit = max(1.0, self.limit * self.decrease)
+        elif not first and running >= int(self.limit):
+            # it only grows when it really limits, or it grows forever when idle
+            self.limit = self.limit + self.increase
+        self.limit = min(self.limit, float(self.get_max_limit()))
+        if int(self.limit) != int(old):
+            log.info("Admission limit of running tasks changed from %d to %d, pressure %.2f",
+                     int(old), int(self.limit), self.get_pressure())
+            self.record(Decision(now, None, None, None, "limit changed from %d" % int(old),
+                                 running, self.get_state()))
+
+    def decide(self, priority, running, signals):
+        if priority <= PRIORITY_URGENT:
+            return (True, None)
+        for name, value, limit in self.get_limits(signals):
+            if name not in self.signals and value >= limit:
+                return (False, "%s %.2f is too high" % (name, value))
+        if running >= int(self.limit):
+            return (False, "running tasks reached admission limit %d, pressure %.2f" %
+                           (int(self.limit), self.get_pressure()))
+        return (True, None)
+
+    def get_state(self, signals = None):
+        state = super(AIMDPolicy, self).get_state(signals)
+        state["limit"]    = int(self.limit)
+        state["pressure"] = round(self.get_pressure(signals), 3)
+        return state
+
+POLICIES = dict((policy.name, policy) for policy in (LinearPolicy, AIMDPolicy))
@@ -0,0 +1,130 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Share a bandwidth budget of all running tasks, see `bwlimit` in [general].
+
+Running tasks share the budget by their priority, a task of priority
+1 gets ten times as much as one of priority 10. The share of a task
+is split among processes of it, and passed to rsync by --bwlimit
+when a process starts, see AbstractTask.get_exec_args().
+
+rsync can not change --bwlimit once it is running, so when shares
+are changed (a task starts or finishes, or the budget is changed by
+`bwprofile`), new shares of running tasks are passed to `bwhook`,
+e.g. a script which sets tc or cgroup limits of their processes:
+
+    bwhook <task name> <bytes per second> <pid> [<pid> ...]
+
+"""
+
+import os
+import time
+import logging
+import mirror.common
+
+from mirror.task import PRIORITY_MAX
+
+log = logging.getLogger(__name__)
+
+def parse_profile(profile):
+    """
+    Parse `bwprofile` of config, e.g. "0-7=200M 19-23=50M", the budget
+    between the hours, from the start to the end (not included), it
+    goes across midnight if the start is after the end, e.g. 22-6.
+
+    :returns: list of (start hour, end hour, bytes per second)
+    :raises ValueError: if it is not valid
+
+    """
+    ranges = []
+    for item in profile.split():
+        hours, sep, budget = item.partition("=")
+        start, dash, end   = hours.partition("-")
+        if not sep or not dash:
+            raise ValueError("%s is not start-end=budget" % item)
+        start, end = int(start), int(end)
+        if not (0 <= start <= 24 and 0 <= end <= 24):
+            raise ValueError("hours of %s are not between 0 and 24" % item)
+        ranges.append((start, end, mirror.common.parse_size(budget)))
+    return ranges
+
+class BandwidthManager(object):
+    """
+    :param budget: bytes per second of all tasks, 0 means no limit
+    :param profile: see parse_profile(), budgets used instead of `budget`
+                    during their hours
+    :param hook: command to apply new shares of running tasks, or None
+
+    """
+    def __init__(self, budget = 0, profile = (), hook = None):
+        self.budget  = budget
+        self.profile = list(profile)
+        self.hook    = hook
+        # the budget used by last allocate()
+        self.current = None
+
+    def get_budget(self, now = None):
+        """
+        :returns: budget at `now`, 0 means no limit
+
+        """
+        if not self.profile:
+            return self.budget
+        hour = time.localtime(now).tm_hour
+        for start, end, budget in self.profile:
+            if start <= hour < end or (start > end and (hour >= start or hour < end)):
+                return budget
+        return self.budget
+
+    def is_changed(self, now = None):
+        """
+        :returns: True if the budget is changed since last allocate()
+
+        """
+        return self.current is not None and self.get_budget(now) != self.current
+
+    def allocate(self, tasks, now = None):
+        """
+        :param tasks: list of (task name, priority) of running tasks
+        :returns: dict of task name -> bytes per second, 0 means no limit
+
+        """
+        self.current = budget = self.get_budget(now)
+        if budget <= 0:
+            return dict((name, 0) for name, priority in tasks)
+        weights = dict((name, PRIORITY_MAX + 1 - priority) for name, priority in tasks)
+        total   = sum(weights.values())
+        return dict((name, max(1, budget * weight // total))
+                    for name, weight in weights.items())
+
+    def apply(self, taskname, rate, pids):
+        """
+        Pass the new share of a running task to `hook`, it is not waited
+        for, but reaped as other children of mirrord.
+
+        """
+        if not self.hook or not pids:
+            return
+        args = [ self.hook, taskname, str(rate) ] + [ str(pid) for pid in pids ]
+        try:
+            os.posix_spawn(self.hook, args, os.environ)
+        except (OSError, AttributeError) as e:
+            log.error("Unable to run bwhook %s for task: %s, %s", self.hook, taskname, e)
@@ -0,0 +1,304 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Share CPU and disk between tasks and everything else on the host
+(e.g. the http server of the mirror) by task priority.
+
+Every task is put into a cgroup v2 of its own, `<cgroup>/<task name>`,
+where `cgroup` in [general] is a directory delegated to mirrord, e.g.
+by systemd with Delegate=yes. mirrord itself must not be in it, as
+controllers can not be enabled for a cgroup that has processes.
+
+If that is not possible, priority is mapped to nice and io priority
+of the processes of tasks instead.
+
+"""
+
+import os
+import re
+import ctypes
+import logging
+import platform
+import mirror.common
+
+log = logging.getLogger(__name__)
+
+CONTROLLERS = ("cpu", "io", "memory")
+
+# See linux/ioprio.h
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_BE    = 2
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_BE_LEVELS   = 8
+
+# ioprio_set() has no wrapper in libc
+SYS_IOPRIO_SET = { "x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30,
+                   "armv7l": 314, "ppc64le": 273, "riscv64": 30, "s390x": 282 }
+
+def priority_weight(priority):
+    """
+    :returns: cpu.weight and io.weight of `priority`, 100 (the default
+              weight of cgroups) for the highest one, 10 for the lowest
+
+    """
+    return 10 * (11 - priority)
+
+def priority_nice(priority):
+    """
+    :returns: nice value of `priority`, from 0 to 19
+
+    """
+    return (priority - 1) * 19 // 9
+
+def parse_size(size):
+    """
+    :returns: bytes of `size`, e.g. 512M, or "max"
+
+    """
+    size = size.strip()
+    if size == "max":
+        return size
+    return str(mirror.common.parse_size(size))
+
+def block_device(path):
+    """
+    :returns: "major:minor" of the disk `path` is on, partitions are
+              not accepted by io.max
+
+    """
+    st_dev = os.stat(path).st_dev
+    device = "%d:%d" % (os.major(st_dev), os.minor(st_dev))
+    sysfs  = os.path.realpath("/sys/dev/block/" + device)
+    if os.path.exists(os.path.join(sysfs, "partition")):
+        with open(os.path.join(os.path.dirname(sysfs), "dev")) as fp:
+            device = fp.read().strip()
+    return device
+
+def parse_iomax(iomax, path):
+    """
+    Parse `iomax` of config, e.g. "wbps=50M riops=1000", it limits the
+    device of `path`, unless it begins with "major:minor".
+
+    :returns: a line for io.max
+
+    """
+    fields = iomax.split()
+    if fields and re.match(r"^\d+:\d+$", fields[0]):
+        device = fields.pop(0)
+    else:
+        device = block_device(path)
+    limits = []
+    for field in fields:
+        key, sep, value = field.partition("=")
+        if not sep:
+            raise ValueError("%s is not key=value" % field)
+        limits.append("%s=%s" % (key, parse_size(value) if key.endswith("bps") else value))
+    return " ".join([device] + limits)
+
+def ioprio_set(pid, level):
+    """
+    Set best effort io priority `level` (0 - 7) of process `pid`,
+    0 means the calling process.
+
+    """
+    number = SYS_IOPRIO_SET.get(platform.machine(), None)
+    if number is None:
+        raise OSError("ioprio_set() is unknown on %s" % platform.machine())
+    libc = ctypes.CDLL(None, use_errno = True)
+    ioprio = (IOPRIO_CLASS_BE << IOPRIO_CLASS_SHIFT) | level
+    if libc.syscall(number, IOPRIO_WHO_PROCESS, pid, ioprio) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+class Cgroups(object):
+    """
+    Cgroups of tasks in `root`, see the top of this module.
+
+    Usage of a run of a task is the difference of what its cgroup
+    used before and after it.
+
+    :param root: the directory delegated to mirrord
+
+    """
+    def __init__(self, root):
+        self.root      = root.rstrip("/")
+        # None until checked, see is_usable()
+        self.usable    = None
+        self.enabled   = ()
+        # task name -> usage of its cgroup when the run began
+        self.baselines = {}
+        # task names whose cgroups are created
+        self.created   = set()
+
+    def is_usable(self):
+        """
+        Enable controllers for cgroups of tasks in `root`, only checked once.
+
+        :returns: True if tasks can be put into cgroups
+
+        """
+        if self.usable is not None:
+            return self.usable
+        self.usable = False
+        try:
+            with open(os.path.join(self.root, "cgroup.controllers")) as fp:
+                available = fp.read().split()
+            self.enabled = tuple(c for c in CONTROLLERS if c in available)
+            self.write(self.root, "cgroup.subtree_control",
+                       " ".join("+" + c for c in self.enabled))
+        except (IOError, OSError) as e:
+            log.warning("Unable to use cgroup %s: %s, "
+                        "priority of tasks is mapped to nice instead", self.root, e)
+            return False
+        self.usable = True
+        log.info("Tasks are put into cgroups in %s, controllers: %s",
+                 self.root, ", ".join(self.enabled) or "none")
+        return True
+
+    def get_path(self, taskname):
+        """
+        :returns: path of the cgroup of `taskname`, or None if it is not in one
+
+        """
+        if taskname not in self.created:
+            return None
+        return os.path.join(self.root, taskname)
+
+    def write(self, path, name, value):
+        with open(os.path.join(path, name), "w") as fp:
+            fp.write(value)
+
+    def start(self, task):
+        """
+        Create the cgroup of `task` and set its weights and limits,
+        it is called in mirrord before processes of the task start.
+
+        `iomax` and `memoryhigh` of the task's config set io.max and
+        memory.high, see parse_iomax() and parse_size().
+
+        """
+        if not self.is_usable():
+            return
+        path = os.path.join(self.root, task.name)
+        try:
+            if not os.path.isdir(path):
+                os.mkdir(path)
+            self.created.add(task.name)
+        except OSError as e:
+            log.error("Unable to create cgroup %s: %s", path, e)
+            return
+        weight   = str(priority_weight(task.priority))
+        settings = []
+        if "cpu" in self.enabled:
+            settings.append(("cpu.weight", weight))
+        if "io" in self.enabled:
+            settings.append(("io.weight", "default " + weight))
+        taskinfo = task.taskinfo
+        try:
+            if "iomax" in taskinfo and "io" in self.enabled:
+                settings.append(("io.max", parse_iomax(taskinfo["iomax"],
+                                        getattr(task, "localdir", self.root))))
+            if "memoryhigh" in taskinfo and "memory" in self.enabled:
+                settings.append(("memory.high", parse_size(taskinfo["memoryhigh"])))
+        except (ValueError, OSError) as e:
+            log.error("Error in config for task: %s, limits not valid: %s", task.name, e)
+        for name, value in settings:
+            try:
+                self.write(path, name, value)
+            except (IOError, OSError) as e:
+                # e.g. io.weight needs the bfq io scheduler
+                log.warning("Unable to set %s of cgroup %s: %s", name, path, e)
+        # failover reruns the task, whose usage counts from the first run
+        if task.name not in self.baselines:
+            self.baselines[task.name] = self.read_usage(task.name)
+
+    def attach(self, task, pid):
+        """
+        Put process `pid` of `task` into its cgroup, or set its nice and
+        io priority, 0 means the calling process, e.g. a forked child.
+
+        """
+        path = self.get_path(task.name)
+        if path is not None:
+            try:
+                self.write(path, "cgroup.procs", str(pid or os.getpid()))
+                return
+            except (IOError, OSError) as e:
+                log.warning("Unable to put process %d into cgroup %s: %s", pid, path, e)
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, priority_nice(task.priority))
+            ioprio_set(pid, (task.priority - 1) * (IOPRIO_BE_LEVELS - 1) // 9)
+        except (IOError, OSError) as e:
+            log.warning("Unable to set priority of process %d: %s", pid, e)
+
+    def finish(self, task):
+        """
+        :returns: usage of the run of `task`, dict of cpu (seconds), read
+                  and write (bytes), or None if it is not in a cgroup
+
+        """
+        baseline = self.baselines.pop(task.name, None)
+        if baseline is None:
+            return None
+        usage = self.read_usage(task.name)
+        return dict((key, usage[key] - baseline.get(key, 0)) for key in usage)
+
+    def read_usage(self, taskname):
+        """
+        :returns: total usage of the cgroup of `taskname`, see finish()
+
+        """
+        usage = { "cpu": 0.0, "read": 0, "write": 0 }
+        path  = self.get_path(taskname)
+        if path is None:
+            return usage
+        try:
+            with open(os.path.join(path, "cpu.stat")) as fp:
+                for line in fp:
+                    key, value = line.split()
+                    if key == "usage_usec":
+                        usage["cpu"] = int(value) / 1000000.0
+        except (IOError, OSError, ValueError):
+            pass
+        try:
+            with open(os.path.join(path, "io.stat")) as fp:
+                for line in fp:
+                    for field in line.split()[1:]:
+                        key, sep, value = field.partition("=")
+                        if key == "rbytes":
+                            usage["read"]  += int(value)
+                        elif key == "wbytes":
+                            usage["write"] += int(value)
+        except (IOError, OSError, ValueError):
+            pass
+        return usage
+
+    def close(self):
+        """
+        Remove cgroups of tasks, those still having processes are kept.
+
+        """
+        for taskname in list(self.created):
+            try:
+                os.rmdir(os.path.join(self.root, taskname))
+                self.created.discard(taskname)
+            except OSError as e:
+                log.debug("Unable to remove cgroup of task: %s: %s", taskname, e)
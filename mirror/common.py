@@ -204,6 +204,22 @@ def parse_timestr(timestr):
     else:
         return 0
 
+SIZE_UNITS = { "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40 }
+
+def parse_size(sizestr):
+    """
+    Parse size expression, e.g. 4096, 512K, 1.5G
+
+    :returns: the bytes represented by size
+    :raises ValueError: if size is not valid
+
+    """
+    sizestr = sizestr.strip()
+    unit    = SIZE_UNITS.get(sizestr[-1:].lower(), None)
+    if unit is not None:
+        return int(float(sizestr[:-1]) * unit)
+    return int(sizestr)
+
 CRON_TIME = re.compile(r'^\s*([^@#\s]+)\s+([^@#\s]+)\s+([^@#\s]+)' +
                        r'\s+([^@#\s]+)\s+([^@#\s]+)\s*(#\s*([^\n]*)|$)')
 CRON_ITEM = re.compile(r'^(\d+)-(\d+)/(\d+)$')
@@ -30,8 +30,28 @@ else:
 
 import mirror.common
 
+from collections import OrderedDict
+
 log = logging.getLogger(__name__)
 
+class MultiValueDict(OrderedDict):
+    """
+    Options of a section read by ConfigParser, values of the keys
+    ending with `[]` are collected instead of replaced, e.g.
+
+        upstream[] = mirror.example.org
+        upstream[] = mirror.example.net
+
+    Values are lists of lines while reading, they are joined by "\n".
+
+    """
+    def __setitem__(self, key, value):
+        old = self.get(key, None)
+        if key.endswith("[]") and isinstance(old, list) and isinstance(value, list):
+            old.extend(value)
+            return
+        OrderedDict.__setitem__(self, key, value)
+
 def prop(func):
     """Function decorator for defining property attributes
 
@@ -244,13 +264,17 @@ class Config(object):
             return
 
         # load mirror ini config file
-        config = ConfigParser()
+        try:
+            config = ConfigParser(strict = False, dict_type = MultiValueDict)
+        except TypeError:
+            # ConfigParser of Python 2 keeps the last value only
+            config = ConfigParser()
         config.read(filename)
         for section in config.sections():
             value = {}
             for item in config.items(section):
                 if item[0].endswith("[]") and item[0] not in value:
-                    value[item[0]] = [item[1]]
+                    value[item[0]] = item[1].split("\n")
                     continue
                 if item[0] in value and type(value[item[0]]) == list:
                     value[item[0]].append(item[1])
@@ -22,19 +22,14 @@
 
 import os, sys
 import time
-import mmap
-import struct
 import signal
-try:
-    import cPickle as pickle
-except:
-    import pickle
 
 import mirror.color
 import mirror.common
 import mirror.task  as task
 import mirror.error as error
-from mirror.common import write_stderr
+from mirror.common    import write_stderr
+from mirror.statusmap import read_status, STATUS_FILE
 
 TASK_DESC = {
             task.REGULAR_TASK: "Normal task",
@@ -44,32 +39,26 @@ TASK_DESC = {
 
 def list_task_queue():
     try:
-        bufferfd = os.open("/tmp/mirrord", os.O_RDONLY)
+        records = read_status(STATUS_FILE)
+    except error.MirrorError:
+        write_stderr(_("Wrong file /tmp/mirrord, "
+                       "any other wrote it?"))
+        return error.MIRROR_ERROR
     except:
         write_stderr(_("Open /tmp/mirrord failed, "
                        "can't read task information, please make sure that mirrord is running"))
         return error.MIRROR_ERROR
 
-    buffer = mmap.mmap(bufferfd, os.fstat(bufferfd).st_size,
-                       mmap.MAP_SHARED, mmap.PROT_READ)
-    os.close(bufferfd)
-    if buffer[:2] != b'\x79\x71':
-        write_stderr(_("Wrong file /tmp/mirrord, "
-                       "any other wrote it?"))
-        return error.MIRROR_ERROR
-
-    buffer.seek(2)
-    size = struct.unpack("I", buffer.read(4))[0]
-
-    taskqueue = pickle.loads(buffer.read(size))
+    # tasks not in the queue have no task type
+    taskqueue = sorted([record for record in records if record[1] in TASK_DESC],
+                       key = lambda record: (record[4], record[3]))
     formatstr = ("Task:"+mirror.color.FOREGROUND_COLORS.GREEN
                 +"%-18s"+mirror.color.COLOR_RESET+"\ttype:%14s\ttime: %s")
-    for taskinfo in taskqueue:
+    for name, tasktype, state, priority, next_time, pid in taskqueue:
         print(formatstr % (
-              taskinfo.name, TASK_DESC[taskinfo.tasktype],
-              time.asctime(time.localtime(taskinfo.time))))
+              name, TASK_DESC[tasktype],
+              time.asctime(time.localtime(next_time))))
 
-    buffer.close()
     return error.MIRROR_OK
 
 signals = {
@@ -0,0 +1,177 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""Compiled cron time for Mirror"""
+
+import time
+import calendar
+from datetime import date
+
+import mirror.common
+
+FULL_MINUTE = (1 << 60) - 1
+FULL_HOUR   = (1 << 24) - 1
+FULL_DOW    = ((1 << 8) - 1) & ~1
+
+def _mask(values):
+    mask = 0
+    for value in values:
+        mask |= 1 << value
+    return mask
+
+def _next_bit(mask, start):
+    """
+    :returns: the lowest bit set in `mask` which is >= `start`, or -1
+
+    """
+    mask >>= start
+    if not mask:
+        return -1
+    return start + (mask & -mask).bit_length() - 1
+
+class CronSchedule(object):
+    """
+    A cron time compiled into bitmasks, e.g. `*/20 * * * *`.
+
+    Fields are the lists returned by mirror.common.parse_cron_time(),
+    day of week is from 1 (Monday) to 7 (Sunday).
+
+    NOTE:
+    If minute is `*` but hour is not, the task runs once at the first
+    minute of those hours, e.g. `* */2 * * *` means every two hours.
+
+    """
+    __slots__ = ("minute", "hour", "dom", "month", "dow", "_window")
+
+    def __init__(self, minute, hour, dom, month, dow):
+        self.minute = _mask(minute)
+        self.hour   = _mask(hour)
+        self.dom    = _mask(dom)
+        self.month  = _mask(month)
+        self.dow    = _mask(dow)
+        if self.minute == FULL_MINUTE and self.hour != FULL_HOUR:
+            self.minute = self.minute & -self.minute
+        # (start, next_time), next_after(since) is next_time
+        # for any since in [start, next_time)
+        self._window = (0, 0)
+
+    @classmethod
+    def parse(cls, crontime):
+        """
+        :returns: a CronSchedule, or None if `crontime` is not valid
+
+        """
+        result = mirror.common.parse_cron_time(crontime)
+        if not result:
+            return None
+        return cls(*result[:5])
+
+    def is_valid(self):
+        return bool(self.minute and self.hour and self.dom and
+                    self.month and self.dow)
+
+    def next_after(self, since):
+        """
+        Get the first fire time after the minute `since` is in.
+
+        :returns: seconds since the epoch, or None if it never fires
+
+        """
+        start, next_time = self._window
+        if start <= since < next_time:
+            return next_time
+        next_time = self._next_after(since)
+        if next_time is not None:
+            self._window = (int(since) - time.localtime(since).tm_sec, next_time)
+        return next_time
+
+    def iter_after(self, since):
+        """
+        Iterate over the upcoming fire times after `since`.
+
+        """
+        next_time = self._next_after(since)
+        while next_time is not None:
+            yield next_time
+            next_time = self._next_after(next_time)
+
+    def _next_after(self, since):
+        if not self.is_valid():
+            return None
+        since_struct = time.localtime(since)
+        year   = since_struct.tm_year
+        month  = since_struct.tm_mon
+        day    = since_struct.tm_mday
+        hour   = since_struct.tm_hour
+        minute = since_struct.tm_min + 1
+
+        # e.g. 0 0 29 2 1 only fires once in 28 years
+        while year <= since_struct.tm_year + 28:
+            if minute > 59:
+                minute = 0
+                hour  += 1
+            if hour > 23:
+                hour   = 0
+                day   += 1
+            if month > 12:
+                month  = 1
+                year  += 1
+            if day > 28 and day > calendar.monthrange(year, month)[1]:
+                day    = 1
+                month += 1
+                continue
+
+            value = _next_bit(self.month, month)
+            if value < 0:
+                year  += 1
+                month, day, hour, minute = 1, 1, 0, 0
+                continue
+            if value != month:
+                month, day, hour, minute = value, 1, 0, 0
+
+            value = _next_bit(self.dom, day)
+            if value < 0 or (value > 28 and
+                             value > calendar.monthrange(year, month)[1]):
+                month += 1
+                day, hour, minute = 1, 0, 0
+                continue
+            if value != day:
+                day, hour, minute = value, 0, 0
+            if (self.dow != FULL_DOW and
+                    not (self.dow >> (date(year, month, day).weekday() + 1)) & 1):
+                day += 1
+                hour, minute = 0, 0
+                continue
+
+            value = _next_bit(self.hour, hour)
+            if value < 0:
+                day += 1
+                hour, minute = 0, 0
+                continue
+            if value != hour:
+                hour, minute = value, 0
+
+            value = _next_bit(self.minute, minute)
+            if value < 0:
+                hour  += 1
+                minute = 0
+                continue
+            return time.mktime((year, month, day, hour, value, 0, 0, 0, -1))
+        return None
@@ -24,7 +24,14 @@ class MirrorEventMetaClass(type):
     """
     The metaclass keeps a list of all known event classes.
 
+    Every event class gets an empty __slots__ unless it declares its own,
+    so events have no __dict__, `_args` of MirrorEvent is all they keep.
+
     """
+    def __new__(mcs, name, bases, dct):
+        dct.setdefault("__slots__", ())
+        return super(MirrorEventMetaClass, mcs).__new__(mcs, name, bases, dct)
+
     def __init__(cls, name, bases, dct):
         super(MirrorEventMetaClass, cls).__init__(name, bases, dct)
         if name != "MirrorEvent":
@@ -35,6 +42,7 @@ class MirrorEvent(object, metaclass=MirrorEventMetaClass):
     The base class for all events.
 
     """
+    __slots__ = ("_args",)
 
     def _get_name(self):
         return self.__class__.__name__
@@ -42,7 +50,7 @@ class MirrorEvent(object, metaclass=MirrorEventMetaClass):
     def _get_args(self):
         if hasattr(self, "_args"):
             return self._args
-        return []
+        return ()
 
     name = property(fget=_get_name)
     args = property(fget=_get_args)
@@ -62,7 +70,30 @@ class TaskEnqueueEvent(MirrorEvent):
 
     """
     def __init__(self, taskname):
-        self._args = [ taskname ]
+        self._args = ( taskname, )
+
+class QueueChangedEvent(MirrorEvent):
+    """
+    The event occurs when tasks are appended into the queue or moved in it,
+    it is emitted once for all those tasks in a turn of scheduling.
+
+    Handlers of TaskEnqueueEvent still get one event for each task,
+    see split().
+
+    :param tasknames: list of task names
+
+    """
+    split_name = "TaskEnqueueEvent"
+
+    def __init__(self, tasknames):
+        self._args = ( tasknames, )
+
+    def split(self):
+        """
+        :returns: a TaskEnqueueEvent for each task
+
+        """
+        return [ TaskEnqueueEvent(taskname) for taskname in self._args[0] ]
 
 class PreTaskStartEvent(MirrorEvent):
     """
@@ -72,7 +103,7 @@ class PreTaskStartEvent(MirrorEvent):
 
     """
     def __init__(self, taskname):
-        self._args = [ taskname ]
+        self._args = ( taskname, )
 
 class TaskStartEvent(MirrorEvent):
     """
@@ -83,7 +114,7 @@ class TaskStartEvent(MirrorEvent):
 
     """
     def __init__(self, taskname, taskpid):
-        self._args = [ taskname, taskpid ]
+        self._args = ( taskname, taskpid )
 
 class TaskStopEvent(MirrorEvent):
     """
@@ -95,7 +126,7 @@ class TaskStopEvent(MirrorEvent):
 
     """
     def __init__(self, taskname, taskpid, exitcode):
-        self._args = [ taskname, taskpid, exitcode ]
+        self._args = ( taskname, taskpid, exitcode )
 
 class RunSystemTaskEvent(MirrorEvent):
     """
@@ -105,5 +136,5 @@ class RunSystemTaskEvent(MirrorEvent):
 
     """
     def __init__(self, taskinfo):
-        self._args = [ taskinfo ]
+        self._args = ( taskinfo, )
 
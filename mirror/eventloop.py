@@ -0,0 +1,160 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Event loop for the scheduler to wait in, instead of time.sleep().
+
+It waits with a selector on:
+
+    * a timer fd (or the selector's timeout) for the next deadline
+    * a pidfd for every running child
+    * a pipe written by the C signal handler (signal.set_wakeup_fd()),
+      so a signal can never get lost between checking and waiting
+    * any other fds added by add_reader()
+
+"""
+
+import os
+import time
+import signal
+import logging
+import selectors
+
+log = logging.getLogger(__name__)
+
+class EventLoop(object):
+    """
+    NOTE:
+    It must be created and closed in the main thread,
+    as signal.set_wakeup_fd() can only be called there.
+
+    """
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        # pid -> pidfd
+        self.pidfds   = {}
+
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        for fd in (self.wakeup_r, self.wakeup_w):
+            os.set_blocking(fd, False)
+        self.old_wakeup_fd = signal.set_wakeup_fd(self.wakeup_w,
+                                                  warn_on_full_buffer = False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, self._drain_wakeup)
+
+        # os.timerfd_create() is only available since Python 3.13
+        self.timerfd = None
+        if hasattr(os, "timerfd_create"):
+            self.timerfd = os.timerfd_create(time.CLOCK_MONOTONIC,
+                                             flags = os.TFD_NONBLOCK | os.TFD_CLOEXEC)
+            self.selector.register(self.timerfd, selectors.EVENT_READ, self._drain_timer)
+
+    def add_reader(self, fd, callback):
+        """
+        Call `callback()` in wait() when `fd` is readable.
+
+        """
+        self.selector.register(fd, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, fd):
+        try:
+            self.selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+
+    def watch_pid(self, pid, callback):
+        """
+        Call `callback()` in wait() when child `pid` exits, once only.
+        Without pidfd support, the wakeup pipe is written by SIGCHLD anyway.
+
+        """
+        if not hasattr(os, "pidfd_open") or pid in self.pidfds:
+            return
+        try:
+            fd = os.pidfd_open(pid)
+        except OSError as e:
+            # it may have exited and been reaped already
+            log.debug("Unable to open pidfd of %d: %s", pid, e)
+            return
+        self.pidfds[pid] = fd
+        def on_exited():
+            self.unwatch_pid(pid)
+            callback()
+        self.add_reader(fd, on_exited)
+
+    def unwatch_pid(self, pid):
+        fd = self.pidfds.pop(pid, None)
+        if fd is None:
+            return
+        self.remove_reader(fd)
+        os.close(fd)
+
+    def wakeup(self):
+        """
+        Interrupt wait(), e.g. from another thread.
+
+        """
+        try:
+            os.write(self.wakeup_w, b"\0")
+        except BlockingIOError:
+            # there are enough bytes to wake us up
+            pass
+
+    def wait(self, timeout):
+        """
+        Wait until `timeout` seconds passed, or any fd is ready,
+        callbacks of ready fds are called before it returns.
+
+        :returns: the number of fds which are ready, 0 if it is timed out
+
+        """
+        if self.timerfd is not None:
+            # zero means disarming the timer
+            os.timerfd_settime(self.timerfd, initial = max(timeout, 1e-6))
+            events = self.selector.select()
+        else:
+            events = self.selector.select(max(timeout, 0))
+        ready = 0
+        for key, mask in events:
+            if key.fd != self.timerfd:
+                ready += 1
+            key.data()
+        return ready
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self.wakeup_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _drain_timer(self):
+        try:
+            os.read(self.timerfd, 8)
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        for pid in list(self.pidfds):
+            self.unwatch_pid(pid)
+        signal.set_wakeup_fd(self.old_wakeup_fd)
+        self.selector.close()
+        for fd in (self.wakeup_r, self.wakeup_w, self.timerfd):
+            if fd is not None:
+                os.close(fd)
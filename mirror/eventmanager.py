@@ -18,20 +18,34 @@
 #
 #
 
+import time
 import logging
 from   mirror.component import Component
-from   mirror.pluginthread import PluginThread
+from   mirror.pluginthread import PluginThread, HandlerExecutor, OVERFLOW_BLOCK
 
 log = logging.getLogger(__name__)
 
 class EventManager(Component):
 
+    # executor of handlers which are not methods of a plugin
+    DEFAULT_EXECUTOR = "default"
+
     def __init__(self):
         # The name is "EventManager"
         super(EventManager, self).__init__(self.__class__.__name__)
 
         self.handlers = {}
         self.plugin_thread = None
+        # executor name -> HandlerExecutor
+        self.executors = {}
+        # executor name -> options of HandlerExecutor
+        self.executor_options = {}
+        # handler -> executor name
+        self.handler_executors = {}
+        # names of executors whose overflow is OVERFLOW_BLOCK
+        self.blocking = set()
+        # id of event -> executors reserved for it, see reserve()
+        self.reservations = {}
 
     def emit(self, event):
         """
@@ -39,22 +53,104 @@ class EventManager(Component):
 
         :param event: MirrorEvent
         """
-        if event.name not in self.handlers:
+        # e.g. QueueChangedEvent is split into TaskEnqueueEvents
+        split_name = getattr(event, "split_name", None)
+        if event.name not in self.handlers and split_name not in self.handlers:
             return
 
-        if (not self.plugin_thread) or (not self.plugin_thread.isAlive()):
-            if self.plugin_thread:
-                del self.plugin_thread
+        if self.blocking:
+            self.reserve(event)
+        if (not self.plugin_thread) or self.plugin_thread.finished:
             self.plugin_thread = PluginThread()
             self.plugin_thread.start()
         self.plugin_thread.add_event(event)
 
-    def register_event_handler(self, event, handler):
+    def reserve(self, event):
+        """
+        Wait until executors with OVERFLOW_BLOCK that handle `event`
+        have room, and take a place in each of them, the plugin thread
+        gives them back after `event` is dispatched. So the plugin
+        thread itself never waits for them.
+
+        """
+        executors = []
+        for name in (event.name, getattr(event, "split_name", None)):
+            for handler in list(self.handlers.get(name, ())):
+                if self.handler_executors.get(handler, self.DEFAULT_EXECUTOR) not in self.blocking:
+                    continue
+                executor = self.get_executor(handler)
+                if executor not in executors:
+                    executor.reserve()
+                    executors.append(executor)
+        if executors:
+            self.reservations[id(event)] = executors
+
+    def drain(self, timeout = None):
+        """
+        Wait until all events emitted are handled.
+
+        :param timeout: the seconds to wait at most, None means no limit
+        :returns: True if all events are handled
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self.plugin_thread and not self.plugin_thread.drain(timeout):
+            return False
+        for executor in list(self.executors.values()):
+            if deadline is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+            if not executor.drain(timeout):
+                return False
+        return True
+
+    def get_metrics(self):
+        """
+        See WorkerThread.get_metrics(), metrics of executors are in `executors`.
+
+        """
+        metrics = self.plugin_thread.get_metrics() if self.plugin_thread else {}
+        metrics["executors"] = dict((name, executor.get_metrics())
+                                    for name, executor in self.executors.items())
+        return metrics
+
+    def set_executor(self, name, **options):
+        """
+        Set options of the executor `name`, e.g. the name of a plugin.
+
+        :param options: see HandlerExecutor
+
+        """
+        self.executor_options[name] = options
+        if options.get("overflow") == OVERFLOW_BLOCK:
+            self.blocking.add(name)
+        else:
+            self.blocking.discard(name)
+        executor = self.executors.get(name, None)
+        if executor is not None:
+            for key, value in options.items():
+                setattr(executor, key, value)
+
+    def get_executor(self, handler):
+        """
+        :returns: the HandlerExecutor that runs `handler`
+
+        """
+        name = self.handler_executors.get(handler, self.DEFAULT_EXECUTOR)
+        executor = self.executors.get(name, None)
+        if executor is None or not executor.is_alive():
+            executor = HandlerExecutor(name, **self.executor_options.get(name, {}))
+            executor.start()
+            self.executors[name] = executor
+        return executor
+
+    def register_event_handler(self, event, handler, executor = None):
         """
         Register a function to be called when a `:param:event` is emitted.
 
         :param event: string, the event name
         :param handler: function, to be called when `:param:event` is emitted
+        :param executor: string, the executor to run `:param:handler`, by default
+                         it is the name of the plugin if handler is its method
 
         """
         if event not in self.handlers:
@@ -63,6 +159,11 @@ class EventManager(Component):
         if handler not in self.handlers[event]:
             self.handlers[event].append(handler)
 
+        if executor is None:
+            owner    = getattr(handler, "__self__", None)
+            executor = getattr(owner, "name", None) or self.DEFAULT_EXECUTOR
+        self.handler_executors[handler] = executor
+
     def deregister_event_handler(self, event, handler):
         """
         Deregisters an event handler function.
@@ -77,8 +178,10 @@ class EventManager(Component):
     def stop(self):
         """
         When EventManager is stopped, if plugin_thread is still alive,
-        set the stop_event to make it exit.
+        make it exit after the events left are handled, and then executors.
 
         """
-        if self.plugin_thread and self.plugin_thread.isAlive():
-            self.plugin_thread.stop_event.set()
+        if self.plugin_thread and self.plugin_thread.is_alive():
+            self.plugin_thread.stop()
+        for executor in self.executors.values():
+            executor.stop()
@@ -21,7 +21,6 @@
 #
 
 import os
-import time
 import signal
 import logging
 import mirror.common
@@ -57,9 +56,7 @@ def shutdown_handler(signo, frame):
         log.info("Killed mirror dbus with pid: %d", pid)
 
     event_manager = component.get("EventManager")
-    while (event_manager.plugin_thread and
-           len(event_manager.plugin_thread.event_queue) > 0):
-        time.sleep(0.1)
+    event_manager.drain()
     component.deregister(event_manager)
     component.deregister(component.get("PluginManager"))
 
@@ -73,15 +70,10 @@ def shutdown_handler(signo, frame):
     sys.exit(0)
 
 def sigchld_handler(signo, frame):
-    try:
-        pid, status = os.waitpid(-1, os.WNOHANG)
-    except OSError as e:
-        log.error("Error occurred when waitpid(), %s.", e)
+    scheduler = reap_children()
+    if scheduler is None or not scheduler.sleeping:
+        # the main loop will find the exited children before it sleeps
         return
-    scheduler = component.get("Scheduler")
-    if scheduler is None:
-        return
-    scheduler.stop_task_with_pid(pid, status)
 
     # In Python 3, execution of signal handler will not terminate the sleep() as Python 2
     # But it will still be terminated if signal handler raises an exception
@@ -89,9 +81,44 @@ def sigchld_handler(signo, frame):
     # https://mozillazg.com/2017/07/python-time-sleep-terminate-by-signal.html
 
     if mirror.common.is_python3():
+        scheduler.sleeping = False
         raise mirror.error.MirrordTaskFinishedFakeError("Task finished, please stop sleep")
 
+def reap_children():
+    """
+    Reap all exited children, SIGCHLD is not queued, so one signal
+    may stand for several children. They are passed to the scheduler,
+    which handles them later in its main loop.
+
+    :returns: the scheduler, or None if there is no scheduler
+
+    """
+    scheduler = component.get("Scheduler")
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        except OSError as e:
+            log.error("Error occurred when waitpid(), %s.", e)
+            break
+        if pid == 0:
+            break
+        if scheduler is not None:
+            scheduler.child_exited(pid, status)
+    return scheduler
+
 def reload_handler(signo, frame):
     log.info("Got signal %s, start reloading...", signals[signo])
     scheduler = component.get("Scheduler")
-    scheduler.reload_config()
+    if scheduler is None:
+        return
+    # config is reloaded in the main loop, see process_reload()
+    scheduler.request_reload()
+    if not scheduler.sleeping:
+        return
+
+    # see sigchld_handler()
+    if mirror.common.is_python3():
+        scheduler.sleeping = False
+        raise mirror.error.MirrordTaskFinishedFakeError("Reload requested, please stop sleep")
@@ -0,0 +1,299 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Stages of a task, run as a small DAG, e.g. in mirror.ini:
+
+    stages        = pool dists indices
+    pool.path     = pool
+    pool.shards   = 4
+    dists.path    = dists
+    indices.path  = indices
+    indices.after = pool
+
+`dists` runs after `pool` (the previous stage, by default), and so
+does `indices`, but `dists` and `indices` run at the same time.
+
+"""
+
+import time
+import shlex
+import logging
+import mirror.common
+
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+# entries are split into hashed shards by their first character,
+# see hashed_shards()
+SHARD_CHARS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+def hashed_shards(count, root):
+    """
+    Split entries in `root` into `count` shards by their first character,
+    e.g. pool/main of debian, whose entries are 0ad, a52dec, ..., libz, ...
+
+    The last shard takes all entries not taken by the others.
+
+    :returns: list of (path, rsync filter args)
+
+    """
+    chunks = [ ''.join(char + char.upper() if char.isalpha() else char
+                       for char in SHARD_CHARS[i::count])
+               for i in range(count) ]
+    shards = []
+    for chunk in chunks[:-1]:
+        shards.append((root, ['--include=/[%s]*' % chunk, '--exclude=/*']))
+    shards.append((root, ['--exclude=/[%s]*' % ''.join(chunks[:-1])]))
+    return shards
+
+def parse_shards(shards, root):
+    """
+    Parse `shards` of config, it is a number of hashed shards of `root`
+    (see hashed_shards()), or a list of directories in `root`, one shard
+    for each.
+
+    :returns: list of (path, rsync filter args), empty if not sharded
+
+    """
+    if not shards:
+        return ()
+    if shards.isdigit():
+        count = min(int(shards), len(SHARD_CHARS))
+        return hashed_shards(count, root) if count > 1 else ()
+    return [ (join_path(root, directory), []) for directory in shards.split() ]
+
+def join_path(root, path):
+    """
+    :returns: `path` in `root`, ends with '/', or '' for the top directory
+
+    """
+    path = '/'.join(part for part in (root.strip('/'), path.strip('/')) if part)
+    return path + '/' if path else ''
+
+class Stage(object):
+    """
+    A stage of a task, it is run by one process, or one for each shard.
+
+    :param name: name of the stage
+    :param path: the directory synced by the stage, '' for the whole tree
+    :param args: list of args for the command
+    :param exclude: list of exclude args
+    :param timeout: seconds the stage can run, 0 means no limit
+    :param after: indexes of stages that must finish before the stage
+    :param shards: list of (path, filter args), see parse_shards()
+
+    """
+    __slots__ = ("name", "path", "args", "exclude", "timeout", "after", "shards")
+
+    def __init__(self, name, path = '', args = (), exclude = (), timeout = 0,
+                 after = (), shards = ()):
+        self.name    = name
+        self.path    = path
+        self.args    = list(args)
+        self.exclude = list(exclude)
+        self.timeout = timeout
+        self.after   = tuple(after)
+        self.shards  = shards
+
+    def get_jobs(self):
+        """
+        :returns: list of shards to run, None means the stage is not sharded
+
+        """
+        return list(range(len(self.shards))) if self.shards else [ None ]
+
+def parse_stages(taskinfo, args, exclude):
+    """
+    Parse `stages` of config, every stage has these optional keys:
+
+        <stage>.path     the directory to sync, default is the whole tree
+        <stage>.args     default is `args` of the task
+        <stage>.exclude  default is `exclude` of the task
+        <stage>.timeout  default is 0, no timeout
+        <stage>.shards   see parse_shards(), in <stage>.path
+        <stage>.after    stages to wait for, default is the previous one
+
+    :param args: default args string
+    :param exclude: default exclude string
+    :returns: list of Stage, or None if `stages` is not set
+    :raises ValueError: if stages are not valid
+
+    """
+    names = taskinfo.get("stages", "").split()
+    if not names:
+        return None
+    if len(set(names)) != len(names):
+        raise ValueError("stage names are not unique")
+    # ConfigParser keeps keys in lower case
+    index  = dict((name.lower(), i) for i, name in enumerate(names))
+    stages = []
+    for i, name in enumerate(names):
+        def get(key, default = None):
+            return taskinfo.get(name.lower() + "." + key, default)
+        after = get("after", names[i - 1] if i > 0 else "").split()
+        for dependency in after:
+            if dependency.lower() not in index:
+                raise ValueError("stage %s is after unknown stage %s" % (name, dependency))
+        path  = join_path('', get("path", ''))
+        stages.append(Stage(name, path,
+                            args    = shlex.split(get("args", args) or ''),
+                            exclude = shlex.split(get("exclude", exclude) or ''),
+                            timeout = mirror.common.parse_timestr(get("timeout", "0")),
+                            after   = [ index[dependency.lower()] for dependency in after ],
+                            shards  = parse_shards(get("shards"), path)))
+    check_acyclic(stages)
+    return stages
+
+def check_acyclic(stages):
+    """
+    :raises ValueError: if stages wait for each other
+
+    """
+    finished = set()
+    while len(finished) < len(stages):
+        ready = [ i for i, stage in enumerate(stages) if i not in finished and
+                  all(dependency in finished for dependency in stage.after) ]
+        if not ready:
+            raise ValueError("stages %s wait for each other" %
+                             ", ".join(stage.name for i, stage in enumerate(stages)
+                                       if i not in finished))
+        finished.update(ready)
+
+class Pipeline(object):
+    """
+    A run of stages of a task, a stage is started as soon as all the
+    stages it waits for succeeded, with at most `maxjobs` processes
+    running at the same time.
+
+    If any process fails, no more processes are started, so a stage
+    that deletes files (e.g. with --delete-after) can be put after
+    the others to keep the mirror consistent.
+
+    A job is (index of stage, index of shard or None).
+
+    """
+    def __init__(self, taskname, stages, maxjobs):
+        self.taskname = taskname
+        self.stages   = stages
+        self.maxjobs  = max(maxjobs, 1)
+        # pid -> job
+        self.running  = {}
+        # jobs of started stages waiting for their turn
+        self.pending  = deque()
+        # index of stage -> the number of its unfinished jobs
+        self.left     = {}
+        # index of stage -> the time it started
+        self.started  = {}
+        self.done     = set()
+        # the first error code
+        self.code     = 0
+        # no more jobs are started, see abort()
+        self.aborted  = False
+
+    def ready(self):
+        """
+        Start stages that are ready.
+
+        :returns: list of jobs to start now, add() or abort() must be
+                  called for each of them
+
+        """
+        if not self.aborted:
+            now = time.time()
+            for index, stage in enumerate(self.stages):
+                if index in self.started:
+                    continue
+                if not all(dependency in self.done for dependency in stage.after):
+                    continue
+                jobs = stage.get_jobs()
+                self.started[index] = now
+                self.left[index]    = len(jobs)
+                self.pending.extend((index, shard) for shard in jobs)
+        jobs = []
+        while self.pending and len(self.running) + len(jobs) < self.maxjobs:
+            jobs.append(self.pending.popleft())
+        return jobs
+
+    def add(self, pid, job):
+        self.running[pid] = job
+
+    def abort(self, code = 0):
+        """
+        Start no more jobs, e.g. one of them failed, or the task is stopped.
+
+        """
+        self.code    = self.code or code
+        self.aborted = True
+        self.pending.clear()
+
+    def exited(self, pid, code):
+        """
+        :returns: True if the pipeline is finished, i.e. nothing is running
+                  and nothing can be started
+
+        """
+        index, shard = self.running.pop(pid)
+        if code != 0:
+            log.error("Stage %s of task: %s failed with code %d",
+                      self.get_job_name((index, shard)), self.taskname, code)
+            self.abort(code)
+        else:
+            self.left[index] -= 1
+            if self.left[index] == 0:
+                self.done.add(index)
+                log.info("Stage %s of task: %s finished",
+                         self.stages[index].name, self.taskname)
+        return self.is_finished()
+
+    def is_finished(self):
+        if self.running or self.pending:
+            return False
+        return self.aborted or len(self.done) == len(self.stages)
+
+    def get_width(self):
+        """
+        :returns: the most processes that may run at the same time
+
+        """
+        chained = all(stage.after == ((index - 1, ) if index > 0 else ())
+                      for index, stage in enumerate(self.stages))
+        if not chained:
+            return self.maxjobs
+        return min(self.maxjobs, max(len(stage.get_jobs()) for stage in self.stages))
+
+    def get_pids(self):
+        return list(self.running)
+
+    def get_job_name(self, job):
+        index, shard = job
+        name = self.stages[index].name
+        return name if shard is None else "%s[%d]" % (name, shard)
+
+    def get_deadline(self):
+        """
+        :returns: the time when a running stage timeouts, or None
+
+        """
+        deadlines = [ self.started[index] + self.stages[index].timeout
+                      for index in self.started
+                      if index not in self.done and self.stages[index].timeout > 0 ]
+        return min(deadlines) if deadlines else None
@@ -27,6 +27,7 @@ import mirror.common
 import mirror.configmanager
 import mirror.component as component
 from mirror.component import Component
+from mirror.pluginthread import OVERFLOWS
 
 log = logging.getLogger("pluginmanager")
 
@@ -92,6 +93,7 @@ class PluginManager(Component):
                 )
                 log.exception(e)
                 continue
+            self.set_executor(instance.plugin.name, plugin_name_key.lower())
             instance.enable()
             if not instance.__module__.startswith("mirror.plugins."):
                 log.warn("Wrong module for plugin: %s", entry_point.name)
@@ -101,6 +103,29 @@ class PluginManager(Component):
             self.plugins[plugin_name_display] = instance
             log.info("Plugin %s enabled...", plugin_name_display)
 
+    def set_executor(self, name, section):
+        """
+        Set options of the executor which runs event handlers of
+        plugin `name`, by keys in its `section` of config.
+
+        """
+        options = {}
+        config  = self.config[section] if section in self.config else {}
+        try:
+            if "queuesize" in config:
+                options["queuesize"] = int(config["queuesize"])
+            if "slowhandler" in config:
+                options["slowhandler"] = float(config["slowhandler"])
+        except ValueError as e:
+            log.error("Error in config for plugin: %s, %s", name, e)
+        if "overflow" in config:
+            if config["overflow"] in OVERFLOWS:
+                options["overflow"] = config["overflow"]
+            else:
+                log.error("Error in config for plugin: %s, overflow: %s not valid.",
+                          name, config["overflow"])
+        component.get("EventManager").set_executor(name, **options)
+
     def disable_plugins(self):
         plugin_names = list(self.plugins)
         for name in plugin_names:
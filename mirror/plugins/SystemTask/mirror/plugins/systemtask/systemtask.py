@@ -59,12 +59,10 @@ class SystemTask(PluginBase):
         """
         self.scheduler = component.get("Scheduler")
 
-        self.scheduler.tasks[logcleantask._name] = self.logclean_task
-        self.scheduler.active_tasks += 1
+        self.scheduler.add_task(logcleantask._name, self.logclean_task)
         log.info("Task: %s added", logcleantask._name)
 
-        self.scheduler.tasks[taskcleantask._name] = self.taskclean_task
-        self.scheduler.active_tasks += 1
+        self.scheduler.add_task(taskcleantask._name, self.taskclean_task)
         log.info("Task: %s added", taskcleantask._name)
 
     def __run_log_cleaner(self, taskinfo):
@@ -57,7 +57,8 @@ class TaskCleanTask(SystemTask):
                     continue
                 # SIGCHLD will trigger in main thread
                 if curtime - task.start_time > self.TASK_TIMEOUT:
-                    os.kill(task.pid, signal.SIGTERM)
+                    for pid in task.get_pids():
+                        os.kill(pid, signal.SIGTERM)
                     log.info("Killed task: %s, whose life exceeds %d days",
                              taskname, self.timeout_days)
             except Exception as e:
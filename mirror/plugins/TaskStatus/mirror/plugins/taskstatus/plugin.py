@@ -24,9 +24,10 @@ import os
 import time
 import json
 import logging
+import threading
 import mirror.component as component
 from mirror.pluginbase import PluginBase
-from collections import OrderedDict as odict
+from mirror.upstream   import rsync_source
 
 _plugin_name = "taskstatus"
 
@@ -64,6 +65,9 @@ class Plugin(PluginBase):
 
     DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+    # changes within these seconds are written together
+    DEFAULT_FLUSH_DELAY = 1.0
+
     def enable(self):
         plugin_manager = component.get("PluginManager")
         config = plugin_manager.config
@@ -75,6 +79,19 @@ class Plugin(PluginBase):
             log.info(("Didn't set `status_file` in plugin.ini in `%s` section"
                       ", use default one: %s"), _plugin_name, self.status_file)
 
+        try:
+            self.flush_delay = float(config[_plugin_name]["flush_delay"])
+        except:
+            self.flush_delay = Plugin.DEFAULT_FLUSH_DELAY
+
+        # task name -> status, and task name -> status encoded in json
+        self.task_status = {}
+        self.encoded     = {}
+        # content of status file last written
+        self.content     = None
+        self.lock        = threading.Lock()
+        self.timer       = None
+
         self.enabled = True
         status_dir   = os.path.dirname(self.status_file)
         if not os.path.exists(status_dir):
@@ -83,27 +100,38 @@ class Plugin(PluginBase):
             except:
                 self.enabled = False
                 log.warning("Create directory failed: %s", status_dir)
+        if self.enabled:
+            self.__load_status()
 
         event_manager  = component.get("EventManager")
-        event_manager.register_event_handler("TaskEnqueueEvent",
-                                             self.__on_task_enqueue)
+        event_manager.register_event_handler("QueueChangedEvent",
+                                             self.__on_queue_changed)
         event_manager.register_event_handler("TaskStartEvent",
                                              self.__on_task_start)
         event_manager.register_event_handler("TaskStopEvent",
                                              self.__on_task_stop)
 
     def disable(self):
-        pass
+        if not self.enabled:
+            return
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+        self.flush()
 
-    def __on_task_enqueue(self, taskname):
+    def __on_queue_changed(self, tasknames):
         if not self.enabled:
             return
 
         scheduler = component.get("Scheduler")
-        taskinfo  = scheduler.queue.find(taskname)
-        status    = { "schedule": time.strftime(self.DATE_FORMAT,
-                                       time.localtime(taskinfo.time)) }
-        self.__set_task_status(taskname, status, overwrite = False)
+        for taskname in tasknames:
+            taskinfo  = scheduler.queue.find(taskname)
+            if not taskinfo:
+                continue
+            status    = { "schedule": time.strftime(self.DATE_FORMAT,
+                                           time.localtime(taskinfo.time)) }
+            self.__set_task_status(taskname, status, overwrite = False)
 
     def __on_task_start(self, taskname, pid):
         if not self.enabled:
@@ -130,6 +158,9 @@ class Plugin(PluginBase):
 
         status["exitcode"] = exitcode
         status["date"] = time.strftime(self.DATE_FORMAT)
+        # see mirror.cgroup
+        if task.usage:
+            status["usage"] = task.usage
 
         taskinfo = scheduler.queue.find(taskname)
         if taskinfo:
@@ -144,50 +175,99 @@ class Plugin(PluginBase):
         scheduler = component.get("Scheduler")
         task = scheduler.tasks.get(taskname)
         # We do not export internal task's status
-        if task.isinternal:
+        if task is None or task.isinternal:
             return
 
         # Add info about upstream
         if task.__class__.__name__ == "Task":
-            status['upstream'] = task.upstream[0] + '::' + task.rsyncdir + '/'
+            status['upstream'] = rsync_source(task.get_upstream(), task.rsyncdir)
 
-        # Read old status file content
-        try:
-            fp = open(self.status_file, "r+" if os.path.exists(self.status_file) else "w+")
-        except:
-            log.warning("Open file failed: %s", self.status_file)
-            return
-        task_status = fp.read().rstrip("\r\n")
-        if task_status:
-            try:
-                task_status = json.loads(task_status)
-            except Exception as e:
-                log.warning("Parse json file(%s) failed: %s", self.status_file, e)
-                task_status = {}
+        with self.lock:
+            if overwrite:
+                self.task_status[taskname] = status
             else:
-                # Remove tasks that already been removed from config file
-                list(map(lambda taskname: task_status.pop(taskname),
-                    filter(lambda taskname: taskname not in scheduler.config, list(task_status))))
-        else:
-            task_status = {}
+                if taskname in self.task_status:
+                    self.task_status[taskname]["schedule"] = status["schedule"]
+                else:
+                    status["status"] = self.STATUS_INITIAL
+                    self.task_status[taskname] = status
+            self.encoded.pop(taskname, None)
 
-        if overwrite:
-            task_status[taskname] = status
-        else:
-            if taskname in task_status:
-                task_status[taskname]["schedule"] = status["schedule"]
-            else:
-                status["status"] = self.STATUS_INITIAL
-                task_status[taskname] = status
+            # write the changes later, together with others
+            if self.timer is None:
+                self.timer = threading.Timer(self.flush_delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
 
-        if len(task_status) > 1:
-            task_status = odict(sorted(task_status.items()))
-        fp.seek(0)
+    def __load_status(self):
+        """
+        Read status written before, e.g. by last run of mirrord.
+
+        """
+        try:
+            with open(self.status_file, "r") as fp:
+                content = fp.read()
+        except IOError:
+            return
         try:
-            fp.write(json.dumps(task_status, indent = 2))
+            task_status = json.loads(content) if content.strip() else {}
         except Exception as e:
-            log.exception(e)
-            fp.truncate(0)
-        else:
-            fp.truncate()
-        fp.close()
+            log.warning("Parse json file(%s) failed: %s", self.status_file, e)
+            return
+        with self.lock:
+            self.task_status = task_status
+            self.encoded     = {}
+            self.content     = content
+
+    def encode(self):
+        """
+        Encode status like json.dumps(odict(sorted(task_status.items())), indent = 2),
+        but only status changed since last time is encoded again.
+
+        """
+        if not self.task_status:
+            return "{}"
+        items = []
+        for taskname in sorted(self.task_status):
+            if taskname not in self.encoded:
+                self.encoded[taskname] = "  %s: %s" % (json.dumps(taskname),
+                    json.dumps(self.task_status[taskname], indent = 2).replace("\n", "\n  "))
+            items.append(self.encoded[taskname])
+        return "{\n" + ",\n".join(items) + "\n}"
+
+    def flush(self):
+        """
+        Write status into status file, by a temp file and rename(),
+        so readers never see a partly written file.
+
+        """
+        scheduler = component.get("Scheduler")
+        with self.lock:
+            self.timer = None
+            # Remove tasks that already been removed from config file
+            if scheduler is not None:
+                for taskname in list(self.task_status):
+                    if taskname not in scheduler.config:
+                        self.task_status.pop(taskname)
+                        self.encoded.pop(taskname, None)
+            try:
+                content = self.encode()
+            except Exception as e:
+                log.exception(e)
+                return
+            if content == self.content:
+                return
+
+            tmpfile = "%s.%d.tmp" % (self.status_file, os.getpid())
+            try:
+                with open(tmpfile, "w") as fp:
+                    fp.write(content)
+                os.rename(tmpfile, self.status_file)
+            except Exception as e:
+                log.warning("Write file failed: %s, %s", self.status_file, e)
+                try:
+                    os.unlink(tmpfile)
+                except OSError:
+                    pass
+                return
+            self.content = content
@@ -21,49 +21,384 @@
 #
 
 
+
 import time
 import logging
 import threading
 import mirror.component as component
 
+from collections import deque
+
 log = logging.getLogger("pluginthread")
 
-class PluginThread(threading.Thread):
+# what HandlerExecutor.submit() does when its queue is full
+OVERFLOW_BLOCK       = "block"       # EventManager.emit() waits for room
+OVERFLOW_DROP_OLDEST = "drop-oldest" # drop the oldest call in the queue
+OVERFLOW_COALESCE    = "coalesce"    # ignore a call same as a queued one,
+                                     # and drop the oldest if there is no such call
+OVERFLOWS = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE)
 
-    def __init__(self):
-        threading.Thread.__init__(self, name="mirror.plugin")
-        # python list is thread safe
-        self.event_queue   = [ ]
-        self.event_manager = component.get("EventManager")
-        self.stop_event    = threading.Event()
+class WorkerThread(threading.Thread):
+    """
+    A thread waits on self.condition until items are added, then
+    process() them in order, it stays until stop() is called.
 
-    def add_event(self, event):
-        self.event_queue.append(event)
+    Items queued are taken together, so a burst of items costs
+    one wake-up and one lock for the thread. put() only takes the lock
+    to wake up the thread when it is waiting, as deque.append() and
+    popleft() are atomic.
+
+    """
+    def __init__(self, name):
+        threading.Thread.__init__(self, name=name)
+        # the thread should not keep mirrord from exiting
+        self.daemon        = True
+        # (added time, item)
+        self.event_queue   = deque()
+        # events may be emitted in signal handlers, so it must be reentrant
+        self.condition     = threading.Condition(threading.RLock())
+        self.stopping      = False
+        # whether items taken are being processed
+        self.busy          = False
+        # whether the thread is waiting, or about to wait, for items
+        self.waiting       = False
+        # set when run() returns
+        self.finished      = False
+
+        # metrics, see get_metrics()
+        self.processed     = 0
+        self.max_depth     = 0
+        self.total_latency = 0.0
+        self.max_latency   = 0.0
+
+    def put(self, item):
+        queue = self.event_queue
+        queue.append((time.monotonic(), item))
+        if len(queue) > self.max_depth:
+            self.max_depth = len(queue)
+        # see run() for why it is not missed
+        if self.waiting:
+            with self.condition:
+                self.condition.notify_all()
+
+    def put_locked(self, items):
+        """
+        Add `items`, self.condition must be held.
+
+        """
+        queue = self.event_queue
+        added = time.monotonic()
+        for item in items:
+            queue.append((added, item))
+        if len(queue) > self.max_depth:
+            self.max_depth = len(queue)
+        if self.waiting:
+            self.condition.notify_all()
+
+    def take_locked(self):
+        """
+        Take all queued items, self.condition must be held.
+
+        """
+        # items may be appended by put() meanwhile
+        queue = self.event_queue
+        return [ queue.popleft() for i in range(len(queue)) ]
 
     def run(self):
-        log.debug("Plugin thread started")
-        sleep_count = 0
+        try:
+            self.loop()
+        finally:
+            self.finished = True
+
+    def loop(self):
+        log.debug("%s started", self.name)
         while (True):
-            if self.stop_event.isSet() and len(self.event_queue) == 0:
-                log.debug("PluginThread's stop_event is set, thread is exiting...")
-                break
-            try:
-                event = self.event_queue.pop(0)
-            except:
-                time.sleep(0.1)
-                sleep_count += 1
-                if sleep_count > 600:
-                    log.debug("Plugin thread finished")
+            with self.condition:
+                self.busy = False
+                if not self.event_queue:
+                    # for drain()
+                    self.condition.notify_all()
+                # `waiting` is set before checking the queue, so put()
+                # either appends before the check, or sees `waiting`
+                # after appending and waits for the lock to notify us
+                while True:
+                    self.waiting = True
+                    if self.event_queue or self.stopping:
+                        break
+                    self.condition.wait()
+                self.waiting = False
+                if not self.event_queue:
+                    log.debug("%s is stopped, thread is exiting...", self.name)
                     break
-                else:
+                items = self.take_locked()
+                self.busy = True
+                # for EventManager.emit() waiting for room
+                self.condition.notify_all()
+
+            now = time.monotonic()
+            for added, item in items:
+                latency = now - added
+                self.total_latency += latency
+                if latency > self.max_latency:
+                    self.max_latency = latency
+            self.processed += len(items)
+            self.process_items([ item for added, item in items ])
+        log.debug("%s finished", self.name)
+
+    def process_items(self, items):
+        for item in items:
+            self.process(item)
+
+    def process(self, item):
+        raise NotImplementedError("Need to define a process method!")
+
+    def drain(self, timeout = None):
+        """
+        Wait until all items added are processed.
+
+        :returns: True if drained, False if timed out
+
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                       lambda: not (self.event_queue or self.busy) or not self.is_alive(),
+                       timeout)
+
+    def stop(self, timeout = None):
+        """
+        Process the items left, then make the thread exit.
+
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(timeout)
+
+    def get_metrics(self):
+        """
+        :returns: dict, the current and max queue depth, the number of items
+                  processed, the average and max seconds from added to processed
+
+        """
+        with self.condition:
+            return { "depth"       : len(self.event_queue),
+                     "max_depth"   : self.max_depth,
+                     "processed"   : self.processed,
+                     "latency"     : (self.total_latency / self.processed
+                                      if self.processed else 0.0),
+                     "max_latency" : self.max_latency,
+                   }
+
+class PluginThread(WorkerThread):
+    """
+    The thread dispatches events to the HandlerExecutor of each handler,
+    so a slow handler of one plugin does not delay the others.
+
+    It never waits for a HandlerExecutor, see HandlerExecutor.submit().
+
+    """
+    def __init__(self):
+        super(PluginThread, self).__init__("mirror.plugin")
+        self.event_manager = component.get("EventManager")
+
+    def add_event(self, event):
+        self.put(event)
+
+    def process_items(self, events):
+        handlers  = self.event_manager.handlers
+        # executor -> calls for it, in the order of events
+        calls     = {}
+        executors = {}
+        for event in events:
+            self.dispatch(event, calls, executors)
+            if getattr(event, "split_name", None) in handlers:
+                for item in event.split():
+                    self.dispatch(item, calls, executors)
+        for executor, items in calls.items():
+            executor.submit_items(items)
+        reservations = self.event_manager.reservations
+        if reservations:
+            for event in events:
+                for executor in reservations.pop(id(event), ()):
+                    executor.unreserve()
+
+    def process(self, event):
+        self.process_items([ event ])
+
+    def dispatch(self, event, calls, executors):
+        for handler in self.event_manager.handlers.get(event.name, ()):
+            executor = executors.get(handler)
+            if executor is None:
+                executor = self.event_manager.get_executor(handler)
+                executors[handler] = executor
+            calls.setdefault(executor, []).append((handler, event.name, tuple(event.args)))
+
+class HandlerExecutor(WorkerThread):
+    """
+    The thread runs the handlers of one plugin.
+
+    :param name: the name of the plugin
+    :param queuesize: the max number of calls waiting in the queue
+    :param overflow: what to do when the queue is full, see OVERFLOWS
+    :param slowhandler: warn if a handler runs longer than these seconds,
+                        0 means no warning
+
+    """
+    def __init__(self, name, queuesize = 1000, overflow = OVERFLOW_DROP_OLDEST,
+                 slowhandler = 1.0):
+        super(HandlerExecutor, self).__init__("mirror.plugin." + name)
+        self.queuesize   = queuesize
+        self.overflow    = overflow
+        self.slowhandler = slowhandler
+        self.dropped     = 0
+        self.coalesced   = 0
+        # the number of events emitted for this executor but not
+        # dispatched yet, with OVERFLOW_BLOCK, see reserve()
+        self.reserved    = 0
+        # calls in the queue, for coalesce,
+        # calls with unhashable args are never coalesced
+        self.pending     = set()
+        # handler name -> [calls, total seconds, max seconds]
+        self.timing      = {}
+
+    def submit(self, event, handler):
+        self.submit_items([ (handler, event.name, tuple(event.args)) ])
+
+    def submit_items(self, items):
+        """
+        Queue calls of (handler, event name, args), it never waits:
+        with OVERFLOW_BLOCK, EventManager.emit() waits for room instead,
+        see reserve().
+
+        """
+        with self.condition:
+            if self.overflow == OVERFLOW_COALESCE:
+                items = self.coalesce(items)
+                if not items:
+                    return
+            self.put_locked(items)
+            if self.overflow == OVERFLOW_BLOCK:
+                return
+            while len(self.event_queue) > self.queuesize > 0:
+                added, item = self.event_queue.popleft()
+                self.forget(item)
+                self.dropped += 1
+                log.warning("Queue of %s is full, dropped %s for event %s",
+                            self.name, handler_name(item[0]), item[1])
+
+    def is_full(self):
+        return len(self.event_queue) + self.reserved >= self.queuesize > 0
+
+    def reserve(self):
+        """
+        Wait until the queue is not full, then take a place in it for
+        an event being emitted, it is called by EventManager.emit(),
+        and given back by unreserve() once the event is dispatched.
+
+        """
+        with self.condition:
+            # a handler of this executor may emit an event
+            if self is not threading.current_thread():
+                self.condition.wait_for(lambda: not self.is_full() or self.finished)
+            self.reserved += 1
+
+    def unreserve(self):
+        with self.condition:
+            self.reserved -= 1
+            self.condition.notify_all()
+
+    def coalesce(self, items):
+        """
+        :returns: `items` which are not queued yet, they are added into
+                  self.pending, self.condition must be held
+
+        """
+        accepted = []
+        pending  = self.pending
+        for item in items:
+            key = self.get_key(item)
+            if key is not None:
+                if key in pending:
+                    self.coalesced += 1
                     continue
-            # Call any handlers for the event
-            for handler in self.event_manager.handlers[event.name]:
+                pending.add(key)
+            accepted.append(item)
+        return accepted
+
+    def get_key(self, item):
+        try:
+            hash(item)
+        except TypeError:
+            return None
+        return item
+
+    def forget(self, item):
+        key = self.get_key(item)
+        if key is not None:
+            self.pending.discard(key)
+
+    def take_locked(self):
+        items = super(HandlerExecutor, self).take_locked()
+        if self.pending:
+            for added, item in items:
+                self.forget(item)
+        return items
+
+    def process_items(self, items):
+        debug   = log.isEnabledFor(logging.DEBUG)
+        # handler -> [calls, total seconds, max seconds] of this batch
+        timings = {}
+        end     = time.monotonic()
+        for handler, name, args in items:
+            if debug:
                 log.debug("Running handler %s for event %s with args: %s",
-                          event.name, handler, event.args)
-                try:
-                    handler(*event.args)
-                except Exception as e:
-                    log.error("Event handler %s failed in %s with exception: %s",
-                              event.name, handler, e)
+                          handler, name, args)
+            start = end
+            try:
+                handler(*args)
+            except Exception as e:
+                log.error("Event handler %s failed in %s with exception: %s",
+                          name, handler, e)
+            end     = time.monotonic()
+            elapsed = end - start
+            timing  = timings.get(handler)
+            if timing is None:
+                timings[handler] = [1, elapsed, elapsed]
+            else:
+                timing[0] += 1
+                timing[1] += elapsed
+                if elapsed > timing[2]:
+                    timing[2] = elapsed
+            if self.slowhandler > 0 and elapsed > self.slowhandler:
+                log.warning("Event handler %s for event %s is slow, it took %.3f seconds",
+                            handler_name(handler), name, elapsed)
+
+        with self.condition:
+            for handler, (calls, total, longest) in timings.items():
+                timing = self.timing.setdefault(handler_name(handler), [0, 0.0, 0.0])
+                timing[0] += calls
+                timing[1] += total
+                if longest > timing[2]:
+                    timing[2] = longest
+
+    def process(self, item):
+        self.process_items([ item ])
+
+    def get_metrics(self):
+        """
+        See WorkerThread.get_metrics(), in addition, the number of calls
+        dropped or coalesced, and the timing of each handler:
+        handler name -> (calls, total seconds, max seconds).
+
+        """
+        metrics = super(HandlerExecutor, self).get_metrics()
+        with self.condition:
+            metrics["dropped"]   = self.dropped
+            metrics["coalesced"] = self.coalesced
+            metrics["handlers"]  = dict((name, tuple(timing))
+                                        for name, timing in self.timing.items())
+        return metrics
 
+def handler_name(handler):
+    return getattr(handler, "__qualname__", repr(handler))
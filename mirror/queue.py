@@ -20,9 +20,11 @@
 #
 #
 
-import bisect
+import heapq
+
+class TaskInfo(object):
+    __slots__ = ("name", "tasktype", "time", "priority")
 
-class TaskInfo():
     def __init__(self, name, tasktype, time, priority):
         self.name     = name
         self.tasktype = tasktype
@@ -44,63 +46,298 @@ class TaskInfo():
         return "(name: %s, type: %d, time: %d, priority: %d)" % (self.name,
                                     self.tasktype, self.time, self.priority)
 
+# Layout of a heap entry, entries are plain lists so that they are
+# compared field by field: (time, priority, seq) is always unique
+# because of seq, so item and position never take part in comparing.
+_TIME, _PRIORITY, _SEQ, _ITEM, _POS = range(5)
+
 class Queue(object):
+    """
+    A priority queue of TaskInfo, ordered by (time, priority), items
+    with equal keys are kept in insertion order.
+
+    It is an indexed binary heap: every entry knows its position in the
+    heap, and entries are also indexed by task name, so put(), get(),
+    remove() and update() are O(log n), find() and `in` are O(1).
+
+    NOTE:
+    If `time` or `priority` of a queued TaskInfo is changed, update()
+    must be called to keep the queue in order.
+
+    `changed` collects names of items that are put, removed or updated,
+    it is cleared by the user of the queue.
+
+    """
     def __init__(self, *items):
-        self.queue = []
+        self._heap  = []
+        # task name -> list of entries,
+        # usually there is only one entry for each name
+        self._names = {}
+        self._seq   = 0
+        self.changed = set()
         for item in items:
             if not isinstance(item, TaskInfo):
                 continue
             self.put(item)
 
     def put(self, item):
-        bisect.insort(self.queue, item)
+        self._seq += 1
+        entry = [item.time, item.priority, self._seq, item, len(self._heap)]
+        self._heap.append(entry)
+        self._names.setdefault(item.name, []).append(entry)
+        self._sift_up(entry[_POS])
+        self.changed.add(item.name)
 
     def get(self):
-        try:
-            return self.queue.pop(0)
-        except:
+        if not self._heap:
             return None
+        entry = self._heap[0]
+        self._remove_entry(entry)
+        return entry[_ITEM]
 
     def remove(self, item):
-        self.queue.remove(item)
+        """
+        Remove `item` from the queue, if `item` itself is not queued,
+        the first queued item with the same name and tasktype is removed.
+
+        :raises ValueError: if no item with the same name and tasktype is queued
+
+        """
+        entry = self._find_entry(item)
+        if entry is None:
+            raise ValueError("Queue.remove(item): item not in queue")
+        self._remove_entry(entry)
+
+    def update(self, item):
+        """
+        Move `item` to its new position after its `time` or `priority`
+        is changed, as if it was removed and put again. If `item` itself
+        is not queued, it replaces the first queued item with the same
+        name and tasktype, so the stored item always matches its heap key.
+
+        :raises ValueError: if no item with the same name and tasktype is queued
+
+        """
+        entry = self._find_entry(item)
+        if entry is None:
+            raise ValueError("Queue.update(item): item not in queue")
+        self._seq += 1
+        entry[_ITEM]     = item
+        entry[_TIME]     = item.time
+        entry[_PRIORITY] = item.priority
+        entry[_SEQ]      = self._seq
+        self._sift_up(entry[_POS])
+        self._sift_down(entry[_POS])
+        self.changed.add(item.name)
 
     def empty(self):
-        return ( len(self.queue) == 0 )
+        return ( len(self._heap) == 0 )
 
     def size(self, key = None, value = None):
         if key is None or value is None:
-            return len(self.queue)
+            return len(self._heap)
         else:
             if self.empty():
                 return 0
-            if not hasattr(self.queue[0], key):
+            if not hasattr(self._heap[0][_ITEM], key):
                 return 0
             count = 0
-            for item in self.queue:
-                count += ( getattr(item, key) == value )
+            for entry in self._heap:
+                count += ( getattr(entry[_ITEM], key) == value )
             return count
 
-    def find(self, name):
-        for taskinfo in self.queue:
-            if taskinfo.name == name:
-                return taskinfo
-        return None
+    def find(self, name, tasktype = None):
+        """
+        Find the first queued item with `name` (and `tasktype` if given).
+
+        :returns: TaskInfo or None
+
+        """
+        entries = self._names.get(name)
+        if not entries:
+            return None
+        if tasktype is not None:
+            entries = [entry for entry in entries
+                       if entry[_ITEM].tasktype == tasktype]
+            if not entries:
+                return None
+        return min(entries)[_ITEM]
+
+    def _find_entry(self, item):
+        entries = self._names.get(item.name)
+        if not entries:
+            return None
+        for entry in entries:
+            if entry[_ITEM] is item:
+                return entry
+        entries = [entry for entry in entries
+                   if entry[_ITEM].tasktype == item.tasktype]
+        if not entries:
+            return None
+        return min(entries)
+
+    def _remove_entry(self, entry):
+        heap = self._heap
+        pos  = entry[_POS]
+        last = heap.pop()
+        if last is not entry:
+            heap[pos] = last
+            last[_POS] = pos
+            self._sift_up(pos)
+            self._sift_down(last[_POS])
+        entries = self._names[entry[_ITEM].name]
+        entries.remove(entry)
+        if not entries:
+            del self._names[entry[_ITEM].name]
+        self.changed.add(entry[_ITEM].name)
+
+    def _sift_up(self, pos):
+        heap  = self._heap
+        entry = heap[pos]
+        while pos > 0:
+            parentpos = (pos - 1) >> 1
+            parent    = heap[parentpos]
+            if not entry < parent:
+                break
+            heap[pos]   = parent
+            parent[_POS] = pos
+            pos = parentpos
+        heap[pos]  = entry
+        entry[_POS] = pos
+
+    def _sift_down(self, pos):
+        heap  = self._heap
+        size  = len(heap)
+        entry = heap[pos]
+        while True:
+            childpos = 2 * pos + 1
+            if childpos >= size:
+                break
+            rightpos = childpos + 1
+            if rightpos < size and heap[rightpos] < heap[childpos]:
+                childpos = rightpos
+            child = heap[childpos]
+            if not child < entry:
+                break
+            heap[pos]   = child
+            child[_POS] = pos
+            pos = childpos
+        heap[pos]  = entry
+        entry[_POS] = pos
 
     def __getitem__(self, key):
-        try:
-            return self.queue[key]
-        except:
+        """
+        queue[0] is the first item, queue[n] is the n-th item in order,
+        and queue["name"] is the same as queue.find("name").
+
+        """
+        if isinstance(key, str):
+            return self.find(key)
+        if key < 0:
+            key += len(self._heap)
+        if key < 0 or key >= len(self._heap):
             return None
+        if key == 0:
+            return self._heap[0][_ITEM]
+        return heapq.nsmallest(key + 1, self._heap)[-1][_ITEM]
+
+    def __len__(self):
+        return len(self._heap)
 
     def __str__(self):
-        return "[" + ",".join([str(item) for item in self.queue]) + "]"
+        return "[" + ",".join([str(item) for item in self]) + "]"
 
     def __iter__(self):
-        for item in self.queue:
-            yield item
+        """
+        Iterate in order, it only costs O(k log k) for the first k items,
+        so breaking early from the loop is cheap.
+
+        """
+        heap = self._heap
+        if not heap:
+            return
+        pending = [(heap[0], 0)]
+        while pending:
+            entry, pos = heapq.heappop(pending)
+            yield entry[_ITEM]
+            for childpos in (2 * pos + 1, 2 * pos + 2):
+                if childpos < len(heap):
+                    heapq.heappush(pending, (heap[childpos], childpos))
 
     def __contains__(self, item):
-        return item in self.queue
+        name = item if isinstance(item, str) else item.name
+        return name in self._names
+
+class Deferred(object):
+    """
+    A task turned away by admission, see DeferredQueue.
+
+    :param taskinfo: TaskInfo of the task
+    :param since: when it is deferred first
+    :param attempts: the number of times it is turned away again
+    :param retry: when it is tried again at the latest
+
+    """
+    __slots__ = ("taskinfo", "since", "attempts", "retry")
+
+    def __init__(self, taskinfo, since):
+        self.taskinfo = taskinfo
+        self.since    = since
+        self.attempts = 0
+        self.retry    = since
+
+class DeferredQueue(object):
+    """
+    Tasks turned away by admission, waiting for capacity. They are
+    iterated in order of (priority, since), so when capacity is freed,
+    tasks of higher priority, then those waited longer, go first.
+
+    There are few of them, so they are sorted when iterated.
+
+    """
+    def __init__(self):
+        # task name -> Deferred
+        self._items = {}
+
+    def put(self, taskinfo, since):
+        """
+        :returns: the Deferred of `taskinfo`, the existing one if
+                  the task is already deferred
+
+        """
+        deferred = self._items.get(taskinfo.name, None)
+        if deferred is None:
+            deferred = self._items[taskinfo.name] = Deferred(taskinfo, since)
+        return deferred
+
+    def remove(self, name):
+        """
+        :returns: the removed Deferred, or None
+
+        """
+        return self._items.pop(name, None)
+
+    def find(self, name):
+        return self._items.get(name, None)
+
+    def next_retry(self):
+        """
+        :returns: the earliest retry time, or None if no task is deferred
+
+        """
+        if not self._items:
+            return None
+        return min(deferred.retry for deferred in self._items.values())
+
+    def __iter__(self):
+        return iter(sorted(self._items.values(), key = lambda deferred:
+                           (deferred.taskinfo.priority, deferred.since, deferred.taskinfo.name)))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, name):
+        return name in self._items
 
 if __name__ == "__main__":
     task1 = TaskInfo("Buy clock",    0, 1376712000, 2)
@@ -0,0 +1,149 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""Background sampler of system info for Mirror"""
+
+import logging
+import threading
+
+from collections      import deque
+from collections      import OrderedDict as odict
+from mirror.component import Component
+
+log = logging.getLogger(__name__)
+
+class Metric(object):
+    """
+    Recent samples of a system value, e.g. load average.
+
+    :param reader: function that returns current value
+    :param size: the number of samples to keep
+    :param alpha: smoothing factor of ewma, from 0 to 1
+
+    """
+    def __init__(self, reader, size = 60, alpha = 0.3):
+        self.reader  = reader
+        self.alpha   = alpha
+        self.samples = deque(maxlen = size)
+        self.last    = 0.0
+        self.ewma    = 0.0
+
+    def sample(self):
+        value = self.reader()
+        if not self.samples:
+            self.ewma = value
+        else:
+            self.ewma = self.alpha * value + (1 - self.alpha) * self.ewma
+        self.last = value
+        self.samples.append(value)
+
+    def percentile(self, percent):
+        """
+        :returns: the `percent`-th percentile (nearest rank) of recent samples
+
+        """
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        rank = int(round(percent / 100.0 * (len(samples) - 1)))
+        return samples[min(max(rank, 0), len(samples) - 1)]
+
+class SysInfoSampler(Component):
+    """
+    Sample system info (see mirror.sysinfo) every `interval` seconds in
+    its own thread, so the scheduler can read smoothed values at once.
+
+    If `interval` is 0, there is no sampler thread, sample_now() needs
+    to be called before reading values.
+
+    """
+    def __init__(self, interval = 5, size = 60, alpha = 0.3):
+        # The name is "SysInfoSampler"
+        super(SysInfoSampler, self).__init__(self.__class__.__name__)
+        self.interval   = interval
+        self.size       = size
+        self.alpha      = alpha
+        self.metrics    = odict()
+        # the number of times metrics are sampled
+        self.ticks      = 0
+        self.thread     = None
+        self.stop_event = threading.Event()
+
+    def add_metric(self, name, reader):
+        self.metrics[name] = Metric(reader, self.size, self.alpha)
+
+    def set_interval(self, interval):
+        if interval == self.interval:
+            return
+        running = self.thread is not None
+        self.stop()
+        self.interval = interval
+        if running:
+            self.start()
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        # so that values are ready before the first schedule
+        self.sample()
+        if self.interval <= 0:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target = self.run, name = "mirror.sampler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join()
+        self.thread = None
+
+    def run(self):
+        log.debug("Sampler thread started")
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+        log.debug("Sampler thread finished")
+
+    def sample(self):
+        # metrics may be added by the scheduler meanwhile
+        for name, metric in list(self.metrics.items()):
+            try:
+                metric.sample()
+            except Exception as e:
+                log.error("Error occurred when sampling %s: %s", name, e)
+        self.ticks += 1
+
+    def sample_now(self):
+        """
+        Sample metrics when there is no sampler thread.
+
+        """
+        if not self.thread:
+            self.sample()
+
+    def ewma(self, name):
+        return self.metrics[name].ewma
+
+    def last(self, name):
+        return self.metrics[name].last
+
+    def percentile(self, name, percent):
+        return self.metrics[name].percentile(percent)
@@ -25,16 +25,11 @@
 
 import os, sys
 import time
-import fcntl
+import random
 import signal
 import logging
 import weakref
-import mmap
-import struct
-try:
-    import cPickle as pickle
-except:
-    import pickle
+import functools
 
 import mirror.common
 import mirror.error
@@ -45,11 +40,24 @@ from mirror.configmanager import ConfigManager
 from mirror.task          import Task, SimpleTask, TASK_TYPES
 from mirror.task          import PRIORITY_MIN, PRIORITY_MAX
 from mirror.task          import REGULAR_TASK, TIMEOUT_TASK, SYSTEM_TASK
-from mirror.sysinfo       import loadavg, tcpconn
-from mirror.queue         import TaskInfo, Queue
+from mirror.task          import LAUNCHER_FORK, LAUNCHERS
+from mirror.sysinfo       import loadavg, tcpconn, pressure, PRESSURE_RESOURCES
+from mirror.sysinfo       import disk_device, DiskUtilization, NetRate
+from mirror.queue         import TaskInfo, Queue, DeferredQueue
+from mirror.sampler       import SysInfoSampler
+from mirror.eventloop     import EventLoop
+from mirror.upstream      import UpstreamSelector, RETRY_CODES
+from mirror.cgroup        import Cgroups
+from mirror.admission     import POLICIES, SIGNALS, runnable_priority
+from mirror.bandwidth     import BandwidthManager, parse_profile
+from mirror.semaphore     import KeyedSemaphores, parse_grouplimits
+from mirror.semaphore     import host_key, device_key, group_keys
+from mirror.statusmap     import StatusWriter
+from mirror.statusmap     import STATE_IDLE, STATE_QUEUED, STATE_RUNNING
 from mirror.component     import Component
 
 from collections import OrderedDict as odict
+from collections import deque
 
 log = logging.getLogger(__name__)
 
@@ -65,11 +73,54 @@ class Scheduler(Component):
         self.config  = ConfigManager("mirror.ini")
         self.tasks   = odict()
         self.queue   = Queue()
+        # tasks turned away by admission, see defer_task()
+        self.deferred = DeferredQueue()
+        # a task finished since last schedule(), so deferred tasks
+        # are tried again, see retry_deferred()
+        self.capacity_freed  = False
+        # ticks of self.sampler when deferred tasks were tried last time
+        self.deferred_ticks  = 0
         self.todo    = self.SCHEDULE_TASK
+        # names of tasks that need to be (re)appended into self.queue,
+        # see append_tasks()
+        self.changed_tasks   = set()
+        # names of tasks whose status need to be written, see write_mmap()
+        self.changed_status  = set()
+        # names of tasks enqueued in this turn, see emit_enqueued()
+        self.enqueued_tasks  = odict()
+        self.status_writer   = StatusWriter()
+        # system info used by schedule(), sampled in background
+        self.sampler         = SysInfoSampler()
+        self.sampler.add_metric("load", loadavg)
+        self.sampler.add_metric("conn", tcpconn)
+        # smoothed values of sampled signals for this turn, see init_sysinfo()
+        self.current_signals = {}
+        # orders upstreams of tasks by probing them
+        self.upstream_selector = UpstreamSelector()
+        # cgroups of tasks, None if `cgroup` is not set in config
+        self.cgroups         = None
+        # decides whether tasks can start, see mirror.admission
+        self.admission       = None
+        # shares `bwlimit` among running tasks
+        self.bandwidth       = BandwidthManager()
+        # running tasks by upstream host, device and group
+        self.semaphores      = KeyedSemaphores()
         # the number of tasks that enabled
         self.active_tasks    = -1
         self.expect_time     = 0
         self.roused_by_child = False
+        # pid -> task, for running tasks
+        self.pids            = {}
+        # (pid, status) of children reaped by sigchld_handler(),
+        # see process_exited_children()
+        self.exited_children = deque()
+        # set by reload_handler(), see process_reload()
+        self.reload_requested = False
+        # only when it is True, sigchld_handler() and reload_handler()
+        # interrupt time.sleep()
+        self.sleeping        = False
+        # used instead of time.sleep() if `eventloop` is set in config
+        self.eventloop       = None
 
         self.init_general(self.config)
         self.init_tasks  (self.config)
@@ -77,10 +128,14 @@ class Scheduler(Component):
     def start(self):
         event_manager = component.get("EventManager")
         event_manager.emit(mirror.event.MirrorStartEvent())
+        self.sampler.start()
+        self.upstream_selector.start()
         while (True):
             self.sleep()
             if not self.roused_by_child:
                 log.info("I am waking up...")
+            self.process_exited_children()
+            self.process_reload()
             self.schedule()
 
     TODO = { REGULAR_TASK : SCHEDULE_TASK,
@@ -89,12 +144,18 @@ class Scheduler(Component):
             }
 
     def sleep(self):
-        # SIGCHLD may be coming before into sleep()
-        # better need something like pselect() + sig_atomic_t
+        # SIGCHLD may be coming before into sleep(), so sigchld_handler()
+        # only interrupts us after self.sleeping is set, and children exited
+        # before that are checked just before time.sleep()
         # refer: http://www.linuxprogrammingblog.com/all-about-linux-signals?page=6
+        # With self.eventloop there is no such race, see mirror.eventloop
+        self.process_reload()
+        self.init_eventloop()
         try:
+            self.process_exited_children()
             self.append_tasks()
             self.write_mmap()
+            self.emit_enqueued()
 
             nexttask  = self.queue[0]
             self.todo = 0
@@ -113,21 +174,46 @@ class Scheduler(Component):
                 sleeptime = 0 if sleeptime < 0 else sleeptime
             else:
                 sleeptime = 1800 # half an hour
+            retry = self.deferred.next_retry()
+            if retry is not None:
+                sleeptime = min(sleeptime, max(retry - time.time(), 0))
+                # to try deferred tasks again with new samples
+                if self.sampleinterval > 0:
+                    sleeptime = min(sleeptime, self.sampleinterval)
             log.info("I am going to sleep, next waking up: %s",
                      time.ctime(time.time() + sleeptime))
             self.expect_time     = int(time.time()) + sleeptime
             self.roused_by_child = False
 
-            time.sleep(sleeptime)
+            self.sleeping = self.eventloop is None
+            if self.exited_children or self.reload_requested:
+                self.roused_by_child = True
+            elif self.eventloop is not None:
+                # woken up by children, signals or other fds
+                if self.eventloop.wait(sleeptime) > 0:
+                    self.roused_by_child = True
+            else:
+                time.sleep(sleeptime)
+            self.sleeping = False
         except mirror.error.MirrordTaskFinishedFakeError as e:
-            pass
+            self.sleeping = False
 
     def schedule(self):
-        if self.queue.empty():
+        if self.queue.empty() and not self.deferred:
             log.info("But no task needed to start...")
             return
 
         self.init_sysinfo()
+        self.admission.update(self.current_signals, self.count_running_tasks())
+        if self.bandwidth.is_changed():
+            log.info("Bandwidth budget is changed to %d bytes/s", self.bandwidth.get_budget())
+            self.rebalance_bandwidth()
+        # deferred tasks have waited, so they go before queued ones,
+        # all of them are tried again on new samples of system info
+        ticks = self.sampler.ticks
+        self.retry_deferred(force = self.capacity_freed or ticks != self.deferred_ticks)
+        self.capacity_freed = False
+        self.deferred_ticks = ticks
 
         curtime    = time.time()
         taskqueue  = [ taskinfo for taskinfo in self.queue ]
@@ -140,6 +226,7 @@ class Scheduler(Component):
                 if self.TODO.get(taskinfo.tasktype, 0) != self.SCHEDULE_TASK:
                     continue
                 taskinfo.time -= time_gap
+                self.queue.update(taskinfo)
 
         # we do not need microseconds
         curtime    = int(curtime)
@@ -180,10 +267,13 @@ class Scheduler(Component):
         decided by some conditions, e.g. system load, current http connections.
 
         NOTE:
-        The priority that a task can run is a function of ( current value / limit ).
-        See get_runnable_priority(). However an exception is `maxtasks`, if current
-        running tasks is reaching `maxtasks`, only specific priority (lower than or
-        equal to 2) tasks can still be running.
+        It is decided by the policy of `admission` in config, see mirror.admission.
+        By default, the priority that a task can run is a function of
+        ( current value / limit ), see get_runnable_priority(). However an exception
+        is `maxtasks`, if current running tasks is reaching `maxtasks`, only specific
+        priority (lower than or equal to 2) tasks can still be running.
+
+        A task that is not admitted is deferred, see defer_task().
 
         """
         task = self.tasks[taskinfo.name]
@@ -191,66 +281,169 @@ class Scheduler(Component):
             self.run_system_task(taskinfo)
             return
 
-        if task.priority > self.get_runnable_priority(self.current_load, self.loadlimit):
-            log.info("Task: %s not scheduled because system load %.2f is too high",
-                     taskinfo.name, self.current_load)
-            self.delay_task(taskinfo)
-            return
-        if task.priority > self.get_runnable_priority(self.current_conn,  self.httpconn):
-            log.info("Task: %s not scheduled because http connections is too many",
-                     taskinfo.name)
-            self.delay_task(taskinfo)
-            return
-        if self.maxtasks > 0 and self.count_running_tasks() >= self.maxtasks and task.priority > 2:
-            log.info("Task: %s not scheduled because running tasks is larger than %d",
-                     taskinfo, self.maxtasks)
-            self.delay_task(taskinfo)
+        if not self.admit_task(task, taskinfo):
+            self.defer_task(taskinfo)
             return
         log.info("Starting task: %s ...", taskinfo.name)
         self.run_task(taskinfo)
 
+    def admit_task(self, task, taskinfo):
+        """
+        :returns: True if `task` can start now, see mirror.admission
+                  and mirror.semaphore
+
+        """
+        reason = self.check_semaphores(task)
+        if reason is not None:
+            log.info("Task: %s not scheduled because %s", taskinfo.name, reason)
+            return False
+        decision = self.admission.admit(taskinfo.name, task.priority,
+                                        self.count_running_tasks(),
+                                        self.get_task_signals(task))
+        if not decision.admitted:
+            log.info("Task: %s not scheduled because %s", taskinfo.name, decision.reason)
+        return decision.admitted
+
+    def check_semaphores(self, task):
+        """
+        :returns: why `task` can not start by limits of its keys, or None,
+                  it needs a slot of at least one of its upstream hosts
+
+        """
+        full = self.semaphores.check(self.get_task_keys(task))
+        if full is not None:
+            return "running tasks of %s reached %d" % (full, self.semaphores.get_limit(full))
+        hosts = [ host_key(upstream) for upstream in task.get_upstreams() ]
+        if hosts and all(self.semaphores.is_full(key) for key in hosts):
+            return "running tasks of upstream hosts reached %d" % self.semaphores.hostlimit
+        return None
+
+    def get_task_keys(self, task, upstream = None):
+        """
+        :returns: keys of `task` (see mirror.semaphore), the host key is
+                  only in it if `upstream` is given
+
+        """
+        keys = group_keys(task.taskinfo.get("groups", ""))
+        localdir = getattr(task, "localdir", None)
+        if localdir:
+            key = device_key(localdir)
+            if key is not None:
+                keys.append(key)
+        if upstream is not None:
+            keys.append(host_key(upstream))
+        return keys
+
     def init_sysinfo(self):
         """
-        Get system info for this turn of schedule().
+        Get system info for this turn of schedule(), the values are
+        smoothed ones of the samples taken by self.sampler.
 
         """
-        self.current_load = loadavg()
-        self.current_conn = tcpconn()
+        self.sampler.sample_now()
+        self.current_load = self.sampler.ewma("load")
+        self.current_conn = self.sampler.ewma("conn")
+        self.current_signals = { "load": self.current_load, "conn": self.current_conn }
+        for name in ("cpu", "io", "memory", "net"):
+            if self.signallimits[name] > 0:
+                self.current_signals[name] = self.sampler.ewma(name)
+
+    def get_task_signals(self, task):
+        """
+        :returns: dict of signals of `task` itself, i.e. utilization of
+                  the disk of its localdir if `diskutil` is set
 
-    def delay_task(self, taskinfo, delay_seconds = 1800):
         """
-        If a task is not scheduled due to some reason, it will be
-        delayed for `delay_seconds` seconds (wich is default half
-        an hour), when task's next schedule time is later than that,
-        else it's set to task's next schedule time.
+        localdir = getattr(task, "localdir", None)
+        if self.signallimits["disk"] <= 0 or not localdir:
+            return None
+        try:
+            device = disk_device(localdir)
+        except OSError as e:
+            log.warning("Unable to find the disk of task: %s, %s", task.name, e)
+            return None
+        name = "disk:%d:%d" % device
+        if name not in self.sampler.metrics:
+            # it is sampled since now, so it is 0 until next sample
+            self.sampler.add_metric(name, DiskUtilization(device))
+            self.sampler.metrics[name].sample()
+        return { "disk": self.sampler.ewma(name) }
+
+    def defer_task(self, taskinfo):
+        """
+        If a task is not scheduled due to some reason, it is moved from
+        the queue into self.deferred. It is tried again as soon as
+        another task finishes, system info is sampled again, or its
+        backoff is over, see retry_deferred(), but no later than its
+        next schedule time.
 
         """
-        if taskinfo not in self.queue:
+        task = self.tasks.get(taskinfo.name, None)
+        if task is None:
             return
-        task      = self.tasks[taskinfo.name]
-        next_time = task.get_schedule_time(since = time.time())
-        if taskinfo.time + delay_seconds > next_time:
-            taskinfo.time  = next_time
+        if taskinfo in self.queue:
+            self.queue.remove(taskinfo)
+        now      = time.time()
+        deferred = self.deferred.find(taskinfo.name)
+        if deferred is None:
+            deferred = self.deferred.put(taskinfo, now)
         else:
-            # In python objects are passed by reference
-            taskinfo.time += delay_seconds
-        self.reappend_task(task, taskinfo)
+            deferred.attempts += 1
+        next_time = task.get_schedule_time(since = now)
+        deferred.retry = now + self.get_backoff(deferred.attempts)
+        if next_time is not None:
+            deferred.retry = min(deferred.retry, next_time)
+        self.changed_status.add(taskinfo.name)
+        log.info("Task: %s is deferred, tried again before %s", taskinfo.name,
+                 time.ctime(deferred.retry))
+
+    def get_backoff(self, attempts):
+        """
+        :returns: seconds to wait after a task is turned away `attempts`
+                  times, it is doubled each time up to `delaymax`, and
+                  randomized by `delayjitter`, so deferred tasks are
+                  not tried at the same time
 
-    def count_running_tasks(self):
         """
-        Calculate the number of current running tasks.
+        backoff = min(self.delaybase * (2 ** min(attempts, 32)), self.delaymax)
+        return backoff * random.uniform(1 - self.delayjitter, 1 + self.delayjitter)
 
+    def retry_deferred(self, force = False):
         """
-        running = 0
-        for taskname, task in self.tasks.items():
-            if task.isinternal:
+        Try deferred tasks whose backoff is over, or all of them if
+        `force`, e.g. capacity is freed by a finished task.
+
+        """
+        now = time.time()
+        for deferred in list(self.deferred):
+            taskinfo = deferred.taskinfo
+            if not force and deferred.retry > now:
                 continue
-            running += task.running
-        return running
+            task = self.tasks.get(taskinfo.name, None)
+            if task is None or task.running:
+                self.deferred.remove(taskinfo.name)
+                continue
+            if not self.admit_task(task, taskinfo):
+                if deferred.retry <= now:
+                    self.defer_task(taskinfo)
+                continue
+            self.deferred.remove(taskinfo.name)
+            log.info("Starting deferred task: %s after %d seconds ...",
+                     taskinfo.name, now - deferred.since)
+            self.run_task(taskinfo)
+
+    def count_running_tasks(self):
+        """
+        :returns: the number of current running tasks, counted by
+                  self.semaphores as they start and finish
+
+        """
+        return self.semaphores.running
 
     def append_tasks(self):
         """
-        Append the tasks that are needed to run into self.queue.
+        Append the tasks that are changed since last time into self.queue,
+        a task is changed when it is added, reloaded or finished.
 
         NOTE:
         If a task is currently running or it is not enabled, it will
@@ -258,20 +451,37 @@ class Scheduler(Component):
 
         """
         now = time.time()
-        for taskname in self.tasks:
-            task = self.tasks[taskname]
+        while self.changed_tasks:
+            taskname = self.changed_tasks.pop()
+            self.changed_status.add(taskname)
+            task     = self.tasks.get(taskname, None)
+            if task is None:
+                continue
             self.append_task(taskname, task, since = now)
 
+    def add_task(self, taskname, task):
+        """
+        Add a new task, e.g. a system task from plugins, it will be
+        appended into the queue on next sleep().
+
+        """
+        self.tasks[taskname] = task
+        if task.enabled:
+            self.active_tasks += 1
+        self.changed_tasks.add(taskname)
+
     def append_task(self, taskname, task, since):
         """
         In some cases a task with same name may be ignored if there
         is a running one, but this is a feature, not a bug...
 
         """
-        if task.running and task.timeout > 0:
+        if task.running and task.has_timeout():
             return
         if not task.enabled:
             return
+        if taskname in self.deferred:
+            return
         taskinfo = TaskInfo(taskname, (SYSTEM_TASK if task.isinternal else REGULAR_TASK),
                             task.get_schedule_time(since), task.priority)
 
@@ -281,51 +491,90 @@ class Scheduler(Component):
         if taskinfo in self.queue:
             return
         self.queue.put(taskinfo)
+        self.task_enqueued(taskname)
+
+    def task_enqueued(self, taskname):
+        """
+        A task is appended into the queue or moved in it,
+        all such tasks are emitted together in emit_enqueued().
+
+        """
+        self.enqueued_tasks[taskname] = None
+
+    def emit_enqueued(self):
+        """
+        Emit one QueueChangedEvent for tasks enqueued since last time.
+
+        """
+        if not self.enqueued_tasks:
+            return
+        tasknames = list(self.enqueued_tasks)
+        self.enqueued_tasks.clear()
         event_manager = component.get("EventManager")
-        event_manager.emit(mirror.event.TaskEnqueueEvent(taskname))
+        event_manager.emit(mirror.event.QueueChangedEvent(tasknames))
 
     def reappend_task(self, task, taskinfo):
         """
-        Remove a taskinfo from queue and put it in again,
-        to keep the queue in order.
+        Move a taskinfo to its new position in the queue after its
+        time is changed, to keep the queue in order.
 
         """
         if taskinfo not in self.queue:
             return
-        self.queue.remove(taskinfo)
-        self.queue.put(taskinfo)
-        event_manager = component.get("EventManager")
-        event_manager.emit(mirror.event.TaskEnqueueEvent(taskinfo.name))
-
-    DEFAULT_BUFFER_SIZE  = 10240
+        self.queue.update(taskinfo)
+        self.task_enqueued(taskinfo.name)
 
     def write_mmap(self):
-        data = pickle.dumps(self.queue)
-        size = len(data) + 2 + 4
-        if not hasattr(self, "buffer") or self.buffersz < size:
-            self.buffersz = max(self.DEFAULT_BUFFER_SIZE, size)
-            if hasattr(self, "buffer"):
-                self.buffer.close()
-            self.bufferfd = os.open("/tmp/mirrord",
-                                    os.O_CREAT | os.O_TRUNC | os.O_RDWR,
-                                    0o644)
-            flag = fcntl.fcntl(self.bufferfd, fcntl.F_GETFD)
-            fcntl.fcntl(self.bufferfd, fcntl.F_SETFD, flag | fcntl.FD_CLOEXEC)
-            os.write(self.bufferfd, b'\x00' * self.buffersz)
-            self.buffer   = mmap.mmap(self.bufferfd, self.buffersz, mmap.MAP_SHARED, mmap.PROT_WRITE)
-            # close bufferfd
-            os.close(self.bufferfd)
-            self.buffer.write(b"\x79\x71")
-        self.buffer.seek(2)
-        self.buffer.write(struct.pack("I", size))
-        self.buffer.write(data)
+        """
+        Write status of tasks that are changed since last time,
+        see mirror.statusmap.
+
+        """
+        self.changed_status |= self.queue.changed
+        self.queue.changed.clear()
+        records = {}
+        while self.changed_status:
+            taskname = self.changed_status.pop()
+            records[taskname] = self.get_status_record(taskname)
+        self.status_writer.update(records)
+
+    def get_status_record(self, taskname):
+        task = self.tasks.get(taskname, None)
+        if task is None:
+            return None
+        taskinfo = self.queue.find(taskname)
+        deferred = self.deferred.find(taskname)
+        if taskinfo is None and deferred is not None:
+            taskinfo = TaskInfo(taskname, REGULAR_TASK, deferred.retry, task.priority)
+        if task.running:
+            state = STATE_RUNNING
+        elif taskinfo:
+            state = STATE_QUEUED
+        else:
+            state = STATE_IDLE
+        return (taskinfo.tasktype if taskinfo else 0, state, task.priority,
+                taskinfo.time if taskinfo else 0,
+                getattr(task, "pid", 0) if task.running else 0)
 
     def stop(self):
         log.info("Stopping mirror scheduler")
-        if not hasattr(self, "buffer"):
-            return
-        self.buffer.close()
-        os.unlink("/tmp/mirrord")
+        self.sampler.stop()
+        self.upstream_selector.stop()
+        if self.eventloop is not None:
+            self.eventloop.close()
+            self.eventloop = None
+        self.status_writer.close()
+        if self.cgroups is not None:
+            self.cgroups.close()
+
+    def get_metrics(self):
+        """
+        :returns: dict of task name -> usage of resources by its last
+                  run, see mirror.cgroup.Cgroups.finish()
+
+        """
+        return dict((taskname, task.usage) for taskname, task in self.tasks.items()
+                    if task.usage is not None)
 
     def append_timeout_task(self, taskname, task, time):
         """
@@ -341,19 +590,16 @@ class Scheduler(Component):
         if taskinfo in self.queue:
             return
         self.queue.put(taskinfo)
-        event_manager = component.get("EventManager")
-        event_manager.emit(mirror.event.TaskEnqueueEvent(taskname))
+        self.task_enqueued(taskname)
 
     def remove_timeout_task(self, taskname):
         """
-        It's slow...
+        Remove the timeout checking task of `taskname` if there is one.
 
         """
-        taskqueue  = [ taskinfo for taskinfo in self.queue ]
-        for taskinfo in taskqueue:
-            if taskinfo.name == taskname and taskinfo.tasktype == TIMEOUT_TASK:
-                self.queue.remove(taskinfo)
-                return
+        taskinfo = self.queue.find(taskname, TIMEOUT_TASK)
+        if taskinfo:
+            self.queue.remove(taskinfo)
 
     def init_general(self, config):
         self.emails    = []
@@ -361,9 +607,23 @@ class Scheduler(Component):
         self.httpconn  = 1200
         self.logdir    = mirror.common.DEFAULT_TASK_LOG_DIR
         self.maxtasks  = 10
+        self.sampleinterval = 5
+        self.use_eventloop  = False
+        self.launcher       = LAUNCHER_FORK
+        self.stopgrace      = 30
+        self.upstreamttl    = 300
+        self.probetimeout   = 3
+        self.admissionpolicy = "linear"
+        self.admissionlog    = None
+        self.delaybase       = 60
+        self.delaymax        = 1800
+        self.delayjitter     = 0.1
+        self.signallimits    = dict((name, 0) for name, key in SIGNALS)
+        self.netdev          = None
 
         if "general" not in config:
             log.error("Error in config file, no `general` section, will use default setting.")
+            self.init_admission()
             return
         import re
         emails = re.compile(r"([^@\s]+@[^@\s,]+)")
@@ -377,29 +637,242 @@ class Scheduler(Component):
         self.logdir    = config['general']['logdir']
         if self.logdir[-1] != os.path.sep:
             self.logdir += os.path.sep
+        self.sampleinterval = int(config['general'].get('sampleinterval', 5))
+        self.sampler.set_interval(self.sampleinterval)
+        self.use_eventloop  = config['general'].get('eventloop', "0") != "0"
+        self.launcher       = config['general'].get('launcher', LAUNCHER_FORK)
+        if self.launcher not in LAUNCHERS:
+            log.error("Error in config file, launcher: %s not valid, will use %s.",
+                      self.launcher, LAUNCHER_FORK)
+            self.launcher   = LAUNCHER_FORK
+        self.stopgrace      = mirror.common.parse_timestr(
+                                  config['general'].get('stopgrace', "30"))
+        self.upstreamttl    = mirror.common.parse_timestr(
+                                  config['general'].get('upstreamttl', "5m"))
+        self.probetimeout   = float(config['general'].get('probetimeout', 3))
+        self.upstream_selector.ttl     = self.upstreamttl
+        self.upstream_selector.timeout = self.probetimeout
+        cgroup = config['general'].get('cgroup', '').strip()
+        if not cgroup:
+            self.cgroups = None
+        elif self.cgroups is None or self.cgroups.root != cgroup.rstrip('/'):
+            self.cgroups = Cgroups(cgroup)
+        self.admissionpolicy = config['general'].get('admission', "linear")
+        if self.admissionpolicy not in POLICIES:
+            log.error("Error in config file, admission: %s not valid, will use linear.",
+                      self.admissionpolicy)
+            self.admissionpolicy = "linear"
+        self.admissionlog    = config['general'].get('admissionlog', None) or None
+        self.init_signals(config['general'])
+        self.init_admission()
+        self.delaybase       = mirror.common.parse_timestr(
+                                   config['general'].get('delaybase', "1m")) or 60
+        self.delaymax        = mirror.common.parse_timestr(
+                                   config['general'].get('delaymax', "30m")) or 1800
+        self.delayjitter     = min(max(float(config['general'].get('delayjitter', 0.1)), 0), 1)
+        self.init_bandwidth(config['general'])
+        self.init_semaphores(config['general'])
+
+    def init_bandwidth(self, general):
+        """
+        Read `bwlimit`, `bwprofile` and `bwhook` in `general`,
+        see mirror.bandwidth.
+
+        """
+        try:
+            self.bandwidth.budget  = mirror.common.parse_size(general.get("bwlimit", "0"))
+            self.bandwidth.profile = parse_profile(general.get("bwprofile", ""))
+        except ValueError as e:
+            log.error("Error in config file, bwlimit or bwprofile not valid: %s, "
+                      "will use no limit.", e)
+            self.bandwidth.budget  = 0
+            self.bandwidth.profile = []
+        hook = general.get("bwhook", "").strip()
+        if os.path.isabs(hook):
+            self.bandwidth.hook = hook if os.path.isfile(hook) else None
+        else:
+            self.bandwidth.hook = mirror.common.find_command(hook) if hook else None
+        if hook and not self.bandwidth.hook:
+            log.error("Error in config file, bwhook: %s not found.", hook)
+
+    def init_semaphores(self, general):
+        """
+        Read `hostlimit`, `devicelimit` and `grouplimits` in `general`,
+        see mirror.semaphore, tasks running are still counted on reload.
+
+        """
+        try:
+            self.semaphores.set_limits(int(general.get("hostlimit", "0")),
+                                       int(general.get("devicelimit", "0")),
+                                       parse_grouplimits(general.get("grouplimits", "")))
+        except ValueError as e:
+            log.error("Error in config file, hostlimit, devicelimit or grouplimits "
+                      "not valid: %s, will use no limit.", e)
+            self.semaphores.set_limits()
+
+    def init_signals(self, general):
+        """
+        Read limits of signals (see mirror.admission.SIGNALS) in `general`,
+        signals with limits are sampled by self.sampler.
+
+        """
+        for name, key in SIGNALS:
+            try:
+                value = general.get(key, "0")
+                self.signallimits[name] = (mirror.common.parse_size(value) if name == "net"
+                                           else float(value))
+            except ValueError:
+                log.error("Error in config file, %s: %s not valid, will use no limit.",
+                          key, value)
+                self.signallimits[name] = 0
+        for name in PRESSURE_RESOURCES:
+            if self.signallimits[name] > 0 and name not in self.sampler.metrics:
+                self.sampler.add_metric(name, functools.partial(pressure, name))
+        netdev = general.get("netdev", "").split() or None
+        if self.signallimits["net"] > 0 and ("net" not in self.sampler.metrics or
+                                             netdev != self.netdev):
+            self.sampler.add_metric("net", NetRate(netdev))
+        self.netdev = netdev
+
+    def init_admission(self):
+        """
+        Create self.admission for `admission` in config, or just update
+        its limits, so an aimd policy keeps its state on reload.
+
+        """
+        limits = (self.loadlimit, self.httpconn, self.maxtasks, self.admissionlog,
+                  self.signallimits)
+        if self.admission is not None and self.admission.name == self.admissionpolicy:
+            self.admission.set_limits(*limits)
+            return
+        self.admission = POLICIES[self.admissionpolicy](*limits)
+
+    def init_eventloop(self):
+        """
+        Create or close self.eventloop as `eventloop` in config, it is
+        not done in init_general(), as that may run in a signal handler.
+
+        """
+        if self.use_eventloop and self.eventloop is None:
+            self.eventloop = EventLoop()
+            for pid in self.pids:
+                self.eventloop.watch_pid(pid, mirror.handler.reap_children)
+        elif not self.use_eventloop and self.eventloop is not None:
+            self.eventloop.close()
+            self.eventloop = None
+
+    def request_reload(self):
+        """
+        This is called by reload_handler(), it only records the request,
+        as the main loop may be iterating over tasks and the queue.
+
+        """
+        self.roused_by_child  = True
+        self.reload_requested = True
+
+    def process_reload(self):
+        """
+        Reload config if requested, it is called in the main loop.
+
+        """
+        if not self.reload_requested:
+            return
+        self.reload_requested = False
+        self.reload_config()
 
     def reload_config(self):
-        log.info("Stopping running tasks...")
-        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
-        self.stop_all_tasks()
-        signal.signal(signal.SIGCHLD, mirror.handler.sigchld_handler)
+        """
+        Reload config, only tasks whose sections are changed are rebuilt,
+        running tasks are kept running and adopted by the new ones.
 
-        log.info("Clearing old data...")
-        self.tasks = odict(filter(lambda x:x[1].isinternal,self.tasks.items()))
-        self.queue = Queue()
+        self.tasks is replaced as a whole at the end, so plugin threads
+        iterating over it never see it half updated.
 
+        """
         log.info("Reloading new configs...")
         self.config = ConfigManager("mirror.ini", need_reload = True)
         self.init_general(self.config)
-        self.init_tasks  (self.config)
+
+        tasks    = odict(self.tasks)
+        sections = [mirror for mirror in self.config if mirror != 'general']
+        for taskname, task in list(tasks.items()):
+            if task.isinternal or taskname in sections:
+                continue
+            self.retire_task(taskname, task)
+            del tasks[taskname]
+        for taskname in sections:
+            old = tasks.get(taskname, None)
+            if (old is not None and not old.isinternal and
+                    old.taskinfo == self.config[taskname]):
+                continue
+            log.info("Task: %s is %s", taskname, "updated" if old else "added")
+            task = self.create_task(taskname, self.config[taskname])
+            self.dequeue_task(taskname)
+            if old is not None and old.running:
+                self.adopt_task(old, task)
+            tasks[taskname] = task
+            self.changed_tasks.add(taskname)
+        self.tasks = tasks
+        self.active_tasks = len(
+                            [mirror for mirror, task in self.tasks.items() if task.enabled])
+
+    def retire_task(self, taskname, task):
+        """
+        Stop a task whose section is removed from config, if it is
+        running, and remove it from the queue.
+
+        """
+        log.info("Task: %s is removed", taskname)
+        if task.running:
+            # it will be reaped by sigchld_handler() as usual,
+            # see stop_task_with_pid()
+            task.stop()
+        self.dequeue_task(taskname)
+        self.changed_status.add(taskname)
+
+    def adopt_task(self, old, task):
+        """
+        Hand over the running process of `old` to `task`, which is
+        created from the changed config of that task.
+
+        """
+        task.pid        = old.pid
+        task.running    = old.running
+        task.code       = old.code
+        task.start_time = old.start_time
+        # the stages of old config are run to the end
+        task.pipeline   = old.pipeline
+        task.bwlimit    = old.bwlimit
+        if isinstance(task, Task) and isinstance(old, Task):
+            # the upstream it syncs from, and those left for failover
+            task.upstreams      = old.upstreams
+            task.upstream_index = old.upstream_index
+        for pid in task.get_pids():
+            self.pids[pid] = task
+        self.update_timeout_task(task)
+        log.info("Task: %s with pid %d is adopted", task.name, task.pid)
+
+    def dequeue_task(self, taskname):
+        """
+        Remove all queue entries of `taskname`.
+
+        """
+        while taskname in self.queue:
+            self.queue.remove(self.queue.find(taskname))
+        if self.deferred.remove(taskname) is not None:
+            self.changed_status.add(taskname)
+
+    def create_task(self, taskname, taskinfo):
+        # We think it's default mirror.task.Task
+        task_class = TASK_TYPES.get(taskinfo.get("type", None), Task)
+        return task_class(taskname, weakref.ref(self), **taskinfo)
 
     def init_tasks(self, config):
         for mirror in config:
             if mirror == 'general':
                 continue
-            # We think it's default mirror.task.Task
-            task_class = TASK_TYPES.get(config[mirror].get("type", None), Task)
-            self.tasks[mirror] = task_class(mirror, weakref.ref(self), **config[mirror])
+            self.tasks[mirror] = self.create_task(mirror, config[mirror])
+            self.changed_tasks.add(mirror)
         self.active_tasks = len(
                             [mirror for mirror, task in self.tasks.items() if task.enabled])
 
@@ -413,33 +886,105 @@ class Scheduler(Component):
         task = self.tasks[taskinfo.name]
         self.append_task(taskinfo.name, task, time.time())
 
-    def run_task(self, taskinfo, stage = 1):
+    def run_task(self, taskinfo, failover = False):
         if taskinfo.name not in self.tasks:
             return
         task = self.tasks[taskinfo.name]
         # for tasks that is still running when next schedule time
         # is reached (but has no timeout set), we just need to
         # reappend it.
-        if task.running and task.timeout <= 0:
+        if task.running and not task.has_timeout():
             taskinfo.time  = task.get_schedule_time(since = time.time())
             self.reappend_task(task, taskinfo)
-        if task.running and ( not task.twostage ):
-            log.info("Task: %s is still running and no timeout set, skipped", taskinfo.name)
+        if task.running:
+            log.info("Task: %s is still running, skipped", taskinfo.name)
             return
 
         event_manager = component.get("EventManager")
         event_manager.emit(mirror.event.PreTaskStartEvent(taskinfo.name))
-        task.run(stage)
+        # failover keeps the upstream chosen before
+        if not failover:
+            task.select_upstream(self.upstream_selector,
+                                 busy = [ upstream for upstream in task.get_upstreams()
+                                          if self.semaphores.is_full(host_key(upstream)) ])
+        self.rebalance_bandwidth(starting = task)
+        task.run()
         if taskinfo in self.queue:
             self.queue.remove(taskinfo)
-        log.info("Task: %s begin to run with pid %d", taskinfo.name, task.pid)
+        if not task.running:
+            # failed to start, it will be appended again on next sleep()
+            self.changed_tasks.add(taskinfo.name)
+            self.rebalance_bandwidth()
+            return
+        for pid in task.get_pids():
+            self.track_pid(task, pid)
+        self.semaphores.acquire(task.name, self.get_task_keys(task, task.get_upstream()))
+        if task.get_upstream() is not None:
+            log.info("Task: %s begin to run with pids %s, upstream %s",
+                     taskinfo.name, task.get_pids(), task.get_upstream())
+        else:
+            log.info("Task: %s begin to run with pids %s", taskinfo.name, task.get_pids())
         event_manager.emit(mirror.event.TaskStartEvent(taskinfo.name, task.pid))
 
-        if task.timeout <= 0:
+        if not task.has_timeout():
             self.append_task(taskinfo.name, task, time.time())
         else:
-            self.append_timeout_task(taskinfo.name, task,
-                                     task.start_time + task.timeout)
+            self.update_timeout_task(task)
+
+    def rebalance_bandwidth(self, starting = None):
+        """
+        Share the bandwidth budget among running tasks and `starting`,
+        the task which is going to run, see mirror.bandwidth.
+
+        """
+        tasks = [ task for task in self.tasks.values()
+                  if task.running and task.can_limit_bandwidth() ]
+        if starting is not None and not starting.running and starting.can_limit_bandwidth():
+            tasks.append(starting)
+        if not tasks:
+            return
+        rates = self.bandwidth.allocate([ (task.name, task.priority) for task in tasks ])
+        for task in tasks:
+            rate = rates[task.name]
+            if task is not starting and rate == task.bwlimit:
+                continue
+            task.bwlimit = rate
+            if task is starting:
+                continue
+            log.info("Bandwidth of task: %s is changed to %d bytes/s", task.name, rate)
+            self.bandwidth.apply(task.name, rate, task.get_pids())
+
+    def track_pid(self, task, pid):
+        self.pids[pid] = task
+        if self.eventloop is not None:
+            self.eventloop.watch_pid(pid, mirror.handler.reap_children)
+
+    def run_jobs(self, task):
+        """
+        Start stages of `task` which are ready, or processes of stages
+        waiting for their turn, see AbstractTask.run_jobs().
+
+        :returns: True if any process of `task` is running
+
+        """
+        pids = task.run_jobs()
+        for pid in pids:
+            self.track_pid(task, pid)
+            log.info("Task: %s started stage %s with pid %d", task.name,
+                     task.pipeline.get_job_name(task.pipeline.running[pid]), pid)
+        if pids:
+            self.update_timeout_task(task)
+        return len(task.get_pids()) > 0
+
+    def update_timeout_task(self, task):
+        """
+        The deadline of a task changes when its stages start.
+
+        """
+        self.remove_timeout_task(task.name)
+        deadline = task.get_deadline()
+        if deadline is not None:
+            self.append_timeout_task(task.name, task, deadline)
 
     def stop_task(self, taskinfo):
         """
@@ -451,66 +996,140 @@ class Scheduler(Component):
         task = self.tasks[taskinfo.name]
         if not task.running:
             return
-        pid  = task.pid
         # Python's SIGCHLD sometimes has delay in calling its handler,
         # we have to disable sigchld_handler() here.
         # More: http://utcc.utoronto.ca/~cks/space/blog/python/CPythonSignals
         signal.signal(signal.SIGCHLD, signal.SIG_DFL)
-        task.stop()
-        self.stop_task_manually(task, pid)
-        signal.signal(signal.SIGCHLD, mirror.handler.sigchld_handler)
-
-    def stop_task_manually(self, task, pid):
+        try:
+            # children reaped by sigchld_handler() since the main loop
+            # handled them last time, e.g. a stage that just finished
+            self.process_exited_children()
+            if self.tasks.get(taskinfo.name) is task and task.running:
+                deadline = task.get_deadline()
+                if deadline is not None and deadline <= time.time():
+                    pids = task.get_pids()
+                    task.stop()
+                    self.stop_task_manually(task, pids)
+                else:
+                    # restarted or moved to a later stage meanwhile
+                    self.update_timeout_task(task)
+        finally:
+            signal.signal(signal.SIGCHLD, mirror.handler.sigchld_handler)
+            # SIGCHLD of other children may be discarded meanwhile
+            mirror.handler.reap_children()
+
+    def stop_task_manually(self, task, pids):
         """
         Without SIGCHLD handler, we have to waitpid() here.
 
         """
-        pid, status  = os.waitpid(pid, 0)
-        endstr, code = self.parse_return_status(status)
-        task.code    = code
-        log.info("Killed task: %s %s %d, pid %d", task.name, endstr, code, pid)
+        statuses = self.wait_children(pids)
+        for pid in pids:
+            self.forget_pid(pid)
+            endstr, code = self.parse_return_status(statuses[pid])
+            task.child_exited(pid, code)
+            log.info("Killed task: %s %s %d, pid %d", task.name, endstr, code, pid)
         self.remove_timeout_task(task.name)
         self.task_finished(task)
 
+    def forget_pid(self, pid):
+        """
+        :returns: the task which `pid` belongs to, or None
+
+        """
+        if self.eventloop is not None:
+            self.eventloop.unwatch_pid(pid)
+        return self.pids.pop(pid, None)
+
+    def child_exited(self, pid, status):
+        """
+        This is called by sigchld_handler() for every reaped child,
+        it only records the child, see process_exited_children().
+
+        """
+        self.roused_by_child = True
+        self.exited_children.append((pid, status))
+
+    def process_exited_children(self):
+        """
+        Handle children reaped by sigchld_handler(), it is called in
+        the main loop, not in the signal handler.
+
+        """
+        while self.exited_children:
+            pid, status = self.exited_children.popleft()
+            self.stop_task_with_pid(pid, status)
+
     def stop_task_with_pid(self, pid, status):
         """
-        This is called when we got a SIGCHLD signal.
         Change task's running and pid attr as it's stopped.
 
         """
-        self.roused_by_child = True
-        for taskname, task in self.tasks.items():
-            if task.isinternal:
-                continue
-            if task.pid == pid:
-                if not task.running:
-                    return
-                endstr, code = self.parse_return_status(status)
-                task.code    = code
-                log.info("Task: %s %s %d, pid %d", taskname, endstr, code, pid)
-                self.remove_timeout_task(taskname)
-                self.task_finished(task)
-                return
+        task = self.forget_pid(pid)
+        if task is None or pid not in task.get_pids():
+            return
+        if self.tasks.get(task.name, None) is not task:
+            # its section is removed from config, see retire_task()
+            task.set_stop_flag()
+            current = self.tasks.get(task.name, None)
+            # if added again and running, it took over the slots, see acquire()
+            if current is None or not current.running:
+                self.semaphores.release(task.name)
+                self.capacity_freed = True
+            log.info("Removed task: %s exited, pid %d", task.name, pid)
+            return
+        if not task.running:
+            return
+        endstr, code = self.parse_return_status(status)
+        log.info("Task: %s %s %d, pid %d", task.name, endstr, code, pid)
+        if not task.child_exited(pid, code) and self.run_jobs(task):
+            # other processes are still running
+            return
+        self.remove_timeout_task(task.name)
+        self.task_finished(task)
 
     def task_finished(self, task):
         """
-        Check whether a task needs post process, e.g. two stage tasks.
+        It is called when all stages of a task finished, or one of them failed.
 
         """
-        event_manager = component.get("EventManager")
-        if not task.twostage:
-            event_manager.emit(mirror.event.TaskStopEvent(task.name, task.pid, task.code))
-            self.task_autoretry(task)
-            task.set_stop_flag()
+        if self.task_failover(task):
             return
-        if task.stage == 1:
-            log.info("Task: %s scheduled to second stage", task.name)
-            self.run_task(TaskInfo(task.name, REGULAR_TASK, 0, task.priority), stage = 2)
-        else:
-            event_manager.emit(mirror.event.TaskStopEvent(task.name, task.pid, task.code))
-            self.task_autoretry(task)
-            task.set_stop_flag()
-            task.stage = 1
+        if self.cgroups is not None:
+            task.usage = self.cgroups.finish(task)
+            if task.usage:
+                log.info("Task: %s used %.1fs cpu, read %d bytes, wrote %d bytes",
+                         task.name, task.usage["cpu"], task.usage["read"], task.usage["write"])
+        event_manager = component.get("EventManager")
+        event_manager.emit(mirror.event.TaskStopEvent(task.name, task.pid, task.code))
+        task.set_stop_flag()
+        self.semaphores.release(task.name)
+        self.capacity_freed = True
+        self.rebalance_bandwidth()
+        self.task_autoretry(task)
+        self.changed_tasks.add(task.name)
+
+    def task_failover(self, task):
+        """
+        If a task failed because of its upstream, e.g. connection refused
+        or timed out, run it again at once with the next one.
+
+        :returns: True if the task is running again
+
+        """
+        if task.code not in RETRY_CODES:
+            return False
+        failed = task.get_upstream()
+        if not task.next_upstream():
+            return False
+        self.upstream_selector.mark_failed(failed)
+        log.warning("Task: %s failed with upstream %s, code %d, trying upstream %s",
+                    task.name, failed, task.code, task.get_upstream())
+        task.set_stop_flag()
+        self.semaphores.release(task.name)
+        self.run_task(TaskInfo(task.name, REGULAR_TASK, 0, task.priority),
+                      failover = True)
+        return task.running
 
     def task_autoretry(self, task):
         """
@@ -524,34 +1143,109 @@ class Scheduler(Component):
             return
         curtime   = int(time.time())
         next_time = task.get_schedule_time(since = curtime)
-        if curtime + task.autoretry < next_time:
-            taskinfo = self.queue[task.name]
-            taskinfo.time = next_time
+        if curtime + task.autoretry >= next_time:
+            return
+        taskinfo = self.queue.find(task.name, REGULAR_TASK)
+        if taskinfo:
+            taskinfo.time = curtime + task.autoretry
             self.reappend_task(task, taskinfo)
+            return
+        # tasks with timeout set are not in the queue when they finish
+        self.queue.put(TaskInfo(task.name, REGULAR_TASK,
+                                curtime + task.autoretry, task.priority))
+        self.task_enqueued(task.name)
 
     def stop_all_tasks(self, signo = signal.SIGTERM):
         """
-        This method can only be called when mirrord is shut down by SIGTERM or SIGINT.
+        This method is called when mirrord is shut down by SIGTERM or SIGINT,
+        sigchld_handler() should be disabled first.
+
+        All running tasks are signaled at once and waited together,
+        those still running after self.stopgrace seconds are killed by SIGKILL.
 
         NOTE:
         Currently when mirrord is shut down, all running tasks will also be killed.
 
         """
-        event_manager = component.get("EventManager")
+        running = {}
         for taskname, task in self.tasks.items():
             if task.isinternal:
                 continue
             if not task.running:
                 continue
-            pid = task.pid
+            for pid in task.get_pids():
+                running[pid] = task
             task.stop(signo)
-            # Not sure it is ok...
-            pid, status  = os.waitpid(pid, 0)
 
-            endstr, code = self.parse_return_status(status)
-            task.code    = code
-            event_manager.emit(mirror.event.TaskStopEvent(task.name, task.pid, task.code))
-            log.info("Killed task: %s with pid %d", taskname, pid)
+        statuses = self.wait_children(running, self.stopgrace)
+        killed   = [pid for pid in running if pid not in statuses]
+        for pid in killed:
+            log.warning("Task: %s with pid %d is still running after %d seconds, killing it",
+                        running[pid].name, pid, self.stopgrace)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError as e:
+                log.error("Error killing task: %s, %s", running[pid].name, e)
+        statuses.update(self.wait_children(killed))
+
+        # pid -> task, only one for each task, e.g. of many shards
+        stopped = odict()
+        for pid, task in running.items():
+            self.forget_pid(pid)
+            endstr, code = self.parse_return_status(statuses[pid])
+            task.child_exited(pid, code)
+            if task not in stopped.values():
+                stopped[pid] = task
+            log.info("Killed task: %s with pid %d", task.name, pid)
+        event_manager = component.get("EventManager")
+        for pid, task in stopped.items():
+            task.set_stop_flag()
+            event_manager.emit(mirror.event.TaskStopEvent(task.name, pid, task.code))
+
+    def wait_children(self, pids, timeout = None):
+        """
+        Wait for children `pids` together, without SIGCHLD handler.
+
+        :param timeout: the seconds to wait at most, None means until all of them exit
+        :returns: dict, pid -> status of children exited
+
+        """
+        statuses = {}
+        pending  = set(pids)
+        deadline = None if timeout is None else time.time() + timeout
+        delay    = 0.001
+        while pending:
+            for pid in list(pending):
+                try:
+                    wpid, status = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    # reaped by sigchld_handler() before it was disabled
+                    wpid, status = pid, self.pop_exited_child(pid)
+                if wpid == 0:
+                    continue
+                pending.discard(pid)
+                statuses[pid] = status
+            if not pending:
+                break
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        return statuses
+
+    def pop_exited_child(self, pid):
+        """
+        :returns: the status of `pid` in self.exited_children, or 0 if not found
+
+        """
+        for index, (exited, status) in enumerate(self.exited_children):
+            if exited == pid:
+                del self.exited_children[index]
+                return status
+        return 0
 
     @classmethod
     def get_runnable_priority(cls, current, limit):
@@ -561,11 +1255,7 @@ class Scheduler(Component):
         Else it is a function between target priority and (current / limit).
 
         """
-        if limit <= 0:
-            return PRIORITY_MAX
-        if current < limit:
-            return PRIORITY_MAX
-        return (-4.55 * (current * 1.0 / limit)) + 14.55
+        return runnable_priority(current, limit)
 
     @classmethod
     def parse_return_status(cls, status):
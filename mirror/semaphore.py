@@ -0,0 +1,161 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Limit running tasks that share a resource, besides `maxtasks`:
+
+    host:<host>      tasks syncing from the same upstream host, `hostlimit`
+    device:<st_dev>  tasks writing to the same filesystem, `devicelimit`
+    group:<name>     tasks in `groups` of their sections, `grouplimits`
+
+A running task holds one slot of every key it has, the slots are
+counted, so checking and taking them does not depend on the number
+of tasks.
+
+"""
+
+import os
+import logging
+
+from mirror.upstream import parse_upstream
+
+log = logging.getLogger(__name__)
+
+def host_key(upstream):
+    return "host:" + parse_upstream(upstream)[0].lower()
+
+def device_key(path):
+    """
+    :returns: key of the filesystem `path` is on, or None if it does not exist
+
+    """
+    try:
+        return "device:%d" % os.stat(path).st_dev
+    except OSError:
+        return None
+
+def group_keys(groups):
+    return [ "group:" + group for group in groups.split() ]
+
+def parse_grouplimits(grouplimits):
+    """
+    Parse `grouplimits` of config, e.g. "isos=1 debian=2".
+
+    :returns: dict of group -> limit
+    :raises ValueError: if it is not valid
+
+    """
+    limits = {}
+    for item in grouplimits.split():
+        group, sep, limit = item.partition("=")
+        if not sep or not group:
+            raise ValueError("%s is not group=limit" % item)
+        limits[group] = int(limit)
+    return limits
+
+class KeyedSemaphores(object):
+    """
+    Counters of running tasks by key, see the top of this module.
+
+    :param hostlimit: limit of every host key, 0 means no limit
+    :param devicelimit: limit of every device key, 0 means no limit
+    :param grouplimits: dict of group -> limit, groups not in it have no limit
+
+    """
+    def __init__(self, hostlimit = 0, devicelimit = 0, grouplimits = None):
+        self.set_limits(hostlimit, devicelimit, grouplimits)
+        # key -> the number of running tasks holding it
+        self.counts  = {}
+        # task name -> keys held by it
+        self.held    = {}
+        # the number of running tasks
+        self.running = 0
+
+    def set_limits(self, hostlimit = 0, devicelimit = 0, grouplimits = None):
+        self.hostlimit   = hostlimit
+        self.devicelimit = devicelimit
+        self.grouplimits = dict(grouplimits or {})
+
+    def get_limit(self, key):
+        """
+        :returns: limit of `key`, 0 means no limit
+
+        """
+        kind, sep, name = key.partition(":")
+        if kind == "host":
+            return self.hostlimit
+        if kind == "device":
+            return self.devicelimit
+        return self.grouplimits.get(name, 0)
+
+    def is_full(self, key):
+        limit = self.get_limit(key)
+        return limit > 0 and self.counts.get(key, 0) >= limit
+
+    def check(self, keys):
+        """
+        :returns: the first of `keys` whose limit is reached, or None
+
+        """
+        for key in keys:
+            if self.is_full(key):
+                return key
+        return None
+
+    def acquire(self, taskname, keys):
+        """
+        Take a slot of every key in `keys` for task `taskname`, it is
+        not checked here, as a task may be started regardless of limits,
+        e.g. by failover.
+
+        """
+        self.release(taskname)
+        keys = tuple(set(keys))
+        for key in keys:
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.held[taskname] = keys
+        self.running += 1
+
+    def release(self, taskname):
+        """
+        Give back slots held by task `taskname`.
+
+        :returns: False if it holds nothing
+
+        """
+        keys = self.held.pop(taskname, None)
+        if keys is None:
+            return False
+        for key in keys:
+            self.counts[key] -= 1
+            if self.counts[key] <= 0:
+                del self.counts[key]
+        self.running -= 1
+        return True
+
+    def get_keys(self, taskname):
+        return self.held.get(taskname, ())
+
+    def get_state(self):
+        """
+        :returns: dict of key -> the number of running tasks holding it
+
+        """
+        return dict(self.counts)
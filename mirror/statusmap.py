@@ -0,0 +1,228 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Task status shared by mirrord with other processes (e.g. `mirrord -t`).
+
+The file is mapped into memory, it has a fixed header followed by
+fixed-size slots, one slot for each task:
+
+    header: magic, version, flags, slot size, slot count, sequence
+    slot:   name, task type, state, priority, time, pid
+
+`sequence` is a seqlock: it is odd while mirrord is writing slots, so
+a reader retries until it reads the same even sequence before and
+after copying the slots.
+
+"""
+
+import os
+import mmap
+import time
+import fcntl
+import struct
+import logging
+
+from mirror.error import MirrorError
+
+log = logging.getLogger(__name__)
+
+STATUS_FILE = "/tmp/mirrord"
+
+MAGIC   = b"\x79\x71"
+VERSION = 2
+
+HEADER   = struct.Struct("=2sHIIIQ")
+SEQUENCE = struct.Struct("=Q")
+SEQUENCE_OFFSET = HEADER.size - SEQUENCE.size
+SLOT     = struct.Struct("=64sBBBxqi")
+
+# set in the header of an old file after it is replaced by a bigger one
+FLAG_STALE = 0x01
+
+STATE_FREE    = 0
+STATE_IDLE    = 1
+STATE_QUEUED  = 2
+STATE_RUNNING = 3
+
+class StatusWriter(object):
+    """
+    Write task status into STATUS_FILE, only slots whose
+    records are changed are written.
+
+    """
+    DEFAULT_SLOTS = 64
+
+    def __init__(self, path = STATUS_FILE):
+        self.path     = path
+        self.buffer   = None
+        self.nslots   = 0
+        self.sequence = 0
+        # task name -> slot index
+        self.slots    = {}
+        # task name -> record last written
+        self.records  = {}
+        self.free     = []
+
+    def update(self, records):
+        """
+        :param records: dict, task name -> (task type, state, priority, time, pid),
+                        or None if that task is removed
+
+        """
+        changed = [(name, record) for name, record in records.items()
+                   if self.records.get(name) != record]
+        if not changed:
+            return
+        for name, record in changed:
+            if record is None:
+                self.records.pop(name, None)
+            else:
+                self.records[name] = record
+
+        if self.buffer is None or len(self.records) > self.nslots:
+            self.create(max(self.DEFAULT_SLOTS, len(self.records) * 2))
+            return
+
+        self.begin()
+        for name, record in changed:
+            if record is None:
+                index = self.slots.pop(name, None)
+                if index is not None:
+                    self.free.append(index)
+                    self.write_slot(index, b"", (0, STATE_FREE, 0, 0, 0))
+                continue
+            if name not in self.slots:
+                self.slots[name] = self.free.pop()
+            self.write_slot(self.slots[name], name.encode("utf8"), record)
+        self.end()
+
+    def create(self, nslots):
+        """
+        Create a new file with `nslots` slots and write all records into it,
+        the new file replaces the old one atomically.
+
+        """
+        tmppath = "%s.%d" % (self.path, os.getpid())
+        size    = HEADER.size + nslots * SLOT.size
+        if os.path.exists(tmppath):
+            os.unlink(tmppath)
+        fd = os.open(tmppath, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o644)
+        try:
+            flag = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flag | fcntl.FD_CLOEXEC)
+            os.ftruncate(fd, size)
+            buffer = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(buffer, 0, MAGIC, VERSION, 0, SLOT.size, nslots, self.sequence)
+
+        old = self.buffer
+        self.buffer = buffer
+        self.nslots = nslots
+        self.slots  = {}
+        for index, (name, record) in enumerate(self.records.items()):
+            self.slots[name] = index
+            self.write_slot(index, name.encode("utf8"), record)
+        self.free   = list(range(nslots - 1, len(self.records) - 1, -1))
+        os.rename(tmppath, self.path)
+
+        if old is not None:
+            magic, version, flags, slotsize, count, sequence = HEADER.unpack_from(old, 0)
+            HEADER.pack_into(old, 0, magic, version, flags | FLAG_STALE,
+                             slotsize, count, sequence)
+            old.close()
+        log.debug("Created %s with %d slots", self.path, nslots)
+
+    def begin(self):
+        self.sequence += 1
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, self.sequence)
+
+    def end(self):
+        self.sequence += 1
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, self.sequence)
+
+    def write_slot(self, index, name, record):
+        tasktype, state, priority, next_time, pid = record
+        SLOT.pack_into(self.buffer, HEADER.size + index * SLOT.size,
+                       name[:64], tasktype, state, priority, int(next_time), pid)
+
+    def close(self):
+        if self.buffer is None:
+            return
+        self.buffer.close()
+        self.buffer = None
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            log.warning("Unable to remove %s: %s", self.path, e)
+
+def read_status(path = STATUS_FILE, retries = 1000):
+    """
+    Read a consistent snapshot of all tasks.
+
+    :returns: a list of (name, task type, state, priority, time, pid)
+    :raises MirrorError: if `path` is not written by mirrord or
+                         can not get a consistent snapshot
+
+    """
+    for i in range(retries):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            buffer = mmap.mmap(fd, os.fstat(fd).st_size, mmap.MAP_SHARED, mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        try:
+            if len(buffer) < HEADER.size:
+                raise MirrorError("Wrong file %s", path)
+            magic, version, flags, slotsize, nslots, sequence = HEADER.unpack_from(buffer, 0)
+            if magic != MAGIC or version != VERSION or slotsize != SLOT.size:
+                raise MirrorError("Wrong file %s", path)
+            records = _read_slots(buffer, nslots, retries)
+            if records is not None:
+                return records
+            if not (HEADER.unpack_from(buffer, 0)[2] & FLAG_STALE):
+                break
+        finally:
+            buffer.close()
+    raise MirrorError("Unable to read a consistent snapshot of %s", path)
+
+def _read_slots(buffer, nslots, retries):
+    size = HEADER.size + nslots * SLOT.size
+    for i in range(retries):
+        flags    = HEADER.unpack_from(buffer, 0)[2]
+        if flags & FLAG_STALE:
+            # replaced by a bigger file, need to reopen it
+            return None
+        sequence = SEQUENCE.unpack_from(buffer, SEQUENCE_OFFSET)[0]
+        if sequence & 1:
+            time.sleep(0.001)
+            continue
+        data = buffer[HEADER.size:size]
+        if SEQUENCE.unpack_from(buffer, SEQUENCE_OFFSET)[0] != sequence:
+            continue
+        records = []
+        for name, tasktype, state, priority, next_time, pid in SLOT.iter_unpack(data):
+            if state == STATE_FREE:
+                continue
+            records.append((name.rstrip(b"\x00").decode("utf8", "replace"),
+                            tasktype, state, priority, next_time, pid))
+        return records
+    return None
@@ -20,8 +20,12 @@
 
 
 import os
-import re
+import time
 import socket
+import struct
+import logging
+
+log = logging.getLogger(__name__)
 
 d = { 1: 0, 5: 1, 15: 2}
 
@@ -52,36 +56,218 @@ TCP_STATUS = enum(TCP_ESTABLISHED =1,\
                   TCP_LISTEN      =10,\
                   TCP_CLOSING     =11)
 
-pattern = (r"\d+:\s+" + 
-           r"(?P<local_addr>[\da-fA-F]+):(?P<local_port>[\da-fA-F]+)\s+" +
-           r"(?P<remote_addr>[\da-fA-F]+):(?P<remote_port>[\da-fA-F]+)\s+" +
-           r"(?P<status>[\da-fA-F]+)\s+[\da-fA-F]+:[\da-fA-F]+\s+[\da-fA-F]+:[\da-fA-F]+\s+[\da-fA-F]+\s+\d+\s+\d+\s+" +
-           r"(?P<inode>\d+)")
+# See linux/netlink.h, linux/sock_diag.h and linux/inet_diag.h
+NETLINK_SOCK_DIAG      = 4
+SOCK_DIAG_BY_FAMILY    = 20
+NLM_F_REQUEST          = 0x01
+NLM_F_DUMP             = 0x300
+NLMSG_ERROR            = 2
+NLMSG_DONE             = 3
+INET_DIAG_REQ_BYTECODE = 1
+INET_DIAG_BC_S_GE      = 2
+INET_DIAG_BC_S_LE      = 3
+
+# len, type, flags, seq, pid
+NLMSGHDR  = struct.Struct("=IHHII")
+# family, protocol, ext, states, and an empty inet_diag_sockid
+INET_DIAG_REQ_V2 = struct.Struct("=BBBxI48x")
+# code, yes, no
+INET_DIAG_BC_OP  = struct.Struct("=BBH")
+RTATTR    = struct.Struct("=HH")
+# family, state, timer, retrans, source port
+INET_DIAG_MSG    = struct.Struct("=BBBBH")
 
 def tcpconn(port = 80):
+    """
+    Count established tcp connections whose local port is `port`.
+
+    It asks the kernel through a NETLINK_SOCK_DIAG socket, which filters
+    connections in kernel, and falls back to read /proc/net/tcp{,6}.
+
+    """
     try:
-        # TODO: using AF_NETLINK to fetch tcp information instead from /proc
-        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW)
-        sock.close()
+        return netlink_tcpconn(port)
     except Exception as e:
-        pass
+        log.debug("Unable to count tcp connections by netlink: %s", e)
+    return proc_tcpconn(port)
+
+def netlink_tcpconn(port = 80):
+    # The bytecode runs: if sport >= port and sport <= port then accept,
+    # jumping to len + 4 means reject.
+    bytecode  = (INET_DIAG_BC_OP.pack(INET_DIAG_BC_S_GE, 8, 20) +
+                 INET_DIAG_BC_OP.pack(0, 0, port) +
+                 INET_DIAG_BC_OP.pack(INET_DIAG_BC_S_LE, 8, 12) +
+                 INET_DIAG_BC_OP.pack(0, 0, port))
+    attribute = RTATTR.pack(RTATTR.size + len(bytecode), INET_DIAG_REQ_BYTECODE) + bytecode
+
+    connections = 0
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG)
+    try:
+        for seq, family in enumerate((socket.AF_INET, socket.AF_INET6)):
+            request = INET_DIAG_REQ_V2.pack(family, socket.IPPROTO_TCP, 0,
+                                            1 << TCP_STATUS.TCP_ESTABLISHED) + attribute
+            sock.send(NLMSGHDR.pack(NLMSGHDR.size + len(request), SOCK_DIAG_BY_FAMILY,
+                                    NLM_F_REQUEST | NLM_F_DUMP, seq + 1, 0) + request)
+            connections += _netlink_count(sock, port)
+    finally:
+        sock.close()
+    return connections
+
+def _netlink_count(sock, port):
     connections = 0
-    tcp   = re.compile(pattern)
-    files = ("/proc/net/tcp", "/proc/net/tcp6")
+    # sport in inet_diag_msg is in network byte order
+    sport = socket.htons(port)
+    while True:
+        data   = sock.recv(65536)
+        offset = 0
+        while offset + NLMSGHDR.size <= len(data):
+            length, msgtype, flags, seq, pid = NLMSGHDR.unpack_from(data, offset)
+            if msgtype == NLMSG_DONE:
+                return connections
+            if msgtype == NLMSG_ERROR:
+                errno = -struct.unpack_from("=i", data, offset + NLMSGHDR.size)[0]
+                raise OSError(errno, os.strerror(errno))
+            if msgtype == SOCK_DIAG_BY_FAMILY:
+                family, state, timer, retrans, source = INET_DIAG_MSG.unpack_from(
+                                                  data, offset + NLMSGHDR.size)
+                # in case the bytecode is ignored
+                if state == TCP_STATUS.TCP_ESTABLISHED and source == sport:
+                    connections += 1
+            if length < NLMSGHDR.size:
+                raise OSError("Invalid netlink message")
+            offset += (length + 3) & ~3
+
+def proc_tcpconn(port = 80, files = ("/proc/net/tcp", "/proc/net/tcp6")):
+    """
+    Count established tcp connections by reading `files`, each line
+    looks like (st is the status):
+
+       sl  local_address rem_address   st ...
+        0: 0100007F:0050 00000000:0000 0A ...
+
+    """
+    connections = 0
+    suffix      = (":%04X" % port).encode()
+    established = ("%02X" % TCP_STATUS.TCP_ESTABLISHED).encode()
     for path in files:
-        if os.access(path, os.R_OK):
-            fp = open(path)
+        if not os.access(path, os.R_OK):
+            continue
+        with open(path, "rb") as fp:
             fp.readline() # skip title
             for line in fp:
-                conn = tcp.search(line).groupdict()
-                local_port = int(conn['local_port'], 16)
-                if local_port != port:
+                fields = line.split(None, 4)
+                if len(fields) < 4:
                     continue
-                status = int(conn['status'], 16)
-                if status == TCP_STATUS.TCP_ESTABLISHED:
+                if fields[3] == established and fields[1].endswith(suffix):
                     connections += 1
-            fp.close()
     return connections
 
+# resources of /proc/pressure, see Documentation/accounting/psi.rst
+PRESSURE_RESOURCES = ("cpu", "io", "memory")
+
+def pressure(resource, field = b"avg10", path = "/proc/pressure"):
+    """
+    Percentage of time some tasks stalled on `resource` recently, the
+    first line of /proc/pressure/<resource> looks like:
+
+        some avg10=1.53 avg60=0.87 avg300=0.23 total=12345
+
+    :returns: the value of `field`, or 0.0 if PSI is not available
+
+    """
+    try:
+        with open(os.path.join(path, resource), "rb") as fp:
+            line = fp.readline()
+    except (IOError, OSError):
+        return 0.0
+    for item in line.split()[1:]:
+        key, sep, value = item.partition(b"=")
+        if key == field:
+            return float(value)
+    return 0.0
+
+def disk_device(path):
+    """
+    :returns: (major, minor) of the device `path` is on
+
+    """
+    st_dev = os.stat(path).st_dev
+    return (os.major(st_dev), os.minor(st_dev))
+
+class DiskUtilization(object):
+    """
+    Percentage of time the device was busy since last call, by the
+    io_ticks field (the 13th) of its line in /proc/diskstats:
+
+        8  0 sda 4 0 8 1 2 0 16 3 0 12 4 ...
+
+    It returns 0.0 on the first call, or if the device is not found,
+    e.g. a tmpfs.
+
+    :param device: (major, minor)
+
+    """
+    def __init__(self, device, path = "/proc/diskstats"):
+        self.prefix = ("%d %d " % device).encode()
+        self.path   = path
+        self.last   = None
+
+    def read_ticks(self):
+        with open(self.path, "rb") as fp:
+            for line in fp:
+                fields = line.split(None, 13)
+                if len(fields) > 12 and fields[0] + b" " + fields[1] + b" " == self.prefix:
+                    return int(fields[12])
+        return None
+
+    def __call__(self):
+        now   = time.monotonic()
+        ticks = self.read_ticks()
+        last, self.last = self.last, (now, ticks)
+        if ticks is None or last is None or last[1] is None or now <= last[0]:
+            return 0.0
+        return min(100.0, (ticks - last[1]) / ((now - last[0]) * 10.0))
+
+class NetRate(object):
+    """
+    Bytes per second received or sent since last call, whichever is
+    higher, of `interfaces`, by /proc/net/dev:
+
+        eth0: 1234 5 0 0 0 0 0 0 5678 6 0 0 0 0 0 0
+
+    It returns 0.0 on the first call.
+
+    :param interfaces: names of interfaces, None means all but lo
+
+    """
+    def __init__(self, interfaces = None, path = "/proc/net/dev"):
+        self.interfaces = set(interface.encode() for interface in interfaces or ())
+        self.path       = path
+        self.last       = None
+
+    def read_bytes(self):
+        received = sent = 0
+        with open(self.path, "rb") as fp:
+            for line in fp:
+                name, sep, counters = line.partition(b":")
+                name = name.strip()
+                if not sep or name == b"lo" and not self.interfaces:
+                    continue
+                if self.interfaces and name not in self.interfaces:
+                    continue
+                counters  = counters.split()
+                received += int(counters[0])
+                sent     += int(counters[8])
+        return (received, sent)
+
+    def __call__(self):
+        now = time.monotonic()
+        received, sent = self.read_bytes()
+        last, self.last = self.last, (now, received, sent)
+        if last is None or now <= last[0]:
+            return 0.0
+        return max(received - last[1], sent - last[2]) / (now - last[0])
+
+
 if __name__ == "__main__":
     print("Current connections: %d" % tcpconn(port = 44971))
@@ -24,29 +24,60 @@ import os
 import sys
 import time
 import shlex
-import bisect
 import signal
 import logging
 import mirror.common
 
-from mirror.common import is_python3
+from mirror.error    import MirrorError
+from mirror.common   import is_python3
+from mirror.cron     import CronSchedule
+from mirror.upstream import rsync_source
+from mirror.pipeline import Stage, Pipeline, parse_stages, parse_shards, join_path
 
 log = logging.getLogger(__name__)
 
 DEFAULT_ARGS = "--links --hard-links --times --verbose --delete --recursive"
+DELETE_ARGS  = ("--del", "--delete", "--delete-before", "--delete-during",
+                "--delete-delay", "--delete-after")
+
+# the number of processes of a task can be running at the same time
+MAX_JOBS     = 4
 
 PRIORITY_MIN = 1  # high priority
 PRIORITY_MAX = 10 # low  priority
 
+# how a task's process is started, see AbstractTask.execute()
+LAUNCHER_FORK  = "fork"
+LAUNCHER_SPAWN = "spawn"
+LAUNCHERS      = (LAUNCHER_FORK, LAUNCHER_SPAWN)
+
+# fds of a spawned task
+STDOUT_FILENO = 1
+STDERR_FILENO = 2
+
 REGULAR_TASK = 1  # regular task
 TIMEOUT_TASK = 2  # timeout checking task
 SYSTEM_TASK  = 3  # system internal task, run in thread, so this is different
                   # with REGULAR_TASK
 
+# names of cron fields, for error messages
+CRON_FIELDS = ('time_minute', 'time_hour', 'time_dom', 'time_month', 'time_dow')
+
 class AbstractTask(object):
+    # There may be tens of thousands of tasks, so they have no __dict__.
+    # NOTE: subclasses must declare __slots__ for their own attributes.
+    __slots__ = ("scheduler", "name", "taskinfo", "enabled", "isinternal",
+                 "time", "cron", "priority", "running", "command", "cmdname",
+                 "pid", "code", "timeout", "autoretry", "launcher", "start_time",
+                 "args", "maxjobs", "stages", "pipeline", "usage",
+                 "bwlimit")
+
     def __init__(self, name, scheduler_ref=None, **taskinfo):
         self.scheduler = (scheduler_ref() if scheduler_ref is not None else None)
-        self.name      = name
+        # task names are keys of many dicts, and in every queue entry and event
+        self.name      = sys.intern(name)
+        # the config section, to find out whether it is changed on reload
+        self.taskinfo  = taskinfo
         self.enabled   = True
         self.isinternal= False
 
@@ -55,16 +86,13 @@ class AbstractTask(object):
             log.error("Error in config for task: %s, time not set.", self.name)
             self.enabled = False
         crontime = mirror.common.parse_cron_time(self.time)
+        self.cron = CronSchedule(*crontime[:5]) if crontime else None
         if crontime:
-            self.time_minute = crontime[0]
-            self.time_hour    = crontime[1]
-            self.time_dom     = crontime[2]
-            self.time_month   = crontime[3]
-            self.time_dow     = crontime[4]
-            for attr in ('time_minute', 'time_hour', 'time_dom', 'time_month', 'time_dow'):
-                if len(getattr(self, attr)) == 0:
+            # only the bitmasks of self.cron are kept
+            for field, values in zip(CRON_FIELDS, crontime):
+                if len(values) == 0:
                     log.error("Error in config for task: %s, time: %s not valid.",
-                              self.name, attr)
+                              self.name, field)
                     self.enabled = False
         else:
             log.error("Error in config for task: %s, time not valid.", self.name)
@@ -81,6 +109,14 @@ class AbstractTask(object):
             self.priority = PRIORITY_MAX
 
         self.running = False
+        # None if the task has only one stage, see init_stages()
+        self.stages   = None
+        # the current run of stages
+        self.pipeline = None
+        # usage of resources by the last run, see mirror.cgroup.Cgroups.finish()
+        self.usage    = None
+        # bytes per second shared to the task, see mirror.bandwidth
+        self.bwlimit  = 0
         if taskinfo.get("isinternal", False) != False:
             self.isinternal = True
             return
@@ -95,177 +131,350 @@ class AbstractTask(object):
         # NOTE: `command` is just a command name, but
         # self.command is the complete path...
         self.command   = mirror.common.find_command(command)
-        self.cmdname   = command
+        if self.command:
+            self.command = sys.intern(self.command)
+        self.cmdname   = sys.intern(command)
         if not self.command:
             log.error("command `%s` not found in PATH, please install that first :)",
                       command)
             self.enabled = False
         self.pid       = 0
-        self.stage     = 1
         self.code      = 0
+        self.timeout   = 0
         try:
-            self.twostage = taskinfo['twostage'] != "0" 
             self.timeout  = mirror.common.parse_timestr(taskinfo['timeout'])
         except KeyError as e:
             log.error("Error in config for task: %s, key: %s not found.", self.name, e)
             self.enabled  = False
 
-        if self.twostage and "firststage" not in taskinfo:
+        if taskinfo.get("twostage", "0") != "0" and "firststage" not in taskinfo:
             log.error("Error in config for task: %s, `twostage` is set but no `firststage`.", self.name)
-            self.twostage = False
-        if self.twostage:
-            self.firststage = taskinfo['firststage']
 
         # autoretry indicates whether a task is retried after an interval
         # when it failed. if 0, it is disabled
         self.autoretry = mirror.common.parse_timestr(
                              taskinfo.get("autoretry", '0'))
 
-    def run(self, stage = 1):
+        # if not set, `launcher` in general section is used
+        self.launcher  = taskinfo.get("launcher", None)
+        if self.launcher is not None and self.launcher not in LAUNCHERS:
+            log.error("Error in config for task: %s, launcher: %s not valid.",
+                      self.name, self.launcher)
+            self.launcher = None
+
+        try:
+            self.maxjobs = max(int(taskinfo.get("shardjobs", MAX_JOBS)), 1)
+        except ValueError:
+            log.error("Error in config for task: %s, shardjobs not valid.", self.name)
+            self.maxjobs = MAX_JOBS
+
+    def init_stages(self, taskinfo, args, exclude = None):
+        """
+        Stages of the task are from `stages` of config (see mirror.pipeline),
+        or given by get_legacy_stages(), e.g. for `twostage`.
+
+        :param args: default args of stages
+        :param exclude: default exclude of stages
+
+        """
         try:
-            self.stage = stage
-            self.execute(stage)
-        except Exception as e:
-            log.error("Error occurred when run `%s`: %s.", self.name, e)
-            # If fork succeed but error occurred before execv, we need to exit child process
-            if os.getpid() == self.pid:
-                sys.exit(1)
+            self.stages = (parse_stages(taskinfo, args, exclude) or
+                           self.get_legacy_stages(taskinfo))
+        except ValueError as e:
+            log.error("Error in config for task: %s, %s.", self.name, e)
+            self.enabled = False
+
+    def get_legacy_stages(self, taskinfo):
+        """
+        :returns: list of Stage for `twostage`, or None
+
+        """
+        return None
+
+    def get_default_stage(self):
+        raise MirrorError("AbstractTask's get_default_stage() is not implemented.")
+
+    def get_stages(self):
+        """
+        :returns: list of Stage, there is only one if `stages` is not set
+
+        """
+        return self.stages or [ self.get_default_stage() ]
+
+    def has_timeout(self):
+        """
+        :returns: True if the task or any of its stages has a timeout
+
+        """
+        return self.timeout > 0 or any(stage.timeout > 0 for stage in self.stages or ())
+
+    def get_deadline(self):
+        """
+        :returns: the time when the task timeouts, or None
+
+        """
+        deadlines = []
+        if self.timeout > 0:
+            deadlines.append(self.start_time + self.timeout)
+        if self.pipeline is not None and self.pipeline.get_deadline() is not None:
+            deadlines.append(self.pipeline.get_deadline())
+        return min(deadlines) if deadlines else None
+
+    def run(self):
+        """
+        Start the task, i.e. stages of it which wait for no others.
+
+        """
+        self.code       = 0
+        self.start_time = int(time.time())
+        self.pipeline   = Pipeline(self.name, self.get_stages(), self.maxjobs)
+        cgroups = self.get_cgroups()
+        if cgroups is not None:
+            cgroups.start(self)
+        self.run_jobs()
+
+    def run_jobs(self):
+        """
+        Start jobs of stages that are ready, at most `maxjobs` processes
+        of the task are running at the same time.
+
+        :returns: list of pids of started processes
+
+        """
+        started = []
+        if self.pipeline is None:
+            return started
+        for job in self.pipeline.ready():
+            stage, shard = job
+            try:
+                self.execute(self.pipeline.stages[stage], shard)
+            except Exception as e:
+                log.error("Error occurred when run `%s`: %s.", self.name, e)
+                # If fork succeed but error occurred before execv, we need to exit child process
+                if os.getpid() == self.pid:
+                    sys.exit(1)
+                # the task is not complete without it, so nothing else is started
+                self.pipeline.abort(1)
+                break
+            self.pipeline.add(self.pid, job)
+            started.append(self.pid)
+        self.code = self.pipeline.code
+        if not self.pipeline.running:
             # If we are in parent process, e.g. scheduler
-            self.pid     = 0
-            self.running = False
+            self.set_stop_flag()
+        return started
+
+    def execute(self, stage, shard = None):
+        if self.get_launcher() == LAUNCHER_SPAWN:
+            self.execute_spawn(stage, shard)
+        else:
+            self.execute_fork(stage, shard)
+
+    def get_launcher(self):
+        launcher = self.launcher
+        if launcher is None and self.scheduler:
+            launcher = getattr(self.scheduler, "launcher", None)
+        # a forked child attaches itself to the task's cgroup (or sets
+        # its priority) before execv(), while a spawned process may
+        # fork its helpers before mirrord could attach it
+        if (launcher == LAUNCHER_SPAWN and hasattr(os, "posix_spawn") and
+                self.get_cgroups() is None):
+            return LAUNCHER_SPAWN
+        return LAUNCHER_FORK
+
+    def get_cgroups(self):
+        """
+        :returns: mirror.cgroup.Cgroups of the scheduler, or None if
+                  `cgroup` is not set in config
+
+        """
+        return getattr(self.scheduler, "cgroups", None) if self.scheduler else None
 
-    def execute(self, stage):
+    def get_logfile(self):
+        if self.scheduler:
+            logdir = self.scheduler.logdir
+        else:
+            logdir = mirror.common.DEFAULT_TASK_LOG_DIR
+        if not os.path.exists(logdir):
+            os.makedirs(logdir, 0o755)
+        return logdir + self.name + '.log.' + time.strftime('%Y-%m-%d')
+
+    def execute_fork(self, stage, shard = None):
         pid = os.fork()
         if pid > 0:
             self.pid        = pid
             self.running    = True
-            self.start_time = int(time.time())
         elif pid == 0:
             self.pid   = os.getpid()
-            if self.scheduler:
-                logdir = self.scheduler.logdir
-            else:
-                logdir = mirror.common.DEFAULT_TASK_LOG_DIR
-            if not os.path.exists(logdir):
-                os.makedirs(logdir, 0o755)
-            fp = open(logdir + self.name + '.log.' + time.strftime('%Y-%m-%d'), 'a')
+            fp = open(self.get_logfile(), 'a')
             # Redirect child process's stdout and stderr
             os.dup2(fp.fileno(), sys.stdout.fileno())
             os.dup2(fp.fileno(), sys.stderr.fileno())
             fp.close()
-            os.execv(self.command, self.get_args(stage))
+            cgroups = self.get_cgroups()
+            if cgroups is not None:
+                cgroups.attach(self, 0)
+            os.execv(self.command, self.get_exec_args(stage, shard))
+
+    def execute_spawn(self, stage, shard = None):
+        """
+        Start the task with posix_spawn(), which does not copy the page
+        tables of mirrord (glibc uses vfork or clone(CLONE_VM)), and its
+        errors are raised here instead of in a forked child.
+
+        It is not used if `cgroup` is set, see get_launcher().
+
+        """
+        logfile = self.get_logfile()
+        # Redirect child process's stdout and stderr, which are always
+        # 1 and 2 in the child, whatever sys.stdout of mirrord is
+        file_actions = [
+            (os.POSIX_SPAWN_OPEN, STDOUT_FILENO, logfile,
+             os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644),
+            (os.POSIX_SPAWN_DUP2, STDOUT_FILENO, STDERR_FILENO),
+        ]
+        pid = os.posix_spawn(self.command, self.get_exec_args(stage, shard), os.environ,
+                             file_actions = file_actions)
+        self.pid        = pid
+        self.running    = True
 
     def stop(self, signo = signal.SIGTERM):
-        if self.pid > 0:
+        """
+        Kill running processes of the task, and start no more, they are
+        reaped as usual, see child_exited().
+
+        """
+        if self.pipeline is not None:
+            self.pipeline.abort()
+        for pid in self.get_pids():
             try:
-                os.kill(self.pid, signo)
+                os.kill(pid, signo)
             except:
                 log.exception('Error killing task: %s', self.name)
-        if not self.twostage:
-            self.set_stop_flag()
+
+    def get_pids(self):
+        """
+        :returns: list of pids of running processes of the task
+
+        """
+        if self.pipeline is None:
+            return []
+        return self.pipeline.get_pids()
+
+    def child_exited(self, pid, code):
+        """
+        Record the exit code of a process of the task.
+
+        :returns: True if the task is finished, i.e. no process of it
+                  is running or can be started
+
+        """
+        if self.pipeline is None or pid not in self.pipeline.running:
+            self.code = code
+            return True
+        finished  = self.pipeline.exited(pid, code)
+        self.code = self.pipeline.code
+        return finished
 
     def set_stop_flag(self):
-        self.pid     = 0
-        self.running = False
+        self.pid      = 0
+        self.running  = False
+        self.pipeline = None
 
     TIME_STRUCT  = 1
     TIME_SECONDS = 2
 
     def get_schedule_time(self, since, style=TIME_SECONDS):
         """
-        This method is too long.
+        Get the next schedule time after `since`.
 
         """
-
-        if not hasattr(self, "time_minute"):
+        if self.cron is None:
             return None
         if not self.enabled:
             return None
-        since_struct  = time.localtime(since)
-
-        minute = since_struct.tm_min
-        hour    = since_struct.tm_hour
-        day     = since_struct.tm_mday
-        month   = since_struct.tm_mon
-        year    = since_struct.tm_year
-
-        day_increase   = False
-        month_increase = False
-        year_increase  = False
-        if since_struct.tm_mon in self.time_month and since_struct.tm_mday in self.time_dom:
-            minute_idx = bisect.bisect(self.time_minute, since_struct.tm_min)
-            if since_struct.tm_hour in self.time_hour and minute_idx < len(self.time_minute):
-                minute = self.time_minute[minute_idx]
-                hour    = since_struct.tm_hour
-            else:
-                minute  = self.time_minute[0]
-                hour_idx = bisect.bisect(self.time_hour, since_struct.tm_hour)
-                if hour_idx < len(self.time_hour):
-                    hour = self.time_hour[hour_idx]
-                else:
-                    hour = self.time_hour[0]
-                    day_increase = True
-            if len(self.time_minute) == 60 and len(self.time_hour) != 24:
-                minute  = self.time_minute[0]
-                hour_idx = bisect.bisect(self.time_hour, since_struct.tm_hour)
-                if hour_idx < len(self.time_hour):
-                    hour = self.time_hour[hour_idx]
-                else:
-                    hour = self.time_hour[0]
-                    day_increase = True
-            if not day_increase:
-                day   = since_struct.tm_mday
-                month = since_struct.tm_mon
-        if since_struct.tm_mday not in self.time_dom or day_increase:
-            minute = self.time_minute[0]
-            hour    = self.time_hour[0]
-            day_idx = bisect.bisect(self.time_dom, since_struct.tm_mday)
-            if day_idx < len(self.time_dom):
-                day = self.time_dom[day_idx]
-            else:
-                day = self.time_dom[0]
-                month_increase = True
-            if not month_increase:
-                month = since_struct.tm_mon
-        if since_struct.tm_mon not in self.time_month or month_increase:
-            minute = self.time_minute[0]
-            hour    = self.time_hour[0]
-            day     = self.time_dom[0]
-            month_idx = bisect.bisect(self.time_month, since_struct.tm_mon)
-            if month_idx < len(self.time_month):
-                month = self.time_month[month_idx]
-            else:
-                month = self.time_month[0]
-                year_increase = True
-        if year_increase:
-            year += 1
-
-        next_time   = time.mktime((year, month, day, hour, minute, 0, 0, 0, 0))
-        next_struct = time.localtime(next_time)
-        if (next_struct.tm_wday + 1) not in self.time_dow:
-            from datetime import datetime, timedelta
-            wday_idx = bisect.bisect(self.time_dow, next_struct.tm_wday)
-            if wday_idx < len(self.time_dow):
-                wdays = self.time_dow[wday_idx] - next_struct.tm_wday
-            else:
-                wdays = (7 - self.time_dow[-1]) + self.time_dow[0]
-            delta = timedelta(days = wdays)
-            next_time = time.mktime((datetime.fromtimestamp(next_time) + delta).timetuple())
+        next_time = self.cron.next_after(since)
 
         if style == self.TIME_SECONDS:
             return next_time
         else:
             return time.localtime(next_time)
 
-    def get_args(self, stage = 1):
+    def get_args(self, stage = None, shard = None):
+        """
+        :param stage: a Stage of the task, None means the first one
+        :param shard: index of the shard of `stage`, None if it is not sharded
+
+        """
         raise MirrorError("AbstractTask's get_args() is not implemented.")
 
+    def get_exec_args(self, stage, shard = None):
+        """
+        :returns: get_args() with the share of `bwlimit` of a process
+
+        """
+        args = self.get_args(stage, shard)
+        if self.bwlimit <= 0 or self.pipeline is None:
+            return args
+        return self.add_bwlimit(args, max(1, self.bwlimit // self.pipeline.get_width()))
+
+    def can_limit_bandwidth(self):
+        """
+        :returns: True if add_bwlimit() limits processes of the task
+
+        """
+        return False
+
+    def add_bwlimit(self, args, rate):
+        """
+        :param rate: bytes per second
+        :returns: `args` that limit bandwidth to `rate`
+
+        """
+        return args
+
+    def select_upstream(self, selector, busy = ()):
+        """
+        Choose the upstream for a new run, by an UpstreamSelector,
+        upstreams in `busy` are only used if the others fail.
+
+        """
+        pass
+
+    def get_upstreams(self):
+        """
+        :returns: list of configured upstreams
+
+        """
+        return []
+
+    def next_upstream(self):
+        """
+        Switch to the next upstream after the current one failed.
+
+        :returns: True if there is one
+
+        """
+        return False
+
+    def get_upstream(self):
+        return None
+
 class Task(AbstractTask):
+    __slots__ = ("upstream", "rsyncdir", "localdir", "exclude",
+                 "upstreams", "upstream_index")
+
     def __init__(self, name, scheduler_ref=None, **taskinfo):
         super(Task, self).__init__(name, scheduler_ref, **taskinfo)
 
+        # upstreams ordered for current run, see select_upstream()
+        self.upstreams      = []
+        self.upstream_index = 0
         try:
             self.upstream = taskinfo['upstream[]']
+            if not isinstance(self.upstream, list):
+                self.upstream = [ self.upstream ]
+            self.upstreams = self.upstream
             self.rsyncdir = taskinfo['rsyncdir']
             if self.rsyncdir[-1] != '/':
                 self.rsyncdir += '/'
@@ -281,26 +490,96 @@ class Task(AbstractTask):
 
         self.exclude  = taskinfo['exclude'] if "exclude" in taskinfo else None
         self.args     = taskinfo['args']    if "args" in taskinfo    else DEFAULT_ARGS
+        self.init_stages(taskinfo, self.args, self.exclude)
+
+    def get_legacy_stages(self, taskinfo):
+        """
+        `twostage` syncs `firststage` first, then the whole tree with
+        --delete-after.
+
+        `shards` splits the tree, or `shardroot` in it, into shards (see
+        mirror.pipeline.parse_shards()) synced without deletion, then
+        the whole tree is synced with --delete-after after all of them.
 
-    def get_args(self, stage = 1):
+        """
+        args    = shlex.split(self.args)
+        exclude = shlex.split(self.exclude) if self.exclude else []
+        final   = [arg for arg in args if arg not in DELETE_ARGS] + ["--delete-after"]
+        shards  = parse_shards(taskinfo.get("shards", None),
+                               join_path('', taskinfo.get("shardroot", "")))
+        if taskinfo.get("twostage", "0") != "0" and "firststage" in taskinfo:
+            if shards:
+                log.error("Error in config for mirror: %s, `twostage` does not work with `shards`.",
+                          self.name)
+            firststage = join_path('', taskinfo['firststage'])
+            return [ Stage("first", firststage, args, exclude),
+                     Stage("second", '', final, exclude + ['--exclude', '/' + firststage],
+                           after = [ 0 ]) ]
+        if shards:
+            # --delete-excluded would delete entries of other shards
+            args = [arg for arg in args if arg not in DELETE_ARGS and arg != "--delete-excluded"]
+            return [ Stage("shards", shards[0][0], args, exclude, shards = shards),
+                     Stage("final", '', final, exclude, after = [ 0 ]) ]
+        return None
+
+    def get_default_stage(self):
+        return Stage("main", '', shlex.split(self.args),
+                     shlex.split(self.exclude) if self.exclude else [])
+
+    def run(self):
+        for stage in self.get_stages():
+            for path in [ path for path, filters in stage.shards ] or [ stage.path ]:
+                directory = self.localdir + '/' + path
+                if path and not os.path.exists(directory):
+                    try:
+                        os.makedirs(directory, 0o755)
+                    except:
+                        log.error("Error when create directory: %s", directory)
+        super(Task, self).run()
+
+    def get_args(self, stage = None, shard = None):
+        if stage is None:
+            stage = self.get_stages()[0]
+        path, filters = stage.shards[shard] if shard is not None else (stage.path, [])
         args  = [os.path.basename(self.command)]
-        args += shlex.split(self.args)
-        if self.twostage and stage == 2:
-            args.remove("--delete")
-            args.append("--delete-after")
-        if self.exclude:
-            args += shlex.split(self.exclude)
-        if self.twostage and stage == 1:
-            args += [self.upstream[0] + '::' + self.rsyncdir + self.firststage + '/',\
-                     self.localdir + '/' + self.firststage]
-            return args
-        if self.twostage and stage == 2:
-            args += ['--exclude', '/' + self.firststage + '/']
-        args += [self.upstream[0] + '::' + self.rsyncdir,\
-                 self.localdir]
+        args += stage.args
+        args += stage.exclude
+        args += filters
+        args += [rsync_source(self.get_upstream(), self.rsyncdir + path),\
+                 self.localdir + '/' + path.rstrip('/') if path else self.localdir]
         return args
 
+    def can_limit_bandwidth(self):
+        return self.cmdname == "rsync"
+
+    def add_bwlimit(self, args, rate):
+        if not self.can_limit_bandwidth():
+            return args
+        # after --bwlimit in `args` if any, as the last one is used,
+        # in KiB per second
+        return args[:-2] + [ "--bwlimit=%d" % max(1, rate // 1024) ] + args[-2:]
+
+    def select_upstream(self, selector, busy = ()):
+        ranked              = selector.rank(self.upstream)
+        self.upstreams      = ([upstream for upstream in ranked if upstream not in busy] +
+                               [upstream for upstream in ranked if upstream in busy])
+        self.upstream_index = 0
+
+    def get_upstreams(self):
+        return self.upstream
+
+    def next_upstream(self):
+        if self.upstream_index + 1 >= len(self.upstreams):
+            return False
+        self.upstream_index += 1
+        return True
+
+    def get_upstream(self):
+        return self.upstreams[self.upstream_index]
+
 class SimpleTask(AbstractTask):
+    __slots__ = ()
+
     def __init__(self, name, scheduler_ref=None, **taskinfo):
         super(SimpleTask, self).__init__(name, scheduler_ref, **taskinfo)
 
@@ -310,21 +589,29 @@ class SimpleTask(AbstractTask):
 
         """
         self.args = taskinfo['args'] if "args" in taskinfo else None
+        self.init_stages(taskinfo, self.args)
 
-    def get_args(self, stage = 1):
-        args  = [os.path.basename(self.command)]
-        if self.twostage and stage == 1:
-            args += self.firststage.split(" ")
-            return args
-        if self.args:
-            args += shlex.split(self.args)
-        return args
+    def get_legacy_stages(self, taskinfo):
+        if taskinfo.get("twostage", "0") != "0" and "firststage" in taskinfo:
+            return [ Stage("first",  args = shlex.split(taskinfo['firststage'])),
+                     Stage("second", args = shlex.split(self.args or ''), after = [ 0 ]) ]
+        return None
+
+    def get_default_stage(self):
+        return Stage("main", args = shlex.split(self.args or ''))
+
+    def get_args(self, stage = None, shard = None):
+        if stage is None:
+            stage = self.get_stages()[0]
+        return [os.path.basename(self.command)] + stage.args
 
 class SystemTask(AbstractTask):
     """
     This is internal task for mirror, so it will not fork.
 
     """
+    __slots__ = ()
+
     def __init__(self, name, scheduler_ref=None, **taskinfo):
         if "isinternal" not in taskinfo:
             taskinfo["isinternal"] = True
@@ -358,4 +645,4 @@ if __name__ == "__main__":
     task   = Task('ubuntu', None, **config['ubuntu'])
     print(time.ctime(task.get_schedule_time(time.time())))
     print(task.get_args())
-    print(task.get_args(stage=2))
+    print(task.get_args(task.get_stages()[-1]))
@@ -0,0 +1,252 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+"""
+Choose the upstream of a task among its `upstream[]` entries.
+
+An upstream is one of:
+
+    * host                  e.g. mirror.example.org, rsync daemon on 873
+    * host:port             e.g. mirror.example.org:8873
+    * rsync://host[:port]   optionally followed by a path prefix
+
+"""
+
+import time
+import errno
+import socket
+import logging
+import selectors
+import threading
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse     import urlsplit
+
+log = logging.getLogger(__name__)
+
+RSYNC_PORT   = 873
+RSYNC_SCHEME = "rsync://"
+
+# Exit codes of rsync (see "EXIT VALUES" in man rsync) caused by the
+# upstream or the connection to it, another upstream may do better:
+#   5  error starting client-server protocol
+#   10 error in socket I/O
+#   12 error in rsync protocol data stream
+#   30 timeout in data send/receive
+#   35 timeout waiting for daemon connection
+RETRY_CODES = (5, 10, 12, 30, 35)
+
+def parse_upstream(upstream):
+    """
+    :returns: (host, port) of `upstream`
+
+    """
+    if upstream.startswith(RSYNC_SCHEME):
+        url = urlsplit(upstream)
+        return (url.hostname, url.port or RSYNC_PORT)
+    host, sep, port = upstream.rpartition(':')
+    # "::1" is a host without port
+    if sep and port.isdigit() and (host.endswith(']') or ':' not in host):
+        return (host.strip("[]"), int(port))
+    return (upstream.strip("[]"), RSYNC_PORT)
+
+def rsync_source(upstream, path):
+    """
+    :returns: the source argument of rsync for `path` on `upstream`
+
+    """
+    if upstream.startswith(RSYNC_SCHEME):
+        return upstream.rstrip('/') + '/' + path
+    host, port = parse_upstream(upstream)
+    if port != RSYNC_PORT:
+        if ':' in host:
+            host = '[' + host + ']'
+        return RSYNC_SCHEME + host + ':' + str(port) + '/' + path
+    return upstream + '::' + path
+
+def probe(upstreams, timeout):
+    """
+    Connect to all `upstreams` at the same time, so it takes no more
+    than `timeout` seconds (besides resolving their names).
+
+    :returns: dict of upstream -> seconds taken to connect, or None if failed
+
+    """
+    results  = dict.fromkeys(upstreams)
+    selector = selectors.DefaultSelector()
+    start    = time.monotonic()
+    try:
+        for upstream in results:
+            try:
+                host, port = parse_upstream(upstream)
+                family, socktype, proto, _, address = socket.getaddrinfo(
+                                    host, port, 0, socket.SOCK_STREAM)[0]
+                sock = socket.socket(family, socktype, proto)
+            except (OSError, ValueError) as e:
+                log.info("Unable to probe upstream %s: %s", upstream, e)
+                continue
+            sock.setblocking(False)
+            error = sock.connect_ex(address)
+            if error not in (0, errno.EINPROGRESS):
+                log.info("Unable to connect upstream %s: %s",
+                         upstream, errno.errorcode.get(error, error))
+                sock.close()
+                continue
+            selector.register(sock, selectors.EVENT_WRITE, upstream)
+
+        while selector.get_map():
+            remaining = start + timeout - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, mask in selector.select(remaining):
+                sock = key.fileobj
+                selector.unregister(sock)
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error == 0:
+                    results[key.data] = time.monotonic() - start
+                else:
+                    log.info("Unable to connect upstream %s: %s",
+                             key.data, errno.errorcode.get(error, error))
+                sock.close()
+    finally:
+        for key in list(selector.get_map().values()):
+            log.info("Timed out when connecting upstream %s", key.data)
+            key.fileobj.close()
+        selector.close()
+    return results
+
+class UpstreamSelector(object):
+    """
+    Order upstreams of a task by the time taken to connect them, the
+    results are cached for `ttl` seconds, so an upstream is probed at
+    most once in that period, however many tasks use it.
+
+    Upstreams that are down are not dropped but moved to the end, as
+    the last resort when the others fail too.
+
+    Once started, upstreams are probed in a thread of the selector, so
+    rank() never waits for the network: it orders upstreams by cached
+    results, the stale ones are probed for the next time, and those
+    never probed are kept in their configured order, after the ones
+    known to be up. Without the thread, rank() probes stale upstreams
+    itself, which takes up to `timeout` seconds besides resolving names.
+
+    :param ttl: seconds to keep the result of a probe
+    :param timeout: seconds to wait for connecting, 0 means no probing,
+                    upstreams are used in the order they are configured
+
+    """
+    def __init__(self, ttl = 300, timeout = 3):
+        self.ttl        = ttl
+        self.timeout    = timeout
+        # upstream -> (expire time, seconds to connect or None if down)
+        self.scores     = {}
+        # upstreams waiting to be probed
+        self.pending    = set()
+        self.lock       = threading.Lock()
+        self.wakeup     = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread     = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target = self.run, name = "mirror.prober")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join()
+        self.thread = None
+
+    def run(self):
+        log.debug("Prober thread started")
+        while True:
+            self.wakeup.wait()
+            if self.stop_event.is_set():
+                break
+            self.wakeup.clear()
+            self.refresh()
+        log.debug("Prober thread finished")
+
+    def refresh(self, now = None):
+        """
+        Probe upstreams that are waiting to be probed.
+
+        """
+        with self.lock:
+            upstreams = list(self.pending)
+            self.pending.clear()
+        if not upstreams or self.timeout <= 0:
+            return
+        results = probe(upstreams, self.timeout)
+        now = time.monotonic() if now is None else now
+        for upstream, latency in results.items():
+            self.scores[upstream] = (now + self.ttl, latency)
+
+    def rank(self, upstreams, now = None):
+        """
+        :returns: list of `upstreams`, the best one first
+
+        """
+        if self.timeout <= 0 or len(set(upstreams)) <= 1:
+            return list(upstreams)
+        now   = time.monotonic() if now is None else now
+        stale = [upstream for upstream in upstreams
+                 if self.scores.get(upstream, (0, None))[0] <= now]
+        if stale:
+            with self.lock:
+                self.pending.update(stale)
+            if self.thread is not None:
+                self.wakeup.set()
+            else:
+                self.refresh(now)
+
+        def key(item):
+            index, upstream = item
+            score = self.scores.get(upstream)
+            if score is None:
+                return (1, 0, index)
+            latency = score[1]
+            return (2 if latency is None else 0, latency or 0, index)
+        return [upstream for index, upstream in sorted(enumerate(upstreams), key = key)]
+
+    def mark_failed(self, upstream, now = None):
+        """
+        Treat `upstream` as down until the result expires,
+        e.g. when a task failed to sync from it.
+
+        """
+        now = time.monotonic() if now is None else now
+        self.scores[upstream] = (now + self.ttl, None)
+
+    def get_latency(self, upstream):
+        """
+        :returns: seconds taken to connect `upstream` last time,
+                  or None if it is down or never probed
+
+        """
+        return self.scores.get(upstream, (0, None))[1]
@@ -0,0 +1,101 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+import os
+import json
+import tempfile
+import unittest
+
+from mirror.admission import LinearPolicy, AIMDPolicy
+
+class AdmissionTestCase(unittest.TestCase):
+
+    def test_linear(self):
+        policy = LinearPolicy(loadlimit = 2.0, httpconn = 100, maxtasks = 2)
+        policy.update({ "load": 1.0, "conn": 10 }, 0)
+        self.assertTrue(policy.admit("a", 10, 0).admitted)
+        # 14.55 - 4.55 * 1.5 = 7.725
+        policy.update({ "load": 3.0, "conn": 10 }, 0)
+        self.assertTrue(policy.admit("a", 7, 0).admitted)
+        self.assertFalse(policy.admit("a", 8, 0).admitted)
+        policy.update({ "load": 1.0, "conn": 10 }, 2)
+        self.assertFalse(policy.admit("a", 3, 2).admitted)
+        self.assertTrue(policy.admit("a", 2, 2).admitted)
+        self.assertEqual(len(policy.decisions), 5)
+
+    def test_aimd(self):
+        logfile = tempfile.mktemp()
+        policy  = AIMDPolicy(loadlimit = 2.0, httpconn = 0, maxtasks = 4,
+                             logfile = logfile, interval = 60)
+        # it starts at maxtasks
+        policy.update({ "load": 0.5, "conn": 0 }, 0, now = 0)
+        self.assertEqual(policy.limit, 4)
+        self.assertTrue(policy.admit("a", 5, 3, now = 0).admitted)
+        # halved when overloaded, once every interval
+        policy.update({ "load": 3.0, "conn": 0 }, 4, now = 60)
+        self.assertEqual(policy.limit, 2)
+        policy.update({ "load": 3.0, "conn": 0 }, 4, now = 90)
+        self.assertEqual(policy.limit, 2)
+        policy.update({ "load": 3.0, "conn": 0 }, 4, now = 120)
+        self.assertEqual(policy.limit, 1)
+        self.assertFalse(policy.admit("b", 5, 1, now = 120).admitted)
+        self.assertTrue(policy.admit("c", 2, 1, now = 120).admitted)
+        # grows only when the limit is used up
+        policy.update({ "load": 0.5, "conn": 0 }, 0, now = 180)
+        self.assertEqual(policy.limit, 1)
+        for now in (240, 300, 360, 420):
+            policy.update({ "load": 0.5, "conn": 0 }, int(policy.limit), now = now)
+        self.assertEqual(policy.limit, 4)
+        policy.update({ "load": 3.0, "conn": 0 }, 4, now = 480)
+        self.assertEqual(policy.limit, 2)
+        self.assertFalse(policy.admit("d", 5, 2, now = 480).admitted)
+
+        # an overloaded system is limited at once after a start
+        overloaded = AIMDPolicy(loadlimit = 2.0, httpconn = 0, maxtasks = 4)
+        overloaded.update({ "load": 3.0, "conn": 0 }, 0, now = 0)
+        self.assertEqual(overloaded.limit, 2)
+
+        with open(logfile) as fp:
+            decisions = [json.loads(line) for line in fp]
+        os.unlink(logfile)
+        self.assertEqual([decision["admitted"] for decision in decisions if decision["taskname"]],
+                         [True, False, True, False])
+        self.assertEqual(decisions[-1]["state"]["limit"], 2)
+
+    def test_signals(self):
+        limits = { "io": 20.0, "disk": 80.0, "net": 0 }
+        linear = LinearPolicy(loadlimit = 0, httpconn = 0, maxtasks = 0, limits = limits)
+        linear.update({ "load": 9.0, "conn": 0, "io": 30.0 }, 0)
+        # 14.55 - 4.55 * 1.5 = 7.725
+        self.assertTrue(linear.admit("a", 7, 0).admitted)
+        decision = linear.admit("b", 8, 0)
+        self.assertEqual((decision.admitted, decision.reason), (False, "io 30.00 is too high"))
+        linear.update({ "load": 0, "conn": 0, "io": 0.0 }, 0)
+        self.assertFalse(linear.admit("c", 10, 0, { "disk": 95.0 }).admitted)
+        self.assertEqual(linear.decisions[-1].state["disk"], 95.0)
+
+        aimd = AIMDPolicy(loadlimit = 0, httpconn = 0, maxtasks = 4, limits = limits)
+        aimd.update({ "load": 0, "conn": 0, "io": 25.0 }, 0, now = 0)
+        self.assertEqual(aimd.get_pressure(), 1.25)
+        self.assertTrue(aimd.admit("a", 5, 0, { "disk": 10.0 }).admitted)
+        self.assertFalse(aimd.admit("b", 5, 0, { "disk": 90.0 }).admitted)
+
+if __name__ == '__main__':
+    unittest.main()
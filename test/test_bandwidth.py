@@ -0,0 +1,76 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+import time
+import unittest
+
+from mirror.task      import Task
+from mirror.pipeline  import Pipeline
+from mirror.bandwidth import BandwidthManager, parse_profile
+
+def at_hour(hour):
+    return time.mktime((2020, 1, 1, hour, 30, 0, 0, 0, -1))
+
+class BandwidthTestCase(unittest.TestCase):
+
+    def test_profile(self):
+        profile = parse_profile("0-7=200M 22-6=1K")
+        self.assertEqual(profile, [(0, 7, 200 << 20), (22, 6, 1024)])
+        self.assertRaises(ValueError, parse_profile, "0-7")
+        self.assertRaises(ValueError, parse_profile, "0-25=1M")
+
+        manager = BandwidthManager(100, parse_profile("1-7=200 22-2=50"))
+        self.assertEqual([manager.get_budget(at_hour(hour)) for hour in (0, 3, 7, 12, 23)],
+                         [50, 200, 100, 100, 50])
+
+    def test_allocate(self):
+        manager = BandwidthManager(1100)
+        self.assertFalse(manager.is_changed())
+        self.assertEqual(manager.allocate([("a", 1), ("b", 10)]), { "a": 1000, "b": 100 })
+        self.assertEqual(manager.allocate([("b", 10)]), { "b": 1100 })
+        manager.budget = 0
+        self.assertTrue(manager.is_changed())
+        self.assertEqual(manager.allocate([("a", 1)]), { "a": 0 })
+
+    def test_bwlimit(self):
+        config = {
+                 'upstream[]': 'mirror.bjtu.edu.cn',
+                 'command': 'rsync',
+                 'time':  '* */2 * * *',
+                 'rsyncdir': 'debian/',
+                 'localdir': '/tmp/mirror/debian',
+                 'args': '--recursive --bwlimit=100000',
+                 'timeout': '2h',
+                 'priority': '2',
+                 'shards': '4',
+                 'shardjobs': '2',
+                 }
+        task = Task('debian', None, **config)
+        stage = task.get_stages()[0]
+        self.assertEqual(task.get_exec_args(stage, 0), task.get_args(stage, 0))
+        task.bwlimit  = 4 << 20
+        task.pipeline = Pipeline(task.name, task.get_stages(), task.maxjobs)
+        # shared by 2 processes, in KiB
+        self.assertEqual(task.get_exec_args(stage, 0)[-3:],
+                         ['--bwlimit=2048', 'mirror.bjtu.edu.cn::debian/',
+                          '/tmp/mirror/debian'])
+
+if __name__ == '__main__':
+    unittest.main()
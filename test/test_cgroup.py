@@ -0,0 +1,107 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mirror.task   import Task, LAUNCHER_FORK, LAUNCHER_SPAWN
+from mirror.cgroup import Cgroups, parse_size, parse_iomax, priority_weight, priority_nice
+
+def read(path):
+    with open(path) as fp:
+        return fp.read()
+
+def write(path, content):
+    with open(path, "w") as fp:
+        fp.write(content)
+
+class CgroupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # stands in for a delegated directory of cgroup2 fs
+        self.root = tempfile.mkdtemp()
+        write(os.path.join(self.root, "cgroup.controllers"), "cpuset cpu io memory pids\n")
+        self.task = Task('debian', None, **{
+                        'upstream[]': 'mirror.bjtu.edu.cn',
+                        'command': 'rsync',
+                        'time':  '* */2 * * *',
+                        'rsyncdir': 'debian/',
+                        'localdir': self.root,
+                        'timeout': '2h',
+                        'priority': '10',
+                        'iomax': '8:0 wbps=50M riops=1000',
+                        'memoryhigh': '2G',
+                        })
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_parse(self):
+        self.assertEqual([priority_weight(p) for p in (1, 5, 10)], [100, 60, 10])
+        self.assertEqual([priority_nice(p) for p in (1, 5, 10)], [0, 8, 19])
+        self.assertEqual(parse_size("512M"), str(512 << 20))
+        self.assertEqual(parse_size("max"), "max")
+        self.assertEqual(parse_iomax("8:16 rbps=1k wiops=max", self.root),
+                         "8:16 rbps=1024 wiops=max")
+        self.assertRaises(ValueError, parse_iomax, "8:16 rbps", self.root)
+
+    def test_cgroup(self):
+        cgroups = Cgroups(self.root + "/")
+        cgroups.start(self.task)
+        self.assertEqual(read(os.path.join(self.root, "cgroup.subtree_control")),
+                         "+cpu +io +memory")
+        path = cgroups.get_path("debian")
+        self.assertEqual(read(os.path.join(path, "cpu.weight")), "10")
+        self.assertEqual(read(os.path.join(path, "io.weight")), "default 10")
+        self.assertEqual(read(os.path.join(path, "io.max")), "8:0 wbps=52428800 riops=1000")
+        self.assertEqual(read(os.path.join(path, "memory.high")), str(2 << 30))
+
+        cgroups.attach(self.task, 4242)
+        self.assertEqual(read(os.path.join(path, "cgroup.procs")), "4242")
+
+        write(os.path.join(path, "cpu.stat"), "usage_usec 2500000\nuser_usec 2000000\n")
+        write(os.path.join(path, "io.stat"), "8:0 rbytes=100 wbytes=200 rios=1 wios=2\n"
+                                             "8:16 rbytes=10 wbytes=20 rios=1 wios=2\n")
+        self.assertEqual(cgroups.finish(self.task), { "cpu": 2.5, "read": 110, "write": 220 })
+        self.assertIsNone(cgroups.finish(self.task))
+
+    def test_unusable(self):
+        cgroups = Cgroups(os.path.join(self.root, "missing"))
+        cgroups.start(self.task)
+        self.assertFalse(cgroups.is_usable())
+        self.assertIsNone(cgroups.get_path("debian"))
+        self.assertIsNone(cgroups.finish(self.task))
+
+    def test_launcher(self):
+        class Scheduler(object):
+            launcher = LAUNCHER_SPAWN
+            cgroups  = None
+        scheduler = Scheduler()
+        self.task.scheduler = scheduler
+        if hasattr(os, "posix_spawn"):
+            self.assertEqual(self.task.get_launcher(), LAUNCHER_SPAWN)
+        # a forked child is attached before execv(), see Task.get_launcher()
+        scheduler.cgroups = Cgroups(self.root)
+        self.assertEqual(self.task.get_launcher(), LAUNCHER_FORK)
+
+if __name__ == '__main__':
+    unittest.main()
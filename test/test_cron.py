@@ -0,0 +1,71 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+import unittest
+import time
+
+from mirror.cron import CronSchedule
+
+def ctime(cron, since):
+    return time.ctime(cron.next_after(time.mktime(since + (0, 0, -1))))
+
+class CronScheduleTestCase(unittest.TestCase):
+
+    def test_next_after(self):
+        cron = CronSchedule.parse("* */2 * * *")
+        self.assertEqual(ctime(cron, (2013, 7, 20, 8, 0, 0)),  'Sat Jul 20 10:00:00 2013')
+        self.assertEqual(ctime(cron, (2013, 7, 20, 9, 30, 0)), 'Sat Jul 20 10:00:00 2013')
+        self.assertEqual(ctime(cron, (2013, 7, 20, 23, 0, 0)), 'Sun Jul 21 00:00:00 2013')
+
+        cron = CronSchedule.parse("*/20 * * * *")
+        self.assertEqual(ctime(cron, (2013, 7, 20, 8, 0, 0)),  'Sat Jul 20 08:20:00 2013')
+        self.assertEqual(ctime(cron, (2013, 7, 20, 8, 59, 0)), 'Sat Jul 20 09:00:00 2013')
+
+        cron = CronSchedule.parse("30 1 31 * *")
+        self.assertEqual(ctime(cron, (2013, 12, 31, 2, 0, 0)), 'Fri Jan 31 01:30:00 2014')
+        self.assertEqual(ctime(cron, (2014, 2, 1, 0, 0, 0)),   'Mon Mar 31 01:30:00 2014')
+
+        # 6 is Saturday
+        cron = CronSchedule.parse("0 3 * * 6")
+        self.assertEqual(ctime(cron, (2013, 7, 20, 3, 0, 0)),  'Sat Jul 27 03:00:00 2013')
+
+        self.assertEqual(CronSchedule.parse("0 3 30 2 *").next_after(time.time()), None)
+        self.assertEqual(CronSchedule.parse("not a cron time"), None)
+
+    def test_cache(self):
+        cron  = CronSchedule.parse("10 0,12 * * *")
+        since = time.mktime((2013, 7, 20, 8, 0, 0, 0, 0, -1))
+        first = cron.next_after(since)
+        self.assertEqual(cron.next_after(since + 59), first)
+        self.assertEqual(cron.next_after(first - 1), first)
+        self.assertEqual(cron.next_after(first), first + 12 * 3600)
+
+    def test_iter_after(self):
+        cron  = CronSchedule.parse("0 */6 * * *")
+        since = time.mktime((2013, 7, 20, 8, 0, 0, 0, 0, -1))
+        times = []
+        for next_time in cron.iter_after(since):
+            times.append(time.localtime(next_time).tm_hour)
+            if len(times) == 5:
+                break
+        self.assertEqual(times, [12, 18, 0, 6, 12])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+import os
+import time
+import signal
+import unittest
+
+from mirror.eventloop import EventLoop
+
+class EventLoopTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = EventLoop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_timeout(self):
+        start = time.time()
+        self.assertEqual(self.loop.wait(0.05), 0)
+        self.assertTrue(time.time() - start >= 0.04)
+
+    def test_child_exited(self):
+        pid = os.fork()
+        if pid == 0:
+            time.sleep(0.1)
+            os._exit(3)
+        exited = []
+        self.loop.watch_pid(pid, lambda: exited.append(os.waitpid(pid, 0)))
+        start = time.time()
+        while not exited and time.time() - start < 5:
+            self.loop.wait(5)
+        self.assertEqual(exited, [(pid, 3 << 8)])
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(self.loop.pidfds, {})
+
+    def test_signal_before_wait(self):
+        handler = signal.signal(signal.SIGUSR1, lambda signo, frame: None)
+        try:
+            os.kill(os.getpid(), signal.SIGUSR1)
+            start = time.time()
+            self.assertEqual(self.loop.wait(5), 1)
+            self.assertTrue(time.time() - start < 5)
+        finally:
+            signal.signal(signal.SIGUSR1, handler)
+
+if __name__ == '__main__':
+    unittest.main()
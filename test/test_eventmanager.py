@@ -0,0 +1,124 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+
+import time
+import threading
+import unittest
+
+import mirror.component as component
+from mirror.eventmanager import EventManager
+from mirror.event        import TaskEnqueueEvent, QueueChangedEvent, TaskStartEvent
+
+class EventManagerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.event_manager = EventManager()
+
+    def tearDown(self):
+        component.deregister(self.event_manager)
+
+    def test_drain_and_stop(self):
+        handled = []
+        self.event_manager.register_event_handler("TaskEnqueueEvent",
+            lambda taskname: (time.sleep(0.001), handled.append(taskname)))
+        for i in range(100):
+            self.event_manager.emit(TaskEnqueueEvent(i))
+        self.assertTrue(self.event_manager.drain(5))
+        self.assertEqual(handled, list(range(100)))
+
+        metrics = self.event_manager.get_metrics()
+        self.assertEqual(metrics["depth"], 0)
+        self.assertEqual(metrics["processed"], 100)
+
+        # events emitted before stop() are still handled
+        self.event_manager.emit(TaskEnqueueEvent(100))
+        plugin_thread = self.event_manager.plugin_thread
+        self.event_manager.stop()
+        self.assertFalse(plugin_thread.is_alive())
+        self.assertEqual(handled[-1], 100)
+
+    def test_batched_and_per_task(self):
+        batches = []
+        tasks   = []
+        self.event_manager.register_event_handler("QueueChangedEvent", batches.append)
+        self.event_manager.register_event_handler("TaskEnqueueEvent", tasks.append)
+        self.event_manager.emit(QueueChangedEvent(["archlinux", "ubuntu"]))
+        self.assertTrue(self.event_manager.drain(5))
+        self.assertEqual(batches, [["archlinux", "ubuntu"]])
+        self.assertEqual(tasks, ["archlinux", "ubuntu"])
+
+    def test_overflow(self):
+        release = threading.Event()
+        slow    = []
+        fast    = []
+        self.event_manager.register_event_handler("TaskEnqueueEvent",
+            lambda taskname: (release.wait(10), slow.append(taskname)), executor = "slow")
+        self.event_manager.register_event_handler("TaskEnqueueEvent",
+            fast.append, executor = "fast")
+        self.event_manager.set_executor("slow", queuesize = 2)
+
+        # drop-oldest by default, a full queue of one plugin
+        # does not hold back the others
+        for i in range(10):
+            self.event_manager.emit(TaskEnqueueEvent(i))
+        deadline = time.monotonic() + 5
+        while len(fast) < 10 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(fast, list(range(10)))
+        release.set()
+        self.assertTrue(self.event_manager.drain(5))
+        metrics = self.event_manager.get_metrics()["executors"]["slow"]
+        self.assertEqual(len(slow) + metrics["dropped"], 10)
+        self.assertEqual(slow[-2:], [8, 9])
+
+        # coalesce ignores calls which are queued already
+        self.event_manager.set_executor("slow", queuesize = 0, overflow = "coalesce")
+        release.clear()
+        del slow[:]
+        for i in (0, 1, 1, 0, 2):
+            self.event_manager.emit(TaskEnqueueEvent(i))
+        release.set()
+        self.assertTrue(self.event_manager.drain(5))
+        self.assertEqual(slow[0], 0)
+        self.assertEqual(sorted(set(slow)), [0, 1, 2])
+        self.assertLess(len(slow), 5)
+
+    def test_block(self):
+        release = threading.Event()
+        handled = []
+        self.event_manager.register_event_handler("TaskStartEvent",
+            lambda taskname, pid: (release.wait(10), handled.append(pid)), executor = "slow")
+        self.event_manager.set_executor("slow", queuesize = 2, overflow = "block")
+
+        # emit() waits for room, nothing is dropped
+        emitter = threading.Thread(target = lambda: [
+                      self.event_manager.emit(TaskStartEvent("slow", i)) for i in range(10)])
+        emitter.start()
+        time.sleep(0.1)
+        self.assertTrue(emitter.is_alive())
+        release.set()
+        emitter.join(5)
+        self.assertFalse(emitter.is_alive())
+        self.assertTrue(self.event_manager.drain(5))
+        self.assertEqual(handled, list(range(10)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#
+# Copyright (C) 2014 Shang Yuanchun <idealities@gmail.com>
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+import os
+import shutil
+import tempfile
+import unittest
+import weakref
+
+from mirror.task import SimpleTask, LAUNCHER_SPAWN
+
+class FakeScheduler(object):
+    def __init__(self, logdir):
+        self.logdir   = logdir
+        self.launcher = LAUNCHER_SPAWN
+
+@unittest.skipUnless(hasattr(os, "posix_spawn"), "posix_spawn is not available")
+class SpawnTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.logdir    = tempfile.mkdtemp() + os.path.sep
+        self.scheduler = FakeScheduler(self.logdir)
+        self.task      = SimpleTask("spawned", weakref.ref(self.scheduler),
+                                    command = "sh", time = "* * * * *",
+                                    args = "-c 'echo out; echo err >&2'",
+                                    timeout = "0", priority = "1")
+
+    def tearDown(self):
+        shutil.rmtree(self.logdir)
+
+    def test_spawn(self):
+        self.assertEqual(self.task.get_launcher(), LAUNCHER_SPAWN)
+        self.task.run()
+        pid = self.task.pid
+        self.assertTrue(self.task.running)
+        self.assertGreater(pid, 0)
+        self.assertEqual(self.task.get_pids(), [ pid ])
+
+        self.assertEqual(os.waitpid(pid, 0), (pid, 0))
+        self.assertTrue(self.task.child_exited(pid, 0))
+        self.task.set_stop_flag()
+        self.assertEqual(self.task.code, 0)
+        # both stdout and stderr go to the log of the task
+        with open(self.task.get_logfile()) as fp:
+            self.assertEqual(fp.read(), "out\nerr\n")
+
+    def test_error(self):
+        self.task.command = os.path.join(self.logdir, "missing")
+        # raised in mirrord, not in a child
+        self.assertRaises(FileNotFoundError, self.task.execute_spawn,
+                          self.task.get_stages()[0])
+        self.assertFalse(self.task.running)
+
+        self.task.run()
+        self.assertFalse(self.task.running)
+        self.assertEqual(self.task.pid, 0)
+        self.assertIsNone(self.task.pipeline)
+        self.assertEqual(self.task.code, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+import unittest
+
+from mirror.pipeline import Pipeline, parse_stages
+
+class PipelineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        taskinfo = {
+                   'stages': 'pool dists indices final',
+                   'pool.shards': '3',
+                   'indices.after': 'pool',
+                   'final.after': 'dists indices',
+                   }
+        self.stages = parse_stages(taskinfo, "--recursive", None)
+
+    def test_parse(self):
+        self.assertEqual([stage.after for stage in self.stages],
+                         [(), (0, ), (0, ), (1, 2)])
+        self.assertEqual(len(self.stages[0].shards), 3)
+        self.assertIsNone(parse_stages({}, "", None))
+        self.assertRaises(ValueError, parse_stages,
+                          {'stages': 'a b', 'a.after': 'b'}, "", None)
+        self.assertRaises(ValueError, parse_stages,
+                          {'stages': 'a b', 'b.after': 'c'}, "", None)
+
+    def test_width(self):
+        self.assertEqual(Pipeline("debian", self.stages, 2).get_width(), 2)
+        chain = parse_stages({ 'stages': 'a b' }, "", None)
+        self.assertEqual(Pipeline("debian", chain, 4).get_width(), 1)
+        chain = parse_stages({ 'stages': 'a b', 'b.shards': '3' }, "", None)
+        self.assertEqual(Pipeline("debian", chain, 4).get_width(), 3)
+
+    def test_run(self):
+        pipeline = Pipeline("debian", self.stages, 2)
+        jobs = pipeline.ready()
+        self.assertEqual(jobs, [(0, 0), (0, 1)])
+        for pid, job in enumerate(jobs):
+            pipeline.add(pid, job)
+        self.assertFalse(pipeline.exited(0, 0))
+        pipeline.add(2, pipeline.ready()[0])
+        self.assertFalse(pipeline.exited(1, 0))
+        self.assertEqual(pipeline.ready(), [])
+        self.assertFalse(pipeline.exited(2, 0))
+        # dists and indices run at the same time
+        jobs = pipeline.ready()
+        self.assertEqual(jobs, [(1, None), (2, None)])
+        pipeline.add(3, jobs[0])
+        pipeline.add(4, jobs[1])
+        self.assertFalse(pipeline.exited(3, 0))
+        self.assertFalse(pipeline.exited(4, 0))
+        pipeline.add(5, pipeline.ready()[0])
+        self.assertTrue(pipeline.exited(5, 0))
+        self.assertEqual(pipeline.code, 0)
+
+    def test_failed(self):
+        pipeline = Pipeline("debian", self.stages, 4)
+        for pid, job in enumerate(pipeline.ready()):
+            pipeline.add(pid, job)
+        self.assertFalse(pipeline.exited(0, 0))
+        self.assertFalse(pipeline.exited(1, 23))
+        self.assertEqual(pipeline.ready(), [])
+        # the final stage never runs
+        self.assertTrue(pipeline.exited(2, 0))
+        self.assertEqual(pipeline.code, 23)
+
+if __name__ == '__main__':
+    unittest.main()
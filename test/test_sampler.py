@@ -0,0 +1,114 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+import time
+import unittest
+import itertools
+
+import mirror.component as component
+from mirror.sampler import Metric, SysInfoSampler
+
+def feeder(values):
+    values = iter(values)
+    return lambda: next(values)
+
+def wait_for(condition, timeout = 5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+class SamplerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = SysInfoSampler(interval = 0, size = 5, alpha = 0.5)
+
+    def tearDown(self):
+        self.sampler.stop()
+        component.deregister(self.sampler)
+
+    def test_metric(self):
+        metric = Metric(feeder([1, 2, 3, 4, 5, 6, 7]), size = 5, alpha = 0.5)
+        self.assertEqual(metric.percentile(50), 0.0)
+        ewma = None
+        for value in range(1, 8):
+            metric.sample()
+            ewma = value if ewma is None else 0.5 * value + 0.5 * ewma
+            self.assertEqual(metric.last, value)
+            self.assertAlmostEqual(metric.ewma, ewma)
+        # only the last `size` samples are kept
+        self.assertEqual(list(metric.samples), [3, 4, 5, 6, 7])
+        self.assertEqual(metric.percentile(0), 3)
+        self.assertEqual(metric.percentile(50), 5)
+        self.assertEqual(metric.percentile(90), 7)
+        self.assertEqual(metric.percentile(100), 7)
+
+    def test_without_thread(self):
+        self.sampler.add_metric("load", feeder([4.0, 2.0, 0.0]))
+        self.sampler.add_metric("broken", feeder([]))
+        # sampled once at start, so values are ready at once
+        self.sampler.start()
+        self.assertIsNone(self.sampler.thread)
+        self.assertEqual(self.sampler.ticks, 1)
+        self.assertEqual(self.sampler.last("load"), 4.0)
+        self.sampler.sample_now()
+        self.sampler.sample_now()
+        self.assertEqual(self.sampler.ticks, 3)
+        self.assertEqual(self.sampler.last("load"), 0.0)
+        self.assertAlmostEqual(self.sampler.ewma("load"), 1.5)
+        self.assertEqual(self.sampler.percentile("load", 100), 4.0)
+        # errors of a metric do not stop the others
+        self.assertEqual(self.sampler.last("broken"), 0.0)
+
+    def test_thread(self):
+        counter = itertools.count()
+        self.sampler.add_metric("count", lambda: float(next(counter)))
+        self.sampler.set_interval(0.01)
+        self.sampler.start()
+        thread = self.sampler.thread
+        self.assertTrue(thread.is_alive())
+        self.assertTrue(wait_for(lambda: self.sampler.ticks >= 3))
+        # sample_now() does nothing while the thread samples
+        ticks = self.sampler.ticks
+        self.sampler.sample_now()
+        self.assertLessEqual(self.sampler.ticks, ticks + 1)
+
+        # the thread is restarted with the new interval
+        self.sampler.set_interval(0.02)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(self.sampler.thread.is_alive())
+        self.assertEqual(self.sampler.interval, 0.02)
+        ticks = self.sampler.ticks
+        self.assertTrue(wait_for(lambda: self.sampler.ticks > ticks))
+
+        thread = self.sampler.thread
+        self.sampler.stop()
+        self.assertIsNone(self.sampler.thread)
+        self.assertFalse(thread.is_alive())
+        ticks = self.sampler.ticks
+        time.sleep(0.05)
+        self.assertEqual(self.sampler.ticks, ticks)
+
+        # no thread with interval 0
+        self.sampler.set_interval(0)
+        self.sampler.start()
+        self.assertIsNone(self.sampler.thread)
+
+if __name__ == '__main__':
+    unittest.main()
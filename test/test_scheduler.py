@@ -0,0 +1,278 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+import os
+import time
+import signal
+import shutil
+import tempfile
+import unittest
+
+import mirror.handler
+import mirror.component     as component
+import mirror.configmanager as configmanager
+from mirror.eventmanager import EventManager
+from mirror.scheduler    import Scheduler
+from mirror.queue        import TaskInfo
+from mirror.task         import REGULAR_TASK
+
+GENERAL = """
+[general]
+emails       = root@localhost
+logdir       = %s
+loadlimit    = 0
+httpconn     = 0
+maxtasks     = 10
+probetimeout = 0
+"""
+
+SLEEP = """
+[sleep]
+type     = simple
+command  = sleep
+time     = 0 0 1 1 *
+args     = 30
+timeout  = 1h
+priority = 4
+"""
+
+OTHER = SLEEP.replace("[sleep]", "[other]")
+
+# tasks which ignore SIGTERM
+STUBBORN = """
+[%s]
+type     = simple
+command  = sh
+time     = 0 0 1 1 *
+args     = -c 'trap "" TERM; exec sleep 30'
+priority = 4
+"""
+
+def wait_for(condition, timeout = 5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+def read_comm(pid):
+    with open("/proc/%d/comm" % pid) as fp:
+        return fp.read().strip()
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.write_config(SLEEP)
+        configmanager.set_config_dir(self.directory)
+        self.event_manager = EventManager()
+        self.scheduler     = Scheduler()
+
+    def tearDown(self):
+        for task in self.scheduler.tasks.values():
+            task.stop()
+        component.deregister(self.scheduler)
+        component.deregister(self.scheduler.sampler)
+        self.event_manager.stop()
+        component.deregister(self.event_manager)
+        configmanager.close("mirror.ini")
+        shutil.rmtree(self.directory)
+
+    def write_config(self, sections):
+        with open(os.path.join(self.directory, "mirror.ini"), "w") as f:
+            f.write(GENERAL % self.directory + sections)
+
+    def reap(self, pids):
+        for pid in pids:
+            self.scheduler.child_exited(*os.waitpid(pid, 0))
+        self.scheduler.process_exited_children()
+
+    def test_reload_removes_running_task(self):
+        task = self.scheduler.tasks["sleep"]
+        self.scheduler.run_task(TaskInfo("sleep", REGULAR_TASK, 0, task.priority))
+        self.assertTrue(task.running)
+        self.assertEqual(self.scheduler.semaphores.running, 1)
+
+        pids = task.get_pids()
+        self.write_config("")
+        self.scheduler.reload_config()
+        self.assertNotIn("sleep", self.scheduler.tasks)
+        self.reap(pids)
+        self.assertFalse(task.running)
+        self.assertEqual(self.scheduler.semaphores.running, 0)
+        self.assertEqual(self.scheduler.count_running_tasks(), 0)
+
+    def test_reload_adopts_running_task(self):
+        task = self.scheduler.tasks["sleep"]
+        self.scheduler.run_task(TaskInfo("sleep", REGULAR_TASK, 0, task.priority))
+        task.bwlimit = 1024
+
+        pids = task.get_pids()
+        self.write_config(SLEEP.replace("priority = 4", "priority = 3"))
+        self.scheduler.reload_config()
+        adopted = self.scheduler.tasks["sleep"]
+        self.assertIsNot(adopted, task)
+        self.assertTrue(adopted.running)
+        self.assertEqual(adopted.get_pids(), pids)
+        self.assertEqual(adopted.bwlimit, 1024)
+        self.assertEqual(self.scheduler.semaphores.running, 1)
+        adopted.stop()
+        self.reap(pids)
+        self.assertFalse(adopted.running)
+        self.assertEqual(self.scheduler.semaphores.running, 0)
+
+    def test_reload_in_main_loop(self):
+        self.write_config("")
+        mirror.handler.reload_handler(signal.SIGHUP, None)
+        # nothing is changed in the signal handler
+        self.assertIn("sleep", self.scheduler.tasks)
+        self.assertTrue(self.scheduler.reload_requested)
+        self.scheduler.process_reload()
+        self.assertNotIn("sleep", self.scheduler.tasks)
+        self.assertFalse(self.scheduler.reload_requested)
+
+    def test_append_changed_tasks(self):
+        self.write_config(SLEEP + OTHER)
+        self.scheduler.reload_config()
+        self.scheduler.append_tasks()
+        self.assertEqual(sorted(self.scheduler.enqueued_tasks), ["other", "sleep"])
+        other = self.scheduler.queue.find("other")
+        self.scheduler.queue.changed.clear()
+        self.scheduler.enqueued_tasks.clear()
+
+        taskinfo = self.scheduler.queue.find("sleep")
+        self.scheduler.queue.remove(taskinfo)
+        self.scheduler.run_task(taskinfo)
+        task = self.scheduler.tasks["sleep"]
+        pids = task.get_pids()
+        task.stop()
+        self.reap(pids)
+        self.assertEqual(self.scheduler.changed_tasks, set(["sleep"]))
+        self.scheduler.queue.changed.clear()
+
+        # only the finished task is appended again, the other is untouched
+        self.scheduler.append_tasks()
+        self.assertEqual(self.scheduler.changed_tasks, set())
+        self.assertEqual(list(self.scheduler.enqueued_tasks), ["sleep"])
+        self.assertEqual(self.scheduler.queue.changed, set(["sleep"]))
+        self.assertIs(self.scheduler.queue.find("other"), other)
+        self.assertEqual(len(self.scheduler.queue), 2)
+
+    def run_tasks(self, *names):
+        for name in names:
+            task = self.scheduler.tasks[name]
+            self.scheduler.run_task(TaskInfo(name, REGULAR_TASK, 0, task.priority))
+            self.assertTrue(task.running)
+
+    def limit_load(self, load):
+        """
+        Make admission depend on `load`, sampled by a sampler thread
+        which takes no sample by itself during the test.
+
+        """
+        sampler = self.scheduler.sampler
+        sampler.metrics["load"].reader = lambda: load[0]
+        sampler.metrics["load"].alpha  = 1.0
+        sampler.set_interval(3600)
+        sampler.start()
+        self.scheduler.loadlimit = 1.0
+        self.scheduler.init_admission()
+        self.scheduler.init_sysinfo()
+        self.scheduler.admission.update(self.scheduler.current_signals, 0)
+
+    def test_deferred_retried_when_task_finished(self):
+        self.write_config(SLEEP + OTHER)
+        self.scheduler.reload_config()
+        self.limit_load([0.0])
+        self.scheduler.maxtasks = 1
+        self.scheduler.init_admission()
+
+        self.run_tasks("sleep")
+        self.scheduler.schedule_task(TaskInfo("other", REGULAR_TASK, int(time.time()), 4))
+        other = self.scheduler.tasks["other"]
+        self.assertFalse(other.running)
+        self.assertIn("other", self.scheduler.deferred)
+        # not retried before its backoff is over
+        self.scheduler.schedule()
+        self.assertFalse(other.running)
+
+        sleep = self.scheduler.tasks["sleep"]
+        pids  = sleep.get_pids()
+        sleep.stop()
+        self.reap(pids)
+        self.assertTrue(self.scheduler.capacity_freed)
+        self.scheduler.schedule()
+        self.assertTrue(other.running)
+        self.assertNotIn("other", self.scheduler.deferred)
+
+    def test_deferred_retried_when_sampled(self):
+        load = [10.0]
+        self.limit_load(load)
+        sleep = self.scheduler.tasks["sleep"]
+        self.scheduler.schedule_task(TaskInfo("sleep", REGULAR_TASK, int(time.time()), 4))
+        self.assertIn("sleep", self.scheduler.deferred)
+        self.assertGreater(self.scheduler.deferred.find("sleep").retry, time.time() + 30)
+
+        load[0] = 0.0
+        self.scheduler.schedule()
+        self.assertFalse(sleep.running)
+        # a tick of the sampler
+        self.scheduler.sampler.sample()
+        self.scheduler.schedule()
+        self.assertTrue(sleep.running)
+        self.assertNotIn("sleep", self.scheduler.deferred)
+
+    def test_backoff(self):
+        self.limit_load([10.0])
+        self.scheduler.delayjitter = 0
+        taskinfo = TaskInfo("sleep", REGULAR_TASK, int(time.time()), 4)
+        backoffs = []
+        for i in range(7):
+            self.scheduler.defer_task(taskinfo)
+            deferred = self.scheduler.deferred.find("sleep")
+            backoffs.append(int(round(deferred.retry - time.time())))
+        self.assertEqual(backoffs, [60, 120, 240, 480, 960, 1800, 1800])
+        self.assertEqual(deferred.attempts, 6)
+
+    def test_stop_all_tasks(self):
+        self.write_config(STUBBORN % "first" + STUBBORN % "second")
+        self.scheduler.reload_config()
+        self.run_tasks("first", "second")
+        tasks = [self.scheduler.tasks[name] for name in ("first", "second")]
+        pids  = [pid for task in tasks for pid in task.get_pids()]
+        # SIGTERM is ignored once sh execs sleep
+        for pid in pids:
+            self.assertTrue(wait_for(lambda: read_comm(pid) == "sleep"))
+
+        self.scheduler.stopgrace = 0.5
+        start = time.monotonic()
+        self.scheduler.stop_all_tasks()
+        elapsed = time.monotonic() - start
+        # both are waited together, then killed
+        self.assertGreaterEqual(elapsed, 0.5)
+        self.assertLess(elapsed, 2)
+        for task in tasks:
+            self.assertFalse(task.running)
+            self.assertEqual(task.code, signal.SIGKILL)
+        for pid in pids:
+            self.assertRaises(ChildProcessError, os.waitpid, pid, os.WNOHANG)
+        self.assertEqual(self.scheduler.pids, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+import os
+import unittest
+
+from mirror.semaphore import KeyedSemaphores, parse_grouplimits
+from mirror.semaphore import host_key, device_key, group_keys
+
+class SemaphoreTestCase(unittest.TestCase):
+
+    def test_keys(self):
+        self.assertEqual(host_key("mirror.aarnet.edu.au"), "host:mirror.aarnet.edu.au")
+        self.assertEqual(host_key("rsync://Mirror.Example.org:8873/pub"),
+                         "host:mirror.example.org")
+        self.assertEqual(device_key("/"), "device:%d" % os.stat("/").st_dev)
+        self.assertIsNone(device_key("/nonexistent/mirror"))
+        self.assertEqual(group_keys("isos debian"), ["group:isos", "group:debian"])
+        self.assertEqual(parse_grouplimits("isos=1 debian=2"), {"isos": 1, "debian": 2})
+        self.assertRaises(ValueError, parse_grouplimits, "isos")
+        self.assertRaises(ValueError, parse_grouplimits, "isos=x")
+
+    def test_limits(self):
+        semaphores = KeyedSemaphores(hostlimit = 2, grouplimits = {"isos": 1})
+        host       = host_key("mirror.aarnet.edu.au")
+        semaphores.acquire("archlinux", [host, "device:1"])
+        self.assertIsNone(semaphores.check([host, "device:1", "group:isos"]))
+        semaphores.acquire("ubuntu", [host, "device:1", "group:isos"])
+        self.assertEqual(semaphores.check(["device:1", host]), host)
+        self.assertEqual(semaphores.check(["group:isos"]), "group:isos")
+        self.assertIsNone(semaphores.check(["group:debian"]))
+        self.assertEqual(semaphores.running, 2)
+
+        # acquired again, e.g. failover, it is not counted twice
+        semaphores.acquire("ubuntu", [host])
+        self.assertEqual(semaphores.running, 2)
+        self.assertIsNone(semaphores.check(["group:isos"]))
+
+        self.assertTrue(semaphores.release("ubuntu"))
+        self.assertFalse(semaphores.release("ubuntu"))
+        self.assertIsNone(semaphores.check([host]))
+        self.assertEqual(semaphores.get_state(), {host: 1, "device:1": 1})
+        semaphores.release("archlinux")
+        self.assertEqual(semaphores.get_state(), {})
+        self.assertEqual(semaphores.running, 0)
+
+if __name__ == '__main__':
+    unittest.main()
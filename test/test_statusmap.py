@@ -0,0 +1,69 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mirror.error     import MirrorError
+from mirror.statusmap import StatusWriter, read_status
+from mirror.statusmap import STATE_QUEUED, STATE_RUNNING
+
+class StatusMapTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path   = os.path.join(self.tmpdir, "mirrord")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_statusmap(self):
+        writer = StatusWriter(self.path)
+        writer.update({"archlinux": (1, STATE_QUEUED, 2, 1376701200, 0),
+                       "ubuntu":    (2, STATE_RUNNING, 10, 1376704800, 4242)})
+        self.assertEqual(sorted(read_status(self.path)),
+                         [("archlinux", 1, STATE_QUEUED, 2, 1376701200, 0),
+                          ("ubuntu", 2, STATE_RUNNING, 10, 1376704800, 4242)])
+
+        sequence = writer.sequence
+        writer.update({"archlinux": (1, STATE_QUEUED, 2, 1376701200, 0)})
+        self.assertEqual(writer.sequence, sequence)
+
+        writer.update({"archlinux": None})
+        self.assertEqual(read_status(self.path),
+                         [("ubuntu", 2, STATE_RUNNING, 10, 1376704800, 4242)])
+
+        # more tasks than slots, the file is created again
+        records = dict(("task%d" % i, (1, STATE_QUEUED, 5, i, 0)) for i in range(200))
+        writer.update(records)
+        self.assertEqual(len(read_status(self.path)), 201)
+
+        writer.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_wrong_file(self):
+        with open(self.path, "wb") as fp:
+            fp.write(b"\x80\x03" + b"\x00" * 100)
+        self.assertRaises(MirrorError, read_status, self.path)
+
+if __name__ == '__main__':
+    unittest.main()
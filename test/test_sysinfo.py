@@ -0,0 +1,125 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+import os
+import socket
+import tempfile
+import unittest
+
+from mirror.sysinfo import proc_tcpconn, netlink_tcpconn
+from mirror.sysinfo import pressure, DiskUtilization, NetRate
+
+PROC_NET_TCP = """\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000:0050 00000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 1001 1 0000000000000000 100 0 0 10 0
+   1: 0100007F:0050 0100007F:C350 01 00000000:00000000 00:00000000 00000000    33        0 1002 1 0000000000000000 20 4 30 10 -1
+   2: 0100007F:C350 0100007F:0050 01 00000000:00000000 00:00000000 00000000  1000        0 1003 1 0000000000000000 20 4 30 10 -1
+   3: 0100007F:0050 0100007F:C351 06 00000000:00000000 00:00000000 00000000    33        0 1004 1 0000000000000000 20 4 30 10 -1
+   4: 0200007F:0050 0100007F:C352 01 00000000:00000000 00:00000000 00000000    33        0 1005 1 0000000000000000 20 4 30 10 -1
+"""
+
+PRESSURE_IO = """\
+some avg10=12.50 avg60=3.10 avg300=0.90 total=123456
+full avg10=8.00 avg60=2.00 avg300=0.50 total=65432
+"""
+
+DISKSTATS = """\
+   8       0 sda 6797 3850 1175986 5016 4296 2830 349736 1559 0 %d 6660 0 0 0 0
+   8       1 sda1 6000 3000 1000000 4000 4000 2000 300000 1000 0 900 5000 0 0 0 0
+"""
+
+NET_DEV = """\
+Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo: %d 10 0 0 0 0 0 0 %d 10 0 0 0 0 0 0
+  eth0: %d 10 0 0 0 0 0 0 %d 10 0 0 0 0 0 0
+"""
+
+class SysInfoTestCase(unittest.TestCase):
+
+    def write(self, content):
+        with open(self.path, "w") as fp:
+            fp.write(content)
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_pressure(self):
+        self.write(PRESSURE_IO)
+        directory, resource = os.path.split(self.path)
+        self.assertEqual(pressure(resource, path = directory), 12.5)
+        self.assertEqual(pressure(resource, b"avg300", path = directory), 0.9)
+        self.assertEqual(pressure("missing", path = directory), 0.0)
+
+    def test_diskstats(self):
+        disk = DiskUtilization((8, 0), self.path)
+        self.write(DISKSTATS % 1000)
+        self.assertEqual(disk(), 0.0)
+        # 500ms busy in 1s
+        disk.last = (disk.last[0] - 1.0, disk.last[1])
+        self.write(DISKSTATS % 1500)
+        self.assertAlmostEqual(disk(), 50.0, delta = 1.0)
+        self.assertEqual(DiskUtilization((9, 0), self.path).read_ticks(), None)
+
+    def test_netdev(self):
+        net = NetRate(path = self.path)
+        self.write(NET_DEV % (0, 0, 1000, 2000))
+        self.assertEqual(net(), 0.0)
+        net.last = (net.last[0] - 2.0,) + net.last[1:]
+        self.write(NET_DEV % (10 ** 9, 10 ** 9, 5000, 4000))
+        # lo is not counted, eth0 received 4000 bytes in 2s
+        self.assertAlmostEqual(net(), 2000.0, delta = 10.0)
+        self.assertEqual(NetRate(["lo"], self.path).read_bytes(), (10 ** 9, 10 ** 9))
+
+    def test_proc_tcpconn(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, PROC_NET_TCP.encode())
+            os.close(fd)
+            self.assertEqual(proc_tcpconn(80, (path,)), 2)
+            self.assertEqual(proc_tcpconn(50000, (path,)), 1)
+        finally:
+            os.unlink(path)
+
+    def test_netlink_tcpconn(self):
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(5)
+        port = server.getsockname()[1]
+        try:
+            try:
+                before = netlink_tcpconn(port)
+            except Exception as e:
+                self.skipTest("netlink is not available: %s" % e)
+            clients  = [socket.create_connection(("127.0.0.1", port)) for i in range(3)]
+            accepted = [server.accept()[0] for i in range(3)]
+            self.assertEqual(netlink_tcpconn(port) - before, 3)
+            self.assertEqual(netlink_tcpconn(port), proc_tcpconn(port))
+            for sock in clients + accepted:
+                sock.close()
+        finally:
+            server.close()
+
+if __name__ == '__main__':
+    unittest.main()
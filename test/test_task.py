@@ -45,5 +45,74 @@ class TaskTestCase(unittest.TestCase):
         self.assertEqual(time.ctime(task.get_schedule_time(since)),
                          'Sat Jul 20 10:00:00 2013')
 
+    def test_shards(self):
+        config = {
+                 'upstream[]': ['mirror.bjtu.edu.cn'],
+                 'command': 'rsync',
+                 'time':  '* */2 * * *',
+                 'rsyncdir': 'debian/',
+                 'localdir': '/tmp/mirror/debian',
+                 'twostage': '0',
+                 'timeout': '2h',
+                 'priority': '2',
+                 'shards': '3',
+                 'shardroot': 'pool/main/',
+                 }
+        task   = Task('debian', None, **config)
+        shards, final = task.get_stages()
+        filters = [task.get_args(shards, i)[-3] for i in range(3)]
+        self.assertEqual(filters, ['--exclude=/*', '--exclude=/*',
+                                   '--exclude=/[0369cCfFiIlLoOrRuUxX147aAdDgGjJmMpPsSvVyY]*'])
+        self.assertNotIn('--delete', task.get_args(shards, 0))
+        self.assertEqual(task.get_args(shards, 0)[-2:], ['mirror.bjtu.edu.cn::debian/pool/main/',
+                                                         '/tmp/mirror/debian/pool/main'])
+        # the final pass
+        self.assertIn('--delete-after', task.get_args(final))
+        self.assertEqual(task.get_args(final)[-2:], ['mirror.bjtu.edu.cn::debian/',
+                                                     '/tmp/mirror/debian'])
+
+        config['shards'] = 'dists pool/'
+        del config['shardroot']
+        task   = Task('debian', None, **config)
+        self.assertEqual(task.get_args(task.get_stages()[0], 1)[-2:],
+                         ['mirror.bjtu.edu.cn::debian/pool/', '/tmp/mirror/debian/pool'])
+
+    def test_stages(self):
+        config = {
+                 'upstream[]': ['mirror.bjtu.edu.cn'],
+                 'command': 'rsync',
+                 'time':  '* */2 * * *',
+                 'rsyncdir': 'ubuntu/',
+                 'localdir': '/tmp/mirror/ubuntu',
+                 'timeout': '2h',
+                 'priority': '2',
+                 'stages': 'pool dists',
+                 'pool.path': 'pool',
+                 'pool.args': '--recursive --times',
+                 'pool.timeout': '1h',
+                 'dists.exclude': '--exclude /pool/',
+                 }
+        task   = Task('ubuntu', None, **config)
+        pool, dists = task.get_stages()
+        self.assertEqual(task.get_args(pool), ['rsync', '--recursive', '--times',
+                                               'mirror.bjtu.edu.cn::ubuntu/pool/',
+                                               '/tmp/mirror/ubuntu/pool'])
+        self.assertEqual(pool.timeout, 3600)
+        self.assertEqual(dists.after, (0, ))
+        self.assertEqual(task.get_args(dists)[-4:], ['--exclude', '/pool/',
+                                                     'mirror.bjtu.edu.cn::ubuntu/',
+                                                     '/tmp/mirror/ubuntu'])
+
+        # twostage is a pipeline of two stages
+        config = dict(config, twostage = '1', firststage = 'pool')
+        del config['stages']
+        task   = Task('ubuntu', None, **config)
+        first, second = task.get_stages()
+        self.assertEqual(task.get_args(first)[-2:], ['mirror.bjtu.edu.cn::ubuntu/pool/',
+                                                     '/tmp/mirror/ubuntu/pool'])
+        self.assertEqual(task.get_args(second)[-5:], ['--delete-after', '--exclude', '/pool/',
+                                                      'mirror.bjtu.edu.cn::ubuntu/',
+                                                      '/tmp/mirror/ubuntu'])
+
 if __name__ == '__main__':
     unittest.main()
@@ -24,6 +24,7 @@ import unittest
 
 from mirror.queue import TaskInfo
 from mirror.queue import Queue
+from mirror.queue import DeferredQueue
 
 class TaskQueueTestCase(unittest.TestCase):
 
@@ -42,5 +43,81 @@ class TaskQueueTestCase(unittest.TestCase):
         self.assertEqual(task.name, "Basketball")
         self.assertEqual(task.time, 1376701200)
 
+    def test_remove_and_update(self):
+        tasks = [TaskInfo("task%d" % i, 1, 1376701200 + (i * 7919) % 1000, i % 3)
+                 for i in range(100)]
+        queue = Queue(*tasks)
+        self.assertTrue("task42" in queue)
+        self.assertTrue(tasks[42] in queue)
+
+        queue.remove(tasks[42])
+        self.assertFalse("task42" in queue)
+        self.assertEqual(queue.find("task42"), None)
+        self.assertRaises(ValueError, queue.remove, tasks[42])
+
+        tasks[7].time = 0
+        queue.update(tasks[7])
+        self.assertEqual(queue[0].name, "task7")
+        self.assertEqual(queue["task7"], tasks[7])
+
+        # an equal but distinct item replaces the queued one
+        copy = TaskInfo("task9", 1, 1, 0)
+        queue.update(copy)
+        self.assertIs(queue.find("task9"), copy)
+        self.assertEqual(queue[1].time, 1)
+        copy.time = tasks[9].time
+        queue.update(copy)
+        tasks[9] = copy
+
+        timeout = TaskInfo("task7", 2, 1, 1)
+        queue.put(timeout)
+        self.assertEqual(queue.find("task7", 2), timeout)
+        self.assertEqual(queue.find("task7"), tasks[7])
+        # the fallback of update() and remove() matches tasktype too
+        self.assertRaises(ValueError, queue.update, TaskInfo("task8", 2, 0, 0))
+        self.assertRaises(ValueError, queue.remove, TaskInfo("task8", 2, 0, 0))
+        other = TaskInfo("task7", 2, 1, 1)
+        queue.update(other)
+        self.assertIs(queue.find("task7", 2), other)
+        self.assertIs(queue.find("task7", 1), tasks[7])
+        timeout = other
+        self.assertIs(queue[-1], list(queue)[-1])
+        self.assertIs(queue[5], list(queue)[5])
+        self.assertIsNone(queue[len(queue)])
+
+        expected = sorted([task for task in tasks if task.name != "task42"] + [timeout],
+                          key = lambda task: (task.time, task.priority))
+        self.assertEqual([task.name for task in queue],
+                         [task.name for task in expected])
+        self.assertEqual([queue.get().name for task in expected],
+                         [task.name for task in expected])
+        self.assertTrue(queue.empty())
+
+    def test_stable_order(self):
+        tasks = [TaskInfo("task%d" % i, 1, 1376701200, 2) for i in range(10)]
+        queue = Queue(*tasks)
+        self.assertEqual([task.name for task in queue],
+                         ["task%d" % i for i in range(10)])
+
+    def test_deferred(self):
+        deferred = DeferredQueue()
+        self.assertIsNone(deferred.next_retry())
+        late   = deferred.put(TaskInfo("late",   1, 0, 2), 200)
+        early  = deferred.put(TaskInfo("early",  1, 0, 2), 100)
+        urgent = deferred.put(TaskInfo("urgent", 1, 0, 1), 300)
+        # deferred again, the first time is kept
+        self.assertIs(deferred.put(TaskInfo("late", 1, 0, 2), 400), late)
+        self.assertEqual(len(deferred), 3)
+        self.assertEqual([item.taskinfo.name for item in deferred],
+                         ["urgent", "early", "late"])
+
+        late.retry = 50
+        self.assertEqual(deferred.next_retry(), 50)
+        self.assertIs(deferred.remove("late"), late)
+        self.assertIsNone(deferred.remove("late"))
+        self.assertFalse("late" in deferred)
+        self.assertIs(deferred.find("early"), early)
+        self.assertEqual(deferred.next_retry(), 100)
+
 if __name__ == '__main__':
     unittest.main()
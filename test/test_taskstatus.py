@@ -0,0 +1,151 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import importlib.util
+
+import mirror.component as component
+from mirror.component    import Component
+from mirror.eventmanager import EventManager
+from mirror.event        import TaskStartEvent
+from collections         import OrderedDict as odict
+
+PLUGIN = os.path.join(os.path.dirname(__file__), os.pardir, "mirror", "plugins",
+                      "TaskStatus", "mirror", "plugins", "taskstatus", "plugin.py")
+
+def load_plugin_class():
+    spec   = importlib.util.spec_from_file_location("taskstatus_plugin", PLUGIN)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Plugin
+
+class FakePluginManager(Component):
+    def __init__(self, config):
+        super(FakePluginManager, self).__init__("PluginManager")
+        self.config = config
+
+class FakeTask(object):
+    isinternal = False
+
+class FakeQueue(object):
+    def find(self, taskname):
+        return None
+
+class FakeScheduler(Component):
+    def __init__(self, tasknames):
+        super(FakeScheduler, self).__init__("Scheduler")
+        self.tasks  = dict((name, FakeTask()) for name in tasknames)
+        self.config = dict((name, {}) for name in tasknames)
+        self.queue  = FakeQueue()
+
+class TaskStatusTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory   = tempfile.mkdtemp()
+        self.status_file = os.path.join(self.directory, "task_status.json")
+        self.components  = [
+            EventManager(),
+            FakePluginManager({ "taskstatus": { "status_file": self.status_file,
+                                                "flush_delay": "0.2" } }),
+            FakeScheduler(["archlinux", "debian"]),
+        ]
+        self.plugin  = load_plugin_class()("taskstatus")
+        self.flushes = 0
+        flush = self.plugin.flush
+        def counted():
+            self.flushes += 1
+            flush()
+        self.plugin.flush = counted
+        self.plugin.enable()
+
+    def tearDown(self):
+        self.plugin.disable()
+        component.deregister(self.plugin)
+        for obj in self.components:
+            component.deregister(obj)
+        shutil.rmtree(self.directory)
+
+    def start(self, *tasknames):
+        event_manager = component.get("EventManager")
+        for taskname in tasknames:
+            event_manager.emit(TaskStartEvent(taskname, 1))
+        self.assertTrue(event_manager.drain(5))
+
+    def read(self):
+        with open(self.status_file) as fp:
+            return json.load(fp)
+
+    def wait_flushed(self, count):
+        deadline = time.monotonic() + 5
+        while self.flushes < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.flushes, count)
+
+    def test_debounce(self):
+        self.start("archlinux", "debian")
+        # written later, together
+        self.assertFalse(os.path.exists(self.status_file))
+        self.wait_flushed(1)
+        status = self.read()
+        self.assertEqual(sorted(status), ["archlinux", "debian"])
+        self.assertEqual(status["debian"]["status"], self.plugin.STATUS_RUNNING)
+        time.sleep(0.3)
+        self.assertEqual(self.flushes, 1)
+        self.assertIsNone(self.plugin.timer)
+
+    def test_atomic_and_unchanged(self):
+        self.start("archlinux")
+        self.wait_flushed(1)
+        inode = os.stat(self.status_file).st_ino
+
+        # nothing changed, the file is not written again
+        self.plugin.flush()
+        self.assertEqual(os.stat(self.status_file).st_ino, inode)
+
+        # a reader of the old file never sees a partly written one
+        with open(self.status_file) as reader:
+            self.start("debian")
+            self.wait_flushed(3)
+            self.assertEqual(sorted(json.load(reader)), ["archlinux"])
+        self.assertNotEqual(os.stat(self.status_file).st_ino, inode)
+        self.assertEqual(sorted(self.read()), ["archlinux", "debian"])
+        self.assertEqual(os.listdir(self.directory), ["task_status.json"])
+
+    def test_encoded(self):
+        self.start("archlinux", "debian")
+        self.wait_flushed(1)
+        self.assertEqual(sorted(self.plugin.encoded), ["archlinux", "debian"])
+        cached = self.plugin.encoded["debian"]
+
+        # only the changed task is encoded again
+        self.start("archlinux")
+        self.assertEqual(sorted(self.plugin.encoded), ["debian"])
+        self.assertIs(self.plugin.encoded["debian"], cached)
+        with self.plugin.lock:
+            content = self.plugin.encode()
+            expected = json.dumps(odict(sorted(self.plugin.task_status.items())), indent = 2)
+        self.assertEqual(content, expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# mirror is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mirror. If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#
+
+import time
+import socket
+import unittest
+
+from mirror.task     import Task
+from mirror.upstream import UpstreamSelector, parse_upstream, rsync_source, probe
+
+def closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+class UpstreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # stands in for a local `rsync --daemon`
+        self.daemon = socket.socket()
+        self.daemon.bind(("127.0.0.1", 0))
+        self.daemon.listen(8)
+        self.alive  = "rsync://127.0.0.1:%d" % self.daemon.getsockname()[1]
+        self.dead   = "127.0.0.1:%d" % closed_port()
+
+    def tearDown(self):
+        self.daemon.close()
+
+    def test_parse(self):
+        self.assertEqual(parse_upstream("mirror.example.org"), ("mirror.example.org", 873))
+        self.assertEqual(parse_upstream("mirror.example.org:8873"), ("mirror.example.org", 8873))
+        self.assertEqual(parse_upstream("rsync://[::1]:8873/pub"), ("::1", 8873))
+        self.assertEqual(parse_upstream("::1"), ("::1", 873))
+        self.assertEqual(rsync_source("mirror.example.org", "archlinux/"),
+                         "mirror.example.org::archlinux/")
+        self.assertEqual(rsync_source("mirror.example.org:8873", "archlinux/"),
+                         "rsync://mirror.example.org:8873/archlinux/")
+        self.assertEqual(rsync_source("rsync://mirror.example.org/", "archlinux/"),
+                         "rsync://mirror.example.org/archlinux/")
+
+    def test_probe(self):
+        results = probe([self.dead, self.alive], 2)
+        self.assertIsNone(results[self.dead])
+        self.assertIsNotNone(results[self.alive])
+
+    def test_rank(self):
+        selector = UpstreamSelector(ttl = 60, timeout = 2)
+        self.assertEqual(selector.rank([self.dead, self.alive], now = 0),
+                         [self.alive, self.dead])
+        # cached until the result expires
+        selector.mark_failed(self.alive, now = 0)
+        self.assertEqual(selector.rank([self.alive, self.dead], now = 30),
+                         [self.alive, self.dead])
+        self.assertIsNone(selector.get_latency(self.alive))
+        self.assertEqual(selector.rank([self.dead, self.alive], now = 60),
+                         [self.alive, self.dead])
+        self.assertIsNotNone(selector.get_latency(self.alive))
+
+    def test_prober(self):
+        selector = UpstreamSelector(ttl = 60, timeout = 2)
+        selector.start()
+        try:
+            # nothing is probed yet, the configured order is kept
+            self.assertEqual(selector.rank([self.dead, self.alive]),
+                             [self.dead, self.alive])
+            deadline = time.monotonic() + 5
+            while (self.alive not in selector.scores and
+                   time.monotonic() < deadline):
+                time.sleep(0.05)
+            self.assertEqual(selector.rank([self.dead, self.alive]),
+                             [self.alive, self.dead])
+        finally:
+            selector.stop()
+        self.assertIsNone(selector.thread)
+
+    def test_failover(self):
+        config = {
+                 'upstream[]': [self.dead, self.alive],
+                 'command': 'rsync',
+                 'time':  '* */2 * * *',
+                 'rsyncdir': 'archlinux/',
+                 'localdir': '/tmp/mirror/archlinux',
+                 'twostage': '0',
+                 'timeout': '2h',
+                 'priority': '2',
+                 }
+        task = Task('archlinux', None, **config)
+        self.assertEqual(task.get_upstream(), self.dead)
+        task.select_upstream(UpstreamSelector(timeout = 0))
+        self.assertEqual(task.get_upstream(), self.dead)
+        self.assertTrue(task.next_upstream())
+        self.assertEqual(task.get_args()[-2], self.alive + "/archlinux/")
+        self.assertFalse(task.next_upstream())
+        task.select_upstream(UpstreamSelector(timeout = 2))
+        self.assertEqual(task.get_upstream(), self.alive)
+        # busy upstreams are the last resort
+        task.select_upstream(UpstreamSelector(timeout = 0), busy = [self.dead])
+        self.assertEqual(task.get_upstream(), self.alive)
+
+if __name__ == '__main__':
+    unittest.main()